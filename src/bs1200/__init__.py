@@ -1,4 +1,25 @@
-from .driver import BS1200
-from .configuration import ConfigTools
-from .cfg_tools import CAN_Settings, Ethernet_Settings, Protocol
+import importlib
 
+#public names and the submodules defining them, imported on first access so that
+#`import bs1200` does not load python-can, nisyscfg, paramiko or scp
+_lazy_attrs = {
+    'BS1200': '.driver',
+    'BS1200Fleet': '.fleet',
+    'ConfigTools': '.configuration',
+    'CAN_Settings': '.cfg_tools',
+    'Ethernet_Settings': '.cfg_tools',
+    'Protocol': '.cfg_tools',
+}
+
+__all__ = list(_lazy_attrs)
+
+def __getattr__(name: str):
+    module = _lazy_attrs.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value #later lookups skip __getattr__
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
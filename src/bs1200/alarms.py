@@ -0,0 +1,149 @@
+import threading
+from collections import deque, namedtuple
+import bs1200.can_frames as ff
+from bs1200.rx_cache import FRAME_SIZE
+
+#(readback base ID, index in the frame's decoded values) of every channel, per signal name:
+#'V', 'I' (cells 1-12), 'AI' (1-8), 'T' (sensors 1-3), 'fan' (status byte, 16 without fault), 'DIO'
+_CHANNELS = {}
+for _base in ff.base_rx_arbids:
+    for _index, _name in enumerate(ff.rx_codecs[_base].names):
+        _CHANNELS.setdefault(_name, []).append((_base, _index))
+
+"""
+Alarm transition reported by an AlarmRule: `active` is True when `channel` of `signal` on `boxid`
+left the rule's window, False when it returned. `value` is the engineering value of the frame
+received at `timestamp` that caused the transition.
+"""
+Alarm = namedtuple('Alarm', ['boxid', 'signal', 'channel', 'active', 'value', 'timestamp'])
+
+class AlarmRule(object):
+    """
+    Limit rule on the `channels` (1-based, all by default) of one readback `signal` of `boxid`.
+    A channel is in alarm while its value is below `low` or above `high` (either may be None),
+    and clears once it is back inside the window by `deadband`. A fan fault is the rule
+    ('fan', low=16, high=16). On every transition the Alarm is appended to `events`,
+    `callback(alarm)` is called if given, and `event` is set while any channel is in alarm.
+    """
+    def __init__(self, boxid: int, signal: str, low: float = None, high: float = None, channels: list = None,
+                 deadband: float = 0.0, callback = None, max_events: int = 1000):
+        if signal not in _CHANNELS:
+            raise ValueError('Invalid readback signal: %s' % signal)
+        if low is None and high is None:
+            raise ValueError('An alarm rule needs a low or high limit')
+        count = len(_CHANNELS[signal])
+        channels = list(range(1, count+1)) if channels is None else list(channels)
+        for ch in channels:
+            if ch not in range(1, count+1):
+                raise IndexError('Invalid %s channel: %d' % (signal, ch))
+        self.boxid = boxid
+        self.signal = signal
+        self.low = low
+        self.high = high
+        self.channels = channels
+        self.deadband = deadband
+        self.callback = callback
+        self.active = set()
+        self.event = threading.Event()
+        self.events = deque(maxlen=max_events)
+        self.error = None
+
+    def frames(self) -> dict:
+        """
+        Returns {base ID: ((index in the decoded frame, channel), ...)} of the frames holding the rule's channels
+        """
+        frames = {}
+        for ch in self.channels:
+            base, index = _CHANNELS[self.signal][ch-1]
+            frames[base] = frames.get(base, ()) + ((index, ch),)
+        return frames
+
+    def evaluate(self, values: tuple, pairs: tuple, timestamp: float):
+        """
+        Check the channels `pairs` (index in `values`, channel) of a decoded frame against the window
+        """
+        low, high = self.low, self.high
+        for index, ch in pairs:
+            value = values[index]
+            if ch in self.active:
+                if ((low is None or value >= low + self.deadband) and
+                        (high is None or value <= high - self.deadband)):
+                    self.active.discard(ch)
+                    self._fire(Alarm(self.boxid, self.signal, ch, False, value, timestamp))
+            elif (low is not None and value < low) or (high is not None and value > high):
+                self.active.add(ch)
+                self._fire(Alarm(self.boxid, self.signal, ch, True, value, timestamp))
+
+    def _fire(self, alarm: Alarm):
+        self.events.append(alarm)
+        if self.active:
+            self.event.set()
+        else:
+            self.event.clear()
+        if self.callback is not None:
+            try:
+                self.callback(alarm)
+            except Exception as e:
+                self.error = e
+
+class AlarmMonitor(object):
+    """
+    Evaluates AlarmRules in the receive path of a RxCache: on_frame() runs as a RxCache hook on the
+    readback frames used by at least one rule, decodes the stored frame once and checks only the
+    rules and channels held by that frame. Callbacks run on the receive thread and must return quickly.
+    """
+    def __init__(self, rx_cache):
+        self.rx_cache = rx_cache
+        self.rules = []
+        #per slot (codec, ((rule, pairs), ...)), replaced (never mutated) when rules change
+        self._table = len(rx_cache.timestamps)*[None]
+        self._lock = threading.Lock()
+
+    def add(self, rule: AlarmRule) -> AlarmRule:
+        if rule.boxid not in self.rx_cache.box_ids:
+            raise IndexError('Box ID %d is not configured' % rule.boxid)
+        with self._lock:
+            arb_ids = []
+            for base, pairs in rule.frames().items():
+                arb_id = base + rule.boxid
+                slot = self.rx_cache.slot(arb_id)
+                entry = self._table[slot]
+                if entry is None:
+                    arb_ids.append(arb_id)
+                    entry = (ff.rx_codecs[base], ())
+                self._table[slot] = (entry[0], entry[1] + ((rule, pairs),))
+            self.rules.append(rule)
+            self.rx_cache.add_hook(arb_ids, self.on_frame)
+        return rule
+
+    def remove(self, rule: AlarmRule):
+        with self._lock:
+            arb_ids = []
+            for base in rule.frames():
+                arb_id = base + rule.boxid
+                slot = self.rx_cache.slot(arb_id)
+                codec, entries = self._table[slot]
+                entries = tuple(e for e in entries if e[0] is not rule)
+                self._table[slot] = (codec, entries) if entries else None
+                if not entries:
+                    arb_ids.append(arb_id)
+            self.rules.remove(rule)
+            self.rx_cache.remove_hook(arb_ids, self.on_frame)
+
+    def on_frame(self, arb_id: int, slot: int, timestamp: float):
+        """
+        RxCache hook, checks the rules on the channels of the stored frame
+        """
+        entry = self._table[slot]
+        if entry is None:
+            return
+        codec, entries = entry
+        values = codec.decode(self.rx_cache.data, slot*FRAME_SIZE)
+        for rule, pairs in entries:
+            rule.evaluate(values, pairs, timestamp)
+
+    def active(self) -> list:
+        """
+        Returns (boxid, signal, channel) of every channel currently in alarm
+        """
+        return sorted((rule.boxid, rule.signal, ch) for rule in list(self.rules) for ch in rule.active)
@@ -0,0 +1,89 @@
+import numpy as np
+import can
+import bs1200.can_frames as ff
+
+_I_LAYOUT = ff.channel_layout('I')
+
+class BatteryModel(object):
+    """
+    Vectorized equivalent circuit model of 12 cells for each of `box_ids`:
+    state of charge integrated from the cell current, open circuit voltage interpolated from
+    the (`ocv_soc`, `ocv_v`) lookup table, and a series resistance `r_series` in Ohms.
+    `capacity_ah`, `r_series` and `soc` may be scalars or arrays broadcast to (boxes, 12).
+    Positive currents discharge the cells.
+    """
+    def __init__(self, box_ids: list, capacity_ah, ocv_soc, ocv_v, r_series = 0.0, soc = 1.0):
+        self.box_ids = list(box_ids)
+        shape = (len(self.box_ids), 12)
+        self.ocv_soc = np.asarray(ocv_soc, dtype=float)
+        self.ocv_v = np.asarray(ocv_v, dtype=float)
+        if self.ocv_soc.shape != self.ocv_v.shape or np.any(np.diff(self.ocv_soc) <= 0):
+            raise ValueError('OCV table needs matching SOC and voltage arrays with increasing SOC')
+        self.capacity_as = np.broadcast_to(np.asarray(capacity_ah, dtype=float)*3600, shape).copy()
+        self.r_series = np.broadcast_to(np.asarray(r_series, dtype=float), shape).copy()
+        self.soc = np.broadcast_to(np.asarray(soc, dtype=float), shape).copy()
+        self.current = np.zeros(shape)
+        self.voltage = self.ocv(self.soc)
+        self.rows = {box: row for row, box in enumerate(self.box_ids)}
+
+    def ocv(self, soc: np.ndarray) -> np.ndarray:
+        """
+        Open circuit voltage of the cells at `soc`
+        """
+        return np.interp(soc, self.ocv_soc, self.ocv_v)
+
+    def step(self, rows, currents: np.ndarray, dt) -> np.ndarray:
+        """
+        Integrate `currents` (A) over `dt` seconds for the boxes at `rows`,
+        returns the updated terminal voltages of those rows
+        """
+        self.current[rows] = currents
+        soc = self.soc[rows] - currents*dt/self.capacity_as[rows]
+        np.minimum(np.maximum(soc, 0.0, out=soc), 1.0, out=soc)
+        self.soc[rows] = soc
+        volts = self.ocv(soc) - currents*self.r_series[rows]
+        np.minimum(np.maximum(volts, 0.0, out=volts), 5.0, out=volts)
+        self.voltage[rows] = volts
+        return volts
+
+class BatteryEngine(object):
+    """
+    Runs a BatteryModel in the receive path. Attach on_frame() as a RxCache hook on the
+    cell current readbacks: when the last current frame of a box arrives, the box's 12 currents
+    are decoded straight from the cache, the model is stepped by the time since the box's previous
+    update and the new cell voltages are sent with the three 4-cell setpoint frames.
+    """
+    def __init__(self, bus: can.BusABC, rx_cache, model: BatteryModel):
+        self.bus = bus
+        self.model = model
+        self.updates = 0
+        self.error = None
+        self.arb_ids = [base+box for box in model.box_ids for base in _I_LAYOUT.bases]
+        last = _I_LAYOUT.bases[-1]
+        first = ff.base_rx_arbids.index(_I_LAYOUT.bases[0])
+        #per slot (box, model row, raw current view), None for slots that do not trigger an update
+        self._targets = len(rx_cache.timestamps)*[None]
+        for row, box in enumerate(model.box_ids):
+            raw = rx_cache.words[rx_cache.rows([box])[0], first:first+len(_I_LAYOUT.bases)].reshape(-1)
+            self._targets[rx_cache.slot(last+box)] = (box, row, raw)
+        self._last_update = len(model.box_ids)*[None]
+
+    def on_frame(self, arb_id: int, slot: int, timestamp: float):
+        """
+        RxCache hook, steps the model of the box whose current readbacks are complete
+        """
+        target = self._targets[slot]
+        if target is None:
+            return
+        box, row, raw = target
+        previous = self._last_update[row]
+        self._last_update[row] = timestamp
+        if previous is None: #first frame only sets the time base
+            return
+        volts = self.model.step(row, raw*_I_LAYOUT.scale + _I_LAYOUT.offset, timestamp - previous).tolist()
+        try:
+            for i, template in enumerate(ff.cell_V_frames):
+                self.bus.send(template.build(box, *volts[4*i:4*i+4]))
+            self.updates += 1
+        except can.CanError as e:
+            self.error = e
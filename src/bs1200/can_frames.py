@@ -1,4 +1,5 @@
-from struct import pack
+from collections import namedtuple
+from struct import Struct, calcsize
 from can import Message
 
 base_rx_arbids = [256, 288, 304, 320, 384, 400, 416, 640, 672, 688]
@@ -8,13 +9,276 @@ def init_frame_dict(boxids: list) -> dict:
     return {id: None for 
             id in [id+box for id in base_rx_arbids for box in boxids]}
 
+def acceptance_filters(boxids: list) -> list:
+    """
+    Returns python-can filters accepting exactly the readback frames of `boxids` (plus Box ID 0,
+    which is never assigned, when all 15 boxes are listed). The arbitration IDs are covered 
+    by the fewest aligned power of two blocks, each block being one (can_id, can_mask) filter.
+    """
+    ids = set(base+box for base in base_rx_arbids for box in boxids)
+    if set(range(1, 16)) <= set(boxids):
+        ids.update(base_rx_arbids)
+    filters = []
+    arb_id = 0
+    while arb_id < 2048:
+        if arb_id not in ids:
+            arb_id += 1
+            continue
+        size = 1
+        while (arb_id % (2*size) == 0 and arb_id + 2*size <= 2048 and 
+               all(i in ids for i in range(arb_id + size, arb_id + 2*size))):
+            size *= 2
+        filters.append({'can_id': arb_id, 'can_mask': 0x7FF & ~(size-1), 'extended': False})
+        arb_id += size
+    return filters
+
+"""
+Signal table for every BS1200 frame, keyed by the name of the frame's builder function:
+    (base arbitration ID, DLC, ((signal, byte offset, struct type, scale, offset), ...))
+A struct type with a count ('4H') holds that many consecutive channels of the signal.
+Engineering value = raw value * scale + offset, so channel indices are stored with offset 1.
+"""
+frame_table = {
+    #transmit frames
+    'hil_mode_trig':                (128,  1, (('enable', 0, '?', 1, 0),)),
+    'cell_V_set_1_4':               (160,  8, (('V', 0, '4e', 1, 0),)),
+    'cell_V_set_5_8':               (176,  8, (('V', 0, '4e', 1, 0),)),
+    'cell_V_set_9_12':              (192,  8, (('V', 0, '4e', 1, 0),)),
+    'dio_set_1_8':                  (512,  2, (('enable_bits', 0, 'B', 1, 0), ('direction_bits', 1, 'B', 1, 0))),
+    'ao_set_1_2':                   (544,  8, (('AO', 0, '2H', 0.0001, 0),)),
+    'config':                       (1024, 3, (('config_bytes', 0, '3B', 1, 0),)),
+    'cell_current_set_all':         (1152, 4, (('I_sink', 0, 'H', 0.0001, 0), ('I_source', 2, 'H', 0.0001, 0))),
+    'cell_current_sink_setpoint':   (1184, 3, (('channel', 0, 'B', 1, 1), ('I_sink', 1, 'H', 0.0001, 0))),
+    'cell_current_source_setpoint': (1200, 3, (('channel', 0, 'B', 1, 1), ('I_source', 1, 'H', 0.0001, 0))),
+    'cell_voltage_set_all':         (1280, 2, (('V', 0, 'H', 0.0001, 0),)),
+    'cell_voltage_setpoint':        (1296, 3, (('channel', 0, 'B', 1, 1), ('V', 1, 'H', 0.0001, 0))),
+    'cell_enable_all':              (1344, 1, (('enable', 0, '?', 1, 0),)),
+    'cell_enable':                  (1360, 2, (('channel', 0, 'B', 1, 1), ('enable', 1, '?', 1, 0))),
+    #readback frames
+    'status':                       (256,  4, (('fan', 0, 'B', 1, 0), ('T', 1, '3B', 1, 0))),
+    'cell_V_get_1_4':               (288,  8, (('V', 0, '4H', 0.0001, 0),)),
+    'cell_V_get_5_8':               (304,  8, (('V', 0, '4H', 0.0001, 0),)),
+    'cell_V_get_9_12':              (320,  8, (('V', 0, '4H', 0.0001, 0),)),
+    'cell_I_get_1_4':               (384,  8, (('I', 0, '4H', 0.0001, -3.2768),)),
+    'cell_I_get_5_8':               (400,  8, (('I', 0, '4H', 0.0001, -3.2768),)),
+    'cell_I_get_9_12':              (416,  8, (('I', 0, '4H', 0.0001, -3.2768),)),
+    'dio_states_1_8':               (640,  1, (('DIO', 0, 'B', 1, 0),)),
+    'ai_get_1_4':                   (672,  8, (('AI', 0, '4H', 0.0001, 0),)),
+    'ai_get_5_8':                   (688,  8, (('AI', 0, '4H', 0.0001, 0),)),
+}
+
+class FrameCodec(object):
+    """
+    Encoder and decoder for one frame payload, generated from its signal table entry.
+    Every signal is packed into a single struct.Struct, and the pack_into(), to_raw() and decode() 
+    functions are generated with the scaling of each value inlined, so a whole frame is encoded
+    or decoded with one function call and one struct call.
+    """
+    def __init__(self, name: str, base_id: int, dlc: int, signals: tuple):
+        self.name = name
+        self.base_id = base_id
+        self.dlc = dlc
+        self.signals = signals
+        fmt, pos = '<', 0
+        names, scales, offsets, integers = [], [], [], []
+        for signal, start, typ, scale, offset in signals:
+            count, code = (int(typ[:-1]) if len(typ) > 1 else 1), typ[-1]
+            if start > pos:
+                fmt += '%dx' % (start-pos)
+            fmt += typ
+            pos = start + count*calcsize('<'+code)
+            names += count*[signal]
+            scales += count*[scale]
+            offsets += count*[offset]
+            integers += count*[code not in 'efd?']
+        if dlc > pos:
+            fmt += '%dx' % (dlc-pos)
+        self.struct = Struct(fmt)
+        self.names = tuple(names)
+        self.scales = tuple(scales)
+        self.offsets = tuple(offsets)
+        self.integers = tuple(integers)
+        self.scaled = any(s != 1 or o != 0 for s, o in zip(scales, offsets))
+        self._generate()
+
+    def _generate(self):
+        n = len(self.names)
+        args = ', '.join('v%d' % i for i in range(n))
+        raw = []
+        values = []
+        for i, (s, o, integer) in enumerate(zip(self.scales, self.offsets, self.integers)):
+            expr = 'v%d' % i
+            if o != 0:
+                expr = '(%s - %r)' % (expr, o)
+            if s != 1:
+                expr = '%s/%r' % (expr, s)
+            if integer and (s != 1 or o != 0):
+                expr = 'round(%s)' % expr
+            raw.append(expr)
+            expr = 'r%d' % i
+            if s != 1:
+                expr += '*%r' % s
+            if o != 0:
+                expr += ' + %r' % o
+            values.append(expr)
+        src = ('def pack_into(buffer, offset, %s):\n'
+               '    _pack_into(buffer, offset, %s)\n'
+               'def to_raw(%s):\n'
+               '    return (%s,)\n' % (args, ', '.join(raw), args, ', '.join(raw)))
+        if self.scaled:
+            src += ('def decode(buffer, offset=0):\n'
+                    '    %s, = _unpack_from(buffer, offset)\n'
+                    '    return (%s,)\n' % (', '.join('r%d' % i for i in range(n)), ', '.join(values)))
+        else:
+            src += ('def decode(buffer, offset=0):\n'
+                    '    return _unpack_from(buffer, offset)\n')
+        namespace = {'_pack_into': self.struct.pack_into, '_unpack_from': self.struct.unpack_from}
+        exec(src, namespace)
+        self.pack_into = namespace['pack_into']
+        self.to_raw = namespace['to_raw']
+        self.decode = namespace['decode']
+        self.source = src
+        self.raw_source = ', '.join(raw) #raw value expressions of the arguments v0, v1, ...
+
+    @classmethod
+    def join(cls, name: str, codecs: list, stride: int = 8):
+        """
+        Codec for consecutive frames stored `stride` bytes apart, e.g. the cell readbacks of a RxCache record
+        """
+        signals = tuple((signal, i*stride + start, typ, scale, offset)
+                        for i, codec in enumerate(codecs)
+                        for signal, start, typ, scale, offset in codec.signals)
+        return cls(name, codecs[0].base_id, stride*len(codecs), signals)
+
+    def signal(self, name: str) -> tuple:
+        """
+        Returns the (signal, byte offset, struct type, scale, offset) table entry of signal `name`
+        """
+        for entry in self.signals:
+            if entry[0] == name:
+                return entry
+        raise KeyError('%s frame has no %s signal' % (self.name, name))
+
+    #generated per codec by _generate():
+    #   pack_into(buffer, offset, *values) packs engineering values into `buffer`
+    #   to_raw(*values) returns the raw payload values of engineering values
+    #   decode(buffer, offset=0) returns the engineering values of the payload at `offset`
+
+    def encode(self, *values) -> bytes:
+        """
+        Returns the payload for the engineering `values`
+        """
+        return self.struct.pack(*self.to_raw(*values))
+
+codecs = {name: FrameCodec(name, *entry) for name, entry in frame_table.items()}
+rx_codecs = {codecs[name].base_id: codecs[name] for name in codecs if codecs[name].base_id in base_rx_arbids}
+
+"""
+Multi-channel readback signals: signal -> names of the frames carrying its channels in channel order.
+The signal's byte offset, struct type and scaling are the same in each of its frames.
+"""
+readback_groups = {'V':  ('cell_V_get_1_4', 'cell_V_get_5_8', 'cell_V_get_9_12'),
+                   'I':  ('cell_I_get_1_4', 'cell_I_get_5_8', 'cell_I_get_9_12'),
+                   'AI': ('ai_get_1_4', 'ai_get_5_8'),
+                   'T':  ('status',)}
+
+ChannelLayout = namedtuple('ChannelLayout', ['bases', 'start', 'code', 'per_frame', 'channels', 'scale', 'offset'])
+
+def channel_layout(signal: str) -> ChannelLayout:
+    """
+    Returns where the channels of a readback group signal sit in its frames
+    """
+    frames = [codecs[name] for name in readback_groups[signal]]
+    _, start, typ, scale, offset = frames[0].signal(signal)
+    per_frame = int(typ[:-1]) if len(typ) > 1 else 1
+    return ChannelLayout(tuple(f.base_id for f in frames), start, typ[-1], 
+                         per_frame, per_frame*len(frames), scale, offset)
+
+class TxMessage(Message):
+    """
+    Classic CAN data frame with a standard arbitration ID, as built by FrameTemplate. Every Message
+    attribute is set directly, which costs less than the keyword handling of Message.__init__.
+    """
+    __slots__ = ()
+
+    def __init__(self, arbitration_id: int, data: bytearray):
+        self.timestamp = 0.0
+        self.arbitration_id = arbitration_id
+        self.is_extended_id = False
+        self.is_remote_frame = False
+        self.is_error_frame = False
+        self.channel = None
+        self.is_fd = False
+        self.is_rx = True
+        self.bitrate_switch = False
+        self.error_state_indicator = False
+        self.data = data
+        self.dlc = len(data)
+
+class _BoxIds(dict):
+    """
+    Arbitration ID per Box ID, an unknown Box ID raises IndexError
+    """
+    def __missing__(self, box_id):
+        raise IndexError('Invalid Box ID: %s' % box_id)
+
+class FrameTemplate(object):
+    """
+    Transmit frame builder for one BS1200 message type, built on the frame's FrameCodec.
+    The frames of every Box ID (1-15) are validated once when the template is constructed, and their 
+    arbitration IDs precomputed. build() is generated with the frame's scaling inlined, so it packs the 
+    engineering values with one struct call into a new TxMessage. Templates are shared by all driver 
+    instances and threads and never hand out a Message twice.
+    """
+    def __init__(self, name: str):
+        self.codec = codecs[name]
+        self.base_id = self.codec.base_id
+        self.size = self.codec.struct.size
+        self.ids = _BoxIds()
+        for box in range(1, 16):
+            Message(arbitration_id= self.base_id + box,
+                    data= bytes(self.size),
+                    is_extended_id= False,
+                    check= True,
+                    is_fd= False)
+            self.ids[box] = self.base_id + box
+        args = ', '.join('v%d' % i for i in range(len(self.codec.names)))
+        src = ('def build(box_id, %s):\n'
+               '    return _TxMessage(_ids[box_id], bytearray(_pack(%s)))\n' % (args, self.codec.raw_source))
+        namespace = {'_TxMessage': TxMessage, '_ids': self.ids, '_pack': self.codec.struct.pack}
+        exec(src, namespace)
+        self.build = namespace['build']
+        self.source = src
+
+    #generated by __init__:
+    #   build(box_id, *values) returns a new frame for `box_id` carrying the engineering `values`
+
+#Templates for the transmit frames, values are the frame's signals in table order
+hil_mode_frame          = FrameTemplate('hil_mode_trig')                #enable
+cell_V_1_4_frame        = FrameTemplate('cell_V_set_1_4')               #cell 1-4 volts
+cell_V_5_8_frame        = FrameTemplate('cell_V_set_5_8')               #cell 5-8 volts
+cell_V_9_12_frame       = FrameTemplate('cell_V_set_9_12')              #cell 9-12 volts
+dio_set_frame           = FrameTemplate('dio_set_1_8')                  #enable bits, direction bits
+ao_set_frame            = FrameTemplate('ao_set_1_2')                   #AO1 volts, AO2 volts
+config_frame            = FrameTemplate('config')                       #configuration bytes 1-3
+current_set_all_frame   = FrameTemplate('cell_current_set_all')         #sink amps, source amps
+current_sink_frame      = FrameTemplate('cell_current_sink_setpoint')   #channel, sink amps
+current_source_frame    = FrameTemplate('cell_current_source_setpoint') #channel, source amps
+voltage_set_all_frame   = FrameTemplate('cell_voltage_set_all')         #volts
+voltage_setpoint_frame  = FrameTemplate('cell_voltage_setpoint')        #channel, volts
+cell_enable_all_frame   = FrameTemplate('cell_enable_all')              #enable
+cell_enable_frame       = FrameTemplate('cell_enable')                  #channel, enable
+
+#4-cell voltage setpoint templates covering cells 1-12
+cell_V_frames = (cell_V_1_4_frame, cell_V_5_8_frame, cell_V_9_12_frame)
+
 def cell_V_set_1_4(box_id: int, cell_1_4_v: list) -> Message:
     """
     Sets the Voltage Setpoints for Cells 1-4, range 0 to 5 V
     """
     try:
         arb_id = 160 + box_id
-        v_data = pack("<4e", *cell_1_4_v)
+        v_data = codecs['cell_V_set_1_4'].struct.pack(*cell_1_4_v)
         frame = Message(arbitration_id= arb_id,
                         data= v_data,
                         is_extended_id= False,
@@ -32,7 +296,7 @@ def cell_V_set_5_8(box_id: int, cell_5_8_v: list) -> Message:
     """
     try:
         arb_id = 176 + box_id
-        v_data = pack("<4e", *cell_5_8_v)
+        v_data = codecs['cell_V_set_5_8'].struct.pack(*cell_5_8_v)
         frame = Message(arbitration_id= arb_id,
                         data= v_data,
                         is_extended_id= False,
@@ -50,7 +314,7 @@ def cell_V_set_9_12(box_id: int, cell_9_12_v: list) -> Message:
     """
     try:
         arb_id = 192 + box_id
-        v_data = pack("<4e", *cell_9_12_v)
+        v_data = codecs['cell_V_set_9_12'].struct.pack(*cell_9_12_v)
         frame = Message(arbitration_id= arb_id,
                         data= v_data,
                         is_extended_id= False,
@@ -74,7 +338,7 @@ def hil_mode_trig(box_id: int, enable: bool) -> Message:
     try:
         arb_id = 128 + box_id
         frame = Message(arbitration_id = arb_id,
-                        data = bytes([enable]),
+                        data = codecs['hil_mode_trig'].struct.pack(enable),
                         is_extended_id = False,
                         check = True,
                         is_fd= False
@@ -93,7 +357,7 @@ def dio_set_1_8(box_id: int, dio_val: list, dio_direction: list) -> Message:
         arb_id = 512 + box_id
         dir_int = sum(2**i for i, v in enumerate(dio_direction) if v)
         en_int  = sum(2**i for i, v in enumerate(dio_val) if v)
-        dio_payload = bytearray([en_int, dir_int])
+        dio_payload = codecs['dio_set_1_8'].struct.pack(en_int, dir_int)
         frame = Message(arbitration_id = arb_id,
                         is_extended_id= False,
                         data = dio_payload,
@@ -114,9 +378,7 @@ def ao_set_1_2(box_id: int, ao1_voltage: float, ao2_voltage: float) -> Message:
     """
     try:
         arb_id = 544 + box_id
-        ao1 = pack("<H", ao1_voltage)
-        ao2 = pack("<H", ao2_voltage)
-        ao_payload = ao1 + ao2 + bytes(4) #pad payload with 4 empty bytes (as seen in CAN DB)
+        ao_payload = codecs['ao_set_1_2'].struct.pack(ao1_voltage, ao2_voltage) #padded with 4 empty bytes (as seen in CAN DB)
         frame = Message(arbitration_id = arb_id,
                         is_extended_id = False,
                         data = ao_payload,
@@ -144,7 +406,7 @@ def config(box_id: int, dio_hil_set_en: bool, ao_hil_set_en: bool, dio_hil_bcast
         byte3 = sum(2**i for i, v in enumerate(bool_array[16:23]) if v) 
         frame = Message(arbitration_id = arb_id,
                         is_extended_id = False,
-                        data = bytes([byte1, byte2, byte3]),
+                        data = codecs['config'].struct.pack(byte1, byte2, byte3),
                         check = True,
                         is_fd= False 
                         )
@@ -159,7 +421,7 @@ def cell_current_set_all(box_id, I_sink_all: int, I_source_all: int) -> Message:
     """
     try: 
         arb_id = 1152 + box_id
-        curr_vals = I_sink_all.to_bytes(2, 'little')+I_source_all.to_bytes(2, 'little')
+        curr_vals = codecs['cell_current_set_all'].struct.pack(I_sink_all, I_source_all)
         frame = Message(arbitration_id= arb_id, 
                         is_extended_id = False, 
                         data = curr_vals, 
@@ -178,11 +440,10 @@ def cell_current_sink_setpoint(box_id, channel: int, I_sink: float) -> Message:
     """
     try: 
         arb_id = 1184 + box_id
-        sink_val = I_sink.to_bytes(2, 'little')
-        
+        sink_val = codecs['cell_current_sink_setpoint'].struct.pack(channel-1, I_sink)
         frame = Message(arbitration_id= arb_id, 
                         is_extended_id = False, 
-                        data = bytes([channel-1])+sink_val, 
+                        data = sink_val, 
                         check = True,
                         is_fd= False
                         )
@@ -198,10 +459,10 @@ def cell_current_source_setpoint(box_id, channel: int, I_source: float) -> Messa
     """
     try: 
         arb_id = 1200 + box_id
-        source_val = I_source.to_bytes(2, 'little')
+        source_val = codecs['cell_current_source_setpoint'].struct.pack(channel-1, I_source)
         frame = Message(arbitration_id= arb_id, 
                         is_extended_id = False,
-                        data = bytes([channel-1])+source_val, 
+                        data = source_val, 
                         check = True,
                         is_fd= False
                         )
@@ -217,7 +478,7 @@ def cell_voltage_set_all(box_id, v_all: float) -> Message:
     """
     try: 
         arb_id = 1280 + box_id
-        volt_val = pack("<H", v_all)
+        volt_val = codecs['cell_voltage_set_all'].struct.pack(v_all)
         frame = Message(arbitration_id= arb_id, 
                         is_extended_id = False, 
                         data = volt_val, 
@@ -237,10 +498,10 @@ def cell_voltage_setpoint(box_id, channel: int, volt_val: int) -> Message:
     """
     try: 
         arb_id = 1296 + box_id
-        source_val = pack("<H", volt_val)
+        source_val = codecs['cell_voltage_setpoint'].struct.pack(channel-1, volt_val)
         frame = Message(arbitration_id= arb_id, 
                         is_extended_id = False, 
-                        data = bytes([channel-1])+source_val, 
+                        data = source_val, 
                         check = True,
                         is_fd= False
                         )
@@ -258,7 +519,7 @@ def cell_enable_all(box_id: int, enable: bool) -> Message:
         arb_id = 1344 + box_id
         frame = Message(arbitration_id = arb_id,
                         is_extended_id= False,
-                        data = bytes([enable]),
+                        data = codecs['cell_enable_all'].struct.pack(enable),
                         check = True,
                         is_fd= False
                         )
@@ -275,7 +536,7 @@ def cell_enable(box_id: int, channel: int, enable: bool) -> Message:
         arb_id = 1360 + box_id
         frame = Message(arbitration_id = arb_id,
                         is_extended_id= False,
-                        data = bytes([channel-1])+bytes([enable]),
+                        data = codecs['cell_enable'].struct.pack(channel-1, enable),
                         check = True,
                         is_fd= False
                         )
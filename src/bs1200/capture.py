@@ -0,0 +1,123 @@
+from struct import Struct
+import numpy as np
+import can
+import bs1200.can_frames as ff
+from bs1200.history import history_signals
+
+"""
+Capture files are a headerless sequence of fixed size 24 byte little endian records:
+    timestamp (float64), arbitration ID (uint32), DLC (uint8), flags (uint8), 2 pad bytes, 8 data bytes
+flags bit 0 is set for extended IDs, bit 1 for error frames, bit 2 for remote frames.
+"""
+capture_dtype = np.dtype([('timestamp', '<f8'),
+                          ('arb_id', '<u4'),
+                          ('dlc', 'u1'),
+                          ('flags', 'u1'),
+                          ('pad', 'V2'),
+                          ('data', 'u1', 8)])
+record_codec = Struct('<dIBB2x8s')
+
+class CaptureWriter(can.Listener):
+    """
+    can.Listener appending every received frame to a capture file.
+    Attach it to a can.Notifier, and call stop() to flush and close the file.
+    """
+    def __init__(self, path: str, buffer_size: int = 1 << 16):
+        self.path = path
+        self.file = open(path, 'ab', buffering=buffer_size)
+        self.frames = 0
+
+    def on_message_received(self, msg: can.Message):
+        flags = msg.is_extended_id | msg.is_error_frame << 1 | msg.is_remote_frame << 2
+        self.file.write(record_codec.pack(msg.timestamp, msg.arbitration_id, msg.dlc, flags, bytes(msg.data[:8])))
+        self.frames += 1
+
+    def stop(self):
+        if not self.file.closed:
+            self.file.close()
+
+class CaptureReader(object):
+    """
+    Memory maps a capture file written by CaptureWriter and decodes
+    the BS1200 readbacks in it with vectorized NumPy operations.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.records = np.memmap(path, dtype=capture_dtype, mode='r')
+        self._arb_ids = None
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def arb_ids(self) -> np.ndarray:
+        """
+        Contiguous copy of the arbitration ID column, read from the file once
+        """
+        if self._arb_ids is None:
+            self._arb_ids = np.ascontiguousarray(self.records['arb_id'])
+        return self._arb_ids
+
+    def box_ids(self) -> list:
+        """
+        Returns the Box IDs that published readback frames in the capture
+        """
+        arb_ids = np.unique(self.arb_ids)
+        readbacks = arb_ids[np.isin(arb_ids & 0x7F0, ff.base_rx_arbids) & (arb_ids < 2048)]
+        return sorted(set(int(b) for b in readbacks & 0xF))
+
+    def frames(self, arb_id: int) -> tuple:
+        """
+        Returns (timestamps, payloads) of every frame with `arb_id`, payloads shaped (frames, 8)
+        """
+        matches = self.records[self.arb_ids == arb_id]
+        return matches['timestamp'], matches['data']
+
+    def signal(self, boxid: int, signal: str) -> tuple:
+        """
+        Decode a readback `signal` ('V', 'I', 'AI' or 'T') of `boxid` into (timestamps, values).
+        Rows follow the History layout: a row starts at each frame of the signal's first readback
+        and values missing from a publish cycle are carried forward (NaN before the first frame).
+        """
+        bases = history_signals[signal].bases
+        index = np.flatnonzero(np.isin(self.arb_ids, [base+boxid for base in bases]))
+        return self._decode(index, boxid, signal)
+
+    def signals(self, signal: str) -> dict:
+        """
+        Decode a readback `signal` of every box in one pass over the capture,
+        returns a dict of (timestamps, values) keyed by Box ID
+        """
+        bases = history_signals[signal].bases
+        arb_ids = self.arb_ids
+        index = np.flatnonzero(np.isin(arb_ids & 0x7F0, bases) & (arb_ids < 2048))
+        boxes = arb_ids[index] & 0xF
+        order = np.argsort(boxes, kind='stable')
+        index, boxes = index[order], boxes[order]
+        bounds = np.searchsorted(boxes, np.arange(17))
+        return {box: self._decode(index[bounds[box]:bounds[box+1]], box, signal)
+                for box in range(1, 16) if bounds[box+1] > bounds[box]}
+
+    def _decode(self, index: np.ndarray, boxid: int, signal: str) -> tuple:
+        """
+        Decode the records at `index` (in capture order) holding the frames of `signal` for `boxid`
+        """
+        bases, start, code, per_frame, channels, scale, offset = history_signals[signal]
+        group = (self.arb_ids[index].astype(np.int64) - (bases[0]+boxid)) >> 4
+        row = np.cumsum(group == 0) - 1
+        #drop frames received before the first row starts
+        first = int(np.searchsorted(row, 0))
+        index, group, row = index[first:], group[first:], row[first:]
+        n_rows = int(row[-1]) + 1 if len(row) else 0
+        dtype = np.dtype('<'+code)
+        data = self.records['data'][index, start:start+per_frame*dtype.itemsize]
+        raw = np.ascontiguousarray(data).view(dtype)
+        values = np.full((n_rows, channels), np.nan)
+        columns = group[:, None]*per_frame + np.arange(per_frame)
+        values[row[:, None], columns] = raw*scale + offset
+        #carry values forward into rows that missed a frame
+        filled = np.where(np.isnan(values), 0, np.arange(n_rows)[:, None])
+        np.maximum.accumulate(filled, axis=0, out=filled)
+        values = values[filled, np.arange(channels)]
+        times = self.records['timestamp'][index[group == 0]]
+        return np.asarray(times), values
@@ -1,7 +1,5 @@
 from ftplib import FTP
 from dataclasses import dataclass
-from paramiko import SSHClient, AutoAddPolicy
-from scp import SCPClient
 
 class FtpHelper(object):
     """
@@ -53,6 +51,9 @@ class ScpHelper(object):
 
     def open(self):
         """Open """
+        #imported here so the settings dataclasses do not need the SSH libraries
+        from paramiko import SSHClient, AutoAddPolicy
+        from scp import SCPClient
         self.ssh = SSHClient()
         self.ssh.load_system_host_keys()
         self.ssh.set_missing_host_key_policy(AutoAddPolicy())
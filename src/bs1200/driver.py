@@ -1,11 +1,51 @@
-from struct import unpack
 import sys
+import threading
 from can.interfaces.pcan import pcan
+from can.interfaces.pcan import basic as pcan_basic
 import can
 from can.message import Message
+import numpy as np
 import bs1200.can_frames as ff
+from bs1200.rx_cache import RxCache
+from bs1200.stream import ReadbackStream, Snapshot, decode_readback, decode_snapshot, readback_signals
+from bs1200.history import History
+from bs1200.capture import CaptureWriter
+from bs1200.profile import ProfilePlayer
+from bs1200.battery import BatteryModel, BatteryEngine
+from bs1200.ethernet import UdpReadback, TcpCommandBus
+from bs1200.latency import LatencyMonitor
+from bs1200.monitor import RxMonitor
+from bs1200.writebehind import WriteBehind
+from bs1200.transmit import TxThread, HIL_MSG_IDS
+from bs1200.health import HealthMonitor
+from bs1200.recovery import BusRecovery
+from bs1200.alarms import AlarmRule, AlarmMonitor
 from time import sleep
 
+#channel layouts of the readback groups and codecs decoding a whole group 
+#from the adjacent frames of a RxCache box record
+_V_LAYOUT = ff.channel_layout('V')
+_I_LAYOUT = ff.channel_layout('I')
+_AI_LAYOUT = ff.channel_layout('AI')
+_V_CODEC = ff.FrameCodec.join('V', [ff.rx_codecs[base] for base in _V_LAYOUT.bases])
+_I_CODEC = ff.FrameCodec.join('I', [ff.rx_codecs[base] for base in _I_LAYOUT.bases])
+_AI_CODEC = ff.FrameCodec.join('AI', [ff.rx_codecs[base] for base in _AI_LAYOUT.bases])
+_STATUS_CODEC = ff.codecs['status']
+_DIO_CODEC = ff.codecs['dio_states_1_8']
+
+#PCAN-Basic status codes of a lost or unusable adapter, reopened by auto recovery
+_ADAPTER_ERRORS = (pcan_basic.PCAN_ERROR_NODRIVER, pcan_basic.PCAN_ERROR_ILLHW, pcan_basic.PCAN_ERROR_ILLNET,
+                   pcan_basic.PCAN_ERROR_ILLHANDLE, pcan_basic.PCAN_ERROR_INITIALIZE, pcan_basic.PCAN_ERROR_RESOURCE,
+                   pcan_basic.PCAN_ERROR_ILLOPERATION, pcan_basic.PCAN_ERROR_UNKNOWN)
+
+#receive timeout of the notifier thread, bounds the time taken to stop it when reconnecting
+_NOTIFIER_TIMEOUT = 0.1
+
+#readback frames that setters with wait=True block on, the DIO frame is only checked by readback_dio()
+_STATUS_READBACK = (_STATUS_CODEC.base_id,)
+_V_READBACKS = _V_LAYOUT.bases
+_I_READBACKS = _I_LAYOUT.bases
+_DIO_READBACK = (_DIO_CODEC.base_id,)
 
 
 class BS1200(object):
@@ -20,31 +60,146 @@ class BS1200(object):
         - delay_ms     (optional): Delay in milliseconds to be used in can_wait() calls 
                                    optionally made after sending CAN frames to BS1200 unit.
                                    Defaults to 10 ms
+        - readback_timeout_ms (optional): Longest time in milliseconds setters called with wait=True 
+                                   block for the next readback frames. Defaults to 100 ms
+        - ethernet     (optional): dict mapping Box IDs to the units' Ethernet_Settings. Commands to
+                                   these units are sent over TCP to their Command_Port and readbacks are
+                                   received as UDP datagrams on their Reporting_Port.
+                                   Set pcan_channel to None to use Ethernet without a PCAN adapter
+        - interface    (optional): python-can interface name, defaults to 'pcan'. Other interfaces 
+                                   (e.g. 'virtual' for tests and benchmarks) open can.Bus(interface, 
+                                   channel=pcan_channel, bitrate=bit_rate). A can.BusABC subclass
+                                   is opened as interface(channel=pcan_channel, bitrate=bit_rate)
     """
     
     def _get_message(self, msg):
-        self.rx_cache[msg.arbitration_id] = msg
+        self.rx_cache.put(msg.arbitration_id, msg.data, msg.timestamp)
 
-    def __init__(self, unit_ids: list, pcan_channel = 'PCAN_USBBUS1', bit_rate = 1000000, delay_ms = 10) -> None:
+    def __init__(self, unit_ids: list, pcan_channel = 'PCAN_USBBUS1', bit_rate = 1000000, delay_ms = 10, 
+                 readback_timeout_ms = 100, ethernet: dict = None, interface: str = 'pcan') -> None:
         #Give BoxIDs OR Ip Addrs and init interface based on non-default value
         cfg = {'fd': False, 'f_clock_mhz' : 20}
         unit_ids.sort()
-        self.box_ids = []
-        for b in unit_ids:
-            if b in range(1,16):
-                self.box_ids.append(b)
+        self.box_ids = self._valid_box_ids(unit_ids)
+        self.rx_cache = RxCache(self.box_ids)
+        self.telemetry = None #History of readbacks, created by enable_history()
+        self.capture = None #CaptureWriter attached by start_capture()
+        self.player = None #ProfilePlayer started by play_profile()
+        self.battery = None #BatteryEngine attached by start_battery_model()
+        self.latency = None #LatencyMonitor attached by enable_latency_stats()
+        self.monitor = None #RxMonitor started by enable_rx_monitor()
+        self.writer = None #WriteBehind started by enable_write_behind()
+        self.tx = None #TxThread started by start_tx_thread()
+        self.health_monitor = None #HealthMonitor started by enable_health_monitor()
+        self.recovery = None #BusRecovery started by enable_auto_recovery()
+        self.alarm_monitor = None #AlarmMonitor created by add_alarm()
+        self._bus_settings = (interface, pcan_channel, bit_rate, cfg) #reopened by reconnect()
+        self._reconnect_lock = threading.Lock()
+        self.bit_rate = bit_rate
+        self.ethernet = ethernet or {}
+        self.udp = [] #one UdpReadback per distinct reporting port
+        self.notifier = None
+        self.tcp = None #TcpCommandBus of the Ethernet units
+        can_bus = None
+        try:
+            for port in sorted(set(eth.Reporting_Port for eth in self.ethernet.values())):
+                self.udp.append(UdpReadback(self.rx_cache, port))
+            if pcan_channel is None:
+                if not self.ethernet:
+                    raise ValueError('A PCAN channel is required when no Ethernet units are configured')
             else:
-                raise IndexError('Invalid BS1200 Box ID: %d' % b)
-        self.rx_cache = ff.init_frame_dict(self.box_ids)   
-        self.bus = pcan.PcanBus(channel = pcan_channel, bitrate = bit_rate, args = cfg)
-        #DEBUG test if we need these to operate iterative read
-        self.buffer = can.BufferedReader()
-        self.notifier = can.Notifier(self.bus, [self._get_message, self.buffer])
+                can_bus = self._open_bus()
+            self.can_bus = can_bus
+            self._apply_filters()
+            if can_bus is not None:
+                self.notifier = can.Notifier(can_bus, [self._get_message], _NOTIFIER_TIMEOUT)
+            #commands to Ethernet units go over TCP, everything else to the PCAN bus
+            if self.ethernet:
+                self.tcp = TcpCommandBus(self.ethernet, can_bus)
+            self.bus = self.tcp if self.tcp is not None else can_bus
+        except Exception:
+            #release the sockets and bus opened so far, close() cannot be called on a partial instance
+            if self.notifier is not None:
+                self.notifier.stop()
+            if can_bus is not None:
+                can_bus.shutdown()
+            for udp in self.udp:
+                udp.close()
+            raise
         self.publish_delay = delay_ms / 1000 #delay to use when using can_wait()
+        self.readback_timeout = readback_timeout_ms / 1000 #longest wait for fresh readbacks
         sleep(0.05) #sleep for frame buffer to populate
     def __enter__(self):
         return self
 
+    def _open_bus(self) -> can.BusABC:
+        interface, channel, bit_rate, cfg = self._bus_settings
+        if interface == 'pcan':
+            return pcan.PcanBus(channel = channel, bitrate = bit_rate, args = cfg)
+        if isinstance(interface, type):
+            return interface(channel = channel, bitrate = bit_rate)
+        return can.Bus(interface = interface, channel = channel, bitrate = bit_rate)
+
+    def _valid_box_ids(self, unit_ids: list) -> list:
+        box_ids = []
+        for b in sorted(unit_ids):
+            if b in range(1,16):
+                box_ids.append(b)
+            else:
+                raise IndexError('Invalid BS1200 Box ID: %d' % b)
+        return box_ids
+
+    def _apply_filters(self):
+        """
+        Accept only the readback frames of the configured boxes. Interfaces filtering in their driver or
+        hardware (e.g. socketcan) get the acceptance filters, and PCAN adapters get a hardware filter on 
+        the range of readback IDs. Other buses are left unfiltered: python-can would check the filters 
+        in Python for every frame, which costs more than RxCache.put() skipping an unknown ID.
+        """
+        if self.can_bus is None:
+            return
+        filters = ff.acceptance_filters(self.box_ids)
+        native = type(self.can_bus)._apply_filters is not can.BusABC._apply_filters
+        self.can_bus.set_filters(filters if native else None)
+        basic = getattr(self.can_bus, 'm_objPCANBasic', None)
+        if basic is not None:
+            handle = self.can_bus.m_PcanHandle
+            low = min(f['can_id'] for f in filters)
+            high = max(f['can_id'] | (~f['can_mask'] & 0x7FF) for f in filters)
+            #closing the filter first replaces the previous range instead of widening it
+            basic.SetValue(handle, pcan_basic.PCAN_MESSAGE_FILTER, pcan_basic.PCAN_FILTER_CLOSE)
+            if basic.FilterMessages(handle, low, high, pcan_basic.PCAN_MODE_STANDARD) != pcan_basic.PCAN_ERROR_OK:
+                print("Could not set the PCAN hardware filter, readbacks are filtered in software only")
+
+    def set_box_ids(self, unit_ids: list):
+        """
+        Change the Box IDs served by this driver. The receive cache and acceptance filters are rebuilt,
+        and history, latency statistics and receive monitoring restart for the new boxes if enabled.
+        Alarm rules of boxes that are still served are kept. A running battery model is stopped,
+        and open stream() generators must be restarted.
+        """
+        box_ids = self._valid_box_ids(unit_ids)
+        self.stop_battery_model()
+        telemetry, latency, monitor = self.telemetry, self.latency, self.monitor
+        rules = self.alarm_monitor.rules if self.alarm_monitor is not None else []
+        self.telemetry = self.latency = self.monitor = self.alarm_monitor = None
+        if monitor is not None:
+            monitor.close()
+        self.box_ids = box_ids
+        self.rx_cache = RxCache(box_ids)
+        for udp in self.udp:
+            udp.rx_cache = self.rx_cache
+        self._apply_filters()
+        if telemetry is not None:
+            self.enable_history(telemetry.capacity)
+        if latency is not None:
+            self.enable_latency_stats(latency.tolerance, latency.timeout)
+        if monitor is not None:
+            self.enable_rx_monitor(monitor.stale_after*1000, monitor.action, monitor.callback)
+        for rule in rules:
+            if rule.boxid in box_ids:
+                self.add_alarm(rule)
+
     def __exit__(self, exception_type, execption_val, tb):
         self.close()
         if exception_type is not None:
@@ -75,8 +230,36 @@ class BS1200(object):
                        "\nCell 5:\t{:5f} A\t| Cell 6:\t{:5f} A\t| Cell 7:\t{:5f} A\t| Cell 8:\t{:5f} A |"+
                        "\nCell 9:\t{:5f} A\t| Cell 10:\t{:5f} A\t| Cell 11:\t{:5f} A\t| Cell 12:\t{:5f} A |")
     
+    def bus_ok(self) -> bool:
+        """
+        Returns the bus status reported by the interface (PcanBus.status_is_ok()),
+        True for interfaces that do not report a status. Once enable_health_monitor() is called
+        the status last polled by the health monitor is returned without querying the interface.
+        """
+        if self.health_monitor is not None:
+            return self.health_monitor.ok
+        status_is_ok = getattr(self.bus, 'status_is_ok', None)
+        return status_is_ok() if status_is_ok is not None else True
+
     def can_wait(self):
         sleep(self.publish_delay)
+
+    def wait_readback(self, boxid: int, base_ids: tuple = _V_READBACKS, timeout_ms: float = None) -> bool:
+        """
+        Block until the next frames of the `base_ids` readbacks (cell voltages by default) 
+        are received from `boxid`, i.e. frames published after this call. Frames queued by the transmit
+        thread, and commands queued for an Ethernet unit's TCP connection, are written first: readbacks 
+        published before the setpoints are sent do not count. Returns False if `timeout_ms` (defaults to 
+        the constructor's `readback_timeout_ms`) elapses while flushing or while waiting for the readbacks.
+        """
+        timeout = self.readback_timeout if timeout_ms is None else timeout_ms/1000
+        if self.tx is not None and not self.tx.flush(timeout):
+            return False
+        if self.tcp is not None and not self.tcp.flush(boxid, timeout):
+            return False
+        arb_ids = [base+boxid for base in base_ids]
+        since = self.rx_cache.sequence(arb_ids)
+        return self.rx_cache.wait_for(arb_ids, since, timeout)
     
     def scale_volts(self, voltsIn, recieving : bool):
         """
@@ -99,11 +282,385 @@ class BS1200(object):
         """
         Calls pcan bus shutdown procedure
         """
+        self.disable_auto_recovery()
+        self.stop_profile()
+        self.stop_battery_model()
+        self.disable_write_behind()
+        self.disable_health_monitor()
+        self.stop_capture()
+        if self.monitor is not None:
+            self.monitor.close()
+        for udp in self.udp:
+            udp.close()
+        if self.notifier is not None:
+            self.notifier.stop()
         self.bus.shutdown()
 
-    def reset(self):
+    def start_capture(self, path: str) -> CaptureWriter:
+        """
+        Append every frame received on the bus to the binary capture file at `path`,
+        which can be decoded offline with bs1200.capture.CaptureReader
+        """
+        if self.notifier is None:
+            raise RuntimeError('Frame capture requires a PCAN channel')
+        if self.capture is None:
+            self.capture = CaptureWriter(path)
+            self.notifier.add_listener(self.capture)
+        return self.capture
+
+    def stop_capture(self):
+        """
+        Detach the capture file writer from the bus and close the file
+        """
+        if self.capture is not None:
+            self.notifier.remove_listener(self.capture)
+            self.capture.stop()
+            self.capture = None
+
+    def play_profile(self, profiles: dict, rate_hz: float, loop: bool = False) -> ProfilePlayer:
+        """
+        Start playing cell voltage profiles from a background thread. `profiles` maps Box IDs to arrays 
+        of cell voltages shaped (samples, 12), and one row per box is sent every 1/`rate_hz` seconds 
+        against absolute deadlines so the playback rate does not drift. Replaces any profile already playing.
+        Returns the ProfilePlayer, use its join(), stop() and stats() methods to follow the playback.
+        """
+        for boxid in profiles:
+            if not self.box_id_check(boxid):
+                raise IndexError('Box ID %d is not configured' % boxid)
+        self.stop_profile()
+        self.player = ProfilePlayer(self.bus, profiles, rate_hz, loop=loop).start()
+        return self.player
+
+    def stop_profile(self):
+        """
+        Stop the profile started by play_profile(), the cells hold the last sent setpoints
+        """
+        if self.player is not None:
+            self.player.stop()
+            if self.writer is not None:
+                self.writer.forget(list(self.player.profiles))
+
+    def start_battery_model(self, model: BatteryModel) -> BatteryEngine:
+        """
+        Emulate battery cells in closed loop: the initial model voltages are set, then every complete 
+        set of cell current readbacks from a box steps `model` and sends the box's updated cell voltages
+        from the receive thread. Replaces any running model.
+        """
+        for boxid in model.box_ids:
+            if not self.box_id_check(boxid):
+                raise IndexError('Box ID %d is not configured' % boxid)
+        self.stop_battery_model()
+        for boxid in model.box_ids:
+            self.set_cells_V(boxid, model.voltage[model.rows[boxid]])
+        if self.writer is not None:
+            self.writer.flush() #initial voltages go out before the model's
+        self.battery = BatteryEngine(self.bus, self.rx_cache, model)
+        self.rx_cache.add_hook(self.battery.arb_ids, self.battery.on_frame)
+        return self.battery
+
+    def stop_battery_model(self):
+        """
+        Detach the battery model from the receive path, the cells hold the last sent voltages
+        """
+        if self.battery is not None:
+            self.rx_cache.remove_hook(self.battery.arb_ids, self.battery.on_frame)
+            if self.writer is not None:
+                self.writer.forget(self.battery.model.box_ids)
+            self.battery = None
+
+    def enable_latency_stats(self, tolerance_V: float = 0.005, timeout_s: float = 1.0) -> LatencyMonitor:
+        """
+        Start measuring the latency from each cell voltage setpoint (set_cell_V, set_V_all, set_cells_V)
+        until the commanded cells read back within `tolerance_V` Volts of the setpoint.
+        Setpoints not reached within `timeout_s` seconds are counted as timeouts.
+        """
+        if self.latency is None:
+            self.latency = LatencyMonitor(self.rx_cache, tolerance_V, timeout_s)
+            self.rx_cache.add_hook(self.latency.arb_ids, self.latency.on_frame)
+        return self.latency
+
+    def stats(self) -> dict:
+        """
+        Returns the setpoint to readback latency summaries (count, min, mean, p50, p90, p99, max in seconds)
+        keyed by (Box ID, command name), with the number of setpoints that timed out or were superseded
+        """
+        if self.latency is None:
+            raise RuntimeError('Latency statistics are not enabled, call enable_latency_stats() first')
+        return self.latency.stats()
+
+    def enable_rx_monitor(self, stale_ms: float = 50, action: str = 'raise', callback = None) -> RxMonitor:
+        """
+        Start monitoring the receive rate, gaps and age of every readback frame of the configured boxes.
+        Readback methods then check the age of the frames they read: with `action` 'raise' a 
+        StaleReadbackError is raised if a frame is older than `stale_ms` (or was never received), 
+        'warn' issues a RuntimeWarning and returns the stale values, 'ignore' only records events.
+        `callback(arb_id, stale, age)` is called from the monitor thread when a frame goes stale or recovers.
+        """
+        if self.monitor is not None:
+            self.monitor.close()
+        self.monitor = RxMonitor(self.rx_cache, stale_ms/1000, action, callback, self.bit_rate)
+        return self.monitor
+
+    def add_alarm(self, boxid, signal: str = None, low: float = None, high: float = None, channels: list = None,
+                  deadband: float = 0.0, callback = None) -> AlarmRule:
+        """
+        Watch readback `signal` ('V', 'I', 'AI', 'T' or 'fan') of `boxid` for values below `low` or
+        above `high`, checked in the receive path each time a frame holding one of `channels`
+        (1-based, all by default) arrives. A channel clears once back inside the limits by `deadband`.
+        `callback(alarm)` is called from the receive thread on every transition with an Alarm
+        (boxid, signal, channel, active, value, timestamp) and must not wait for readbacks.
+        A fan fault is add_alarm(boxid, 'fan', 16, 16). An AlarmRule may be given instead of `boxid`.
+        Returns the AlarmRule, whose `event` is set while any of its channels is in alarm.
+        """
+        rule = boxid if isinstance(boxid, AlarmRule) else AlarmRule(boxid, signal, low, high, channels, deadband, callback)
+        if self.alarm_monitor is None:
+            self.alarm_monitor = AlarmMonitor(self.rx_cache)
+        return self.alarm_monitor.add(rule)
+
+    def remove_alarm(self, rule: AlarmRule = None):
+        """
+        Stop checking an alarm rule returned by add_alarm(), or every rule if none is given
+        """
+        if self.alarm_monitor is None:
+            return
+        for r in ([rule] if rule is not None else list(self.alarm_monitor.rules)):
+            self.alarm_monitor.remove(r)
+
+    def active_alarms(self) -> list:
+        """
+        Returns (Box ID, signal, channel) of every channel currently in alarm
+        """
+        return self.alarm_monitor.active() if self.alarm_monitor is not None else []
+
+    def enable_write_behind(self, period_ms: float = None) -> WriteBehind:
+        """
+        Route the cell voltage, cell current limit and analog output setters through a write-behind cache.
+        Setpoints repeating the values last sent are dropped, and changes are sent by a writer thread
+        at most once every `period_ms` (defaults to delay_ms, set it to the units' Write_Period_ms),
+        merged into set-all or 4-cell frames where possible. Setters then return without waiting for
+        the bus, unless called with wait=True, which sends the pending setpoints first.
+        """
+        if self.writer is None:
+            period = self.publish_delay if period_ms is None else period_ms / 1000
+            self.writer = WriteBehind(self.bus, period, self.bus_ok)
+        return self.writer
+
+    def disable_write_behind(self):
+        """
+        Send the pending setpoints and return to sending every setter call immediately
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def start_tx_thread(self, maxsize: int = 256, hil_ids: tuple = HIL_MSG_IDS) -> TxThread:
+        """
+        Send every frame from a single transmit thread through a bounded priority queue. Frames of the
+        units' `hil_ids` (HIL_Msg_IDs) are sent ahead of other setpoints and configuration frames, callers
+        block while `maxsize` frames are queued, and a full PCAN transmit queue is retried with backoff
+        instead of raising in the caller. Frames changing the same setting of a box keep their order, and 
+        HIL mode and configuration frames keep their order with every frame of their box. Setters then return
+        once their frames are queued, with TxThread.status_is_ok() (False after a failed send). To wait for a 
+        frame, queue it with tx.submit(msg), which returns a Future completed when the frame is sent or failed.
+        Start it before profiles, battery models or the write-behind cache, which keep the bus they started with.
+        """
+        if self.tx is None:
+            self.tx = TxThread(self.bus, maxsize, hil_ids)
+            self.bus = self.tx
+        return self.tx
+
+    def stop_tx_thread(self):
+        """
+        Send the queued frames and go back to sending from the calling threads. The write-behind cache,
+        profile player and battery model started on the transmit thread send on the wrapped bus again.
+        """
+        if self.tx is not None:
+            tx, self.tx = self.tx, None
+            tx.stop()
+            self._replace_bus(tx, tx.bus)
+
+    def enable_health_monitor(self, interval_ms: float = 50) -> HealthMonitor:
+        """
+        Check the bus state every `interval_ms` from a background thread instead of after every send:
+        setters then return the last polled status without an extra interface call. Bus-off, error passive,
+        bus warning, overrun and full transmit queue states are counted, and on PCAN adapters error frames 
+        are received and counted by direction. See health() for the counters.
+        """
+        if self.health_monitor is None:
+            self.health_monitor = HealthMonitor(self.bus, self.can_bus, interval_ms/1000)
+            self._allow_error_frames()
+            if self.notifier is not None:
+                self.notifier.add_listener(self.health_monitor.on_message)
+        return self.health_monitor
+
+    def _allow_error_frames(self):
+        """
+        Receive the error frames of PCAN adapters, counted by the health monitor
+        """
+        basic = getattr(self.can_bus, 'm_objPCANBasic', None)
+        if basic is not None:
+            basic.SetValue(self.can_bus.m_PcanHandle, pcan_basic.PCAN_ALLOW_ERROR_FRAMES, pcan_basic.PCAN_PARAMETER_ON)
+
+    def disable_health_monitor(self):
+        """
+        Stop the health monitor, setters query the bus status after every send again
+        """
+        if self.health_monitor is not None:
+            if self.notifier is not None:
+                self.notifier.remove_listener(self.health_monitor.on_message)
+            self.health_monitor.close()
+            self.health_monitor = None
+
+    def health(self) -> dict:
+        """
+        Returns the bus state polled by the health monitor ('ok' and the PCAN-Basic 'status' code) and
+        cumulative counters: status polls, failed polls, bus-off, error passive and bus warning events,
+        overruns, full transmit queue events, error frames and transmit/receive errors, the last reported 
+        controller error counters, the frames that could not be sent again after a reconnect, 
+        and the last exception raised while polling or sending them
+        """
+        if self.health_monitor is None:
+            raise RuntimeError('Health monitoring is not enabled, call enable_health_monitor() first')
+        return self.health_monitor.summary()
+
+    def _write_behind(self, boxid: int, base_ids: tuple, wait: bool) -> bool:
+        received = True
+        if wait:
+            self.writer.flush()
+            received = self.wait_readback(boxid, base_ids)
+        return self.writer.ok() and received
+
+    def _check_fresh(self, box_ids: list, bases: tuple):
+        if self.monitor is not None:
+            self.monitor.check([base+box for box in box_ids for base in bases])
+
+    def reset(self) -> bool:
+        """
+        Reset the PCAN channel after a bus error. If the interface cannot be reset 
+        (e.g. the adapter was unplugged) the bus is reopened with reconnect()
+        """
         print("Resetting PCAN Bus interface...")
-        print("Bus Reset" if self.reset() else "Error resetting PCAN Bus")
+        reset = getattr(self.can_bus, 'reset', None)
+        try:
+            ok = reset is not None and reset()
+        except can.CanError:
+            ok = False
+        if not ok:
+            ok = self.reconnect()
+        print("Bus Reset" if ok else "Error resetting PCAN Bus")
+        return ok
+
+    def reconnect(self) -> bool:
+        """
+        Shut down the CAN bus and open it again with the constructor's settings: the acceptance filters
+        and notifier listeners are attached to the new bus (and PCAN error frames are allowed again for the
+        health monitor), and with auto recovery enabled the last HIL mode, configuration and setpoint frames
+        sent by the setters are sent again (the write-behind cache resends its setpoints too). Returns False if the bus cannot be opened or the replayed frames 
+        cannot be sent, the send error is then counted by the health monitor (see health()) instead of raised.
+        """
+        if self.can_bus is None:
+            return False
+        if not self._reconnect_lock.acquire(blocking=False):
+            #another thread is reconnecting, wait for it
+            with self._reconnect_lock:
+                return self.bus_ok()
+        try:
+            listeners = list(self.notifier.listeners) if self.notifier is not None else [self._get_message]
+            if self.notifier is not None:
+                self.notifier.stop()
+            old = self.can_bus
+            try:
+                old.shutdown()
+            except Exception as e:
+                print("Error shutting down the CAN bus:", e)
+            try:
+                new = self._open_bus()
+            except (can.CanError, OSError) as e:
+                print("Could not reopen the CAN bus:", e)
+                return False
+            self.can_bus = new
+            self._replace_bus(old, new)
+            self._apply_filters()
+            if self.health_monitor is not None:
+                self._allow_error_frames()
+            self.notifier = can.Notifier(new, listeners, _NOTIFIER_TIMEOUT)
+            if self.recovery is not None:
+                try:
+                    for msg in self.recovery.frames():
+                        self.bus.send(msg)
+                except (can.CanError, OSError) as e:
+                    if self.health_monitor is not None:
+                        self.health_monitor.send_failed(e)
+                    else:
+                        print("Could not send the settings again after reopening the CAN bus:", e)
+                    return False
+            if self.writer is not None:
+                self.writer.resend()
+            return True
+        finally:
+            self._reconnect_lock.release()
+
+    def _replace_bus(self, old: can.BusABC, new: can.BusABC):
+        """
+        Point the transports and background senders holding the `old` bus to the `new` one
+        """
+        if self.bus is old:
+            self.bus = new
+        holders = (self.bus, self.tx, getattr(self.tx, 'bus', None), self.tcp, self.writer, self.player, 
+                   self.battery, self.health_monitor)
+        for holder in holders:
+            for attr in ('bus', 'fallback', 'can_bus'):
+                if holder is not None and getattr(holder, attr, None) is old:
+                    setattr(holder, attr, new)
+
+    def _bus_fault(self) -> bool:
+        """
+        True when the notifier stopped on a receive error, or the PCAN channel is bus-off or lost
+        """
+        if self.can_bus is None:
+            return False
+        if self.notifier is not None and getattr(self.notifier, 'exception', None) is not None:
+            return True
+        status = getattr(self.can_bus, 'status', None)
+        if status is None:
+            return False
+        try:
+            code = status()
+        except Exception:
+            return True
+        return bool(code & pcan_basic.PCAN_ERROR_BUSOFF) or any(code & e == e for e in _ADAPTER_ERRORS)
+
+    def enable_auto_recovery(self, interval_ms: float = 100, retry_ms: float = 1000) -> BusRecovery:
+        """
+        Check the CAN bus for bus-off or a lost adapter every `interval_ms` and recover with reconnect(),
+        retried every `retry_ms` until the bus reopens. From then on the setters remember the last HIL mode,
+        configuration and setpoint frames, which are sent again after each reconnect. Profiles stopped 
+        by a send error must be restarted. See recovery_stats() for the recovery counts and times.
+        """
+        if self.recovery is None:
+            self.recovery = BusRecovery(self._bus_fault, self.reconnect, interval_ms/1000, retry_ms/1000)
+        return self.recovery
+
+    def disable_auto_recovery(self):
+        if self.recovery is not None:
+            self.recovery.close()
+            self.recovery = None
+
+    def recovery_stats(self) -> dict:
+        """
+        Returns the detected faults, recoveries, failed reopen attempts and recovery time summary in seconds
+        """
+        if self.recovery is None:
+            raise RuntimeError('Auto recovery is not enabled, call enable_auto_recovery() first')
+        return self.recovery.stats()
+
+    def _send(self, msg: Message, timeout: float = None):
+        """
+        Send a setter's frame, remembered for auto recovery
+        """
+        self.bus.send(msg, timeout)
+        if self.recovery is not None:
+            self.recovery.record(msg)
 
     def channel_check(self, channel: int) -> bool:
         return True if channel in range(1, 13) else False
@@ -114,19 +671,22 @@ class BS1200(object):
     def query_system_status(self, boxid: int, printout = True):
         """
         Read status frame from BS1200 to get Fan Fault status and Temperature Sensor values.
-        Prints output by default `printout` argument, and returns array of Temperature Sensor values in °C
+        Prints output by default `printout` argument, and returns array of Temperature Sensor values in °C,
+        or None if no status frame has been received from the unit yet
         """
         if self.box_id_check(boxid):
+            self._check_fresh((boxid,), _STATUS_READBACK)
+            if not self._received(256+boxid):
+                if(printout):
+                    print("No status frame received from BS1200 ID {:d}".format(boxid))
+                return None
             try: 
-                sys_stat = self.rx_cache[256+boxid]
-                fanstat = sys_stat.data[0]
+                fanstat, tempSens1, tempSens2, tempSens3 = _STATUS_CODEC.decode(self.rx_cache.data, 
+                                                                               self.rx_cache.offset(256+boxid))
                 if(fanstat== 16):
                     fanFailStat = 'No Fault'
                 else:
                     fanFailStat = 'Fan Failure Detected'
-                tempSens1 = sys_stat.data[1]
-                tempSens2 = sys_stat.data[2]
-                tempSens3 = sys_stat.data[3]
                 if(printout):
                     print("Fan Status:", fanFailStat)
                     print("Temp Sensor 1:  "+str(tempSens1)+" °C")
@@ -140,19 +700,19 @@ class BS1200(object):
 
     def hil_mode(self, boxid: int, enable_HIL: bool, wait: bool = False) -> bool:
         """
-        Enable or disable the BS1200 in HIL mode. Returns PCAN bus OK status.
+        Enable or disable the BS1200 in HIL mode. Returns PCAN bus OK status, like every setter
+        also False if `wait` is True and the readback is not received within readback_timeout_ms.
         Once set, the Battery Simulator will execute only the commands defined as active in HIL mode.
         By default all auxiliary configuration channels are set to disabled during HIL mode. 
         In order to change this option, the configuration frame must be used. 
         Note, the Configure frame is not supported in HIL mode, so this must be sent while HIL mode is disabled.
         """
         if self.box_id_check(boxid):
-            tx_msg = ff.hil_mode_trig(boxid, enable_HIL)
+            tx_msg = ff.hil_mode_frame.build(boxid, enable_HIL)
             try:
-                self.bus.send(tx_msg)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(tx_msg)
+                received = self.wait_readback(boxid, _STATUS_READBACK) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("Error sending HIL mode trigger message:", e)
                 self.reset()
@@ -163,10 +723,9 @@ class BS1200(object):
                                 dio_hil_bcast_en=dio_en, ai_1_4_bcast_en=ai_en, 
                                 ai_5_8_bcast_en=ai_en, cal_mode=False)
             try:
-                self.bus.send(tx_msg)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(tx_msg)
+                received = self.wait_readback(boxid, _STATUS_READBACK) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("Error sending HIL publishing configuration message to BS1200:", e)
                 self.reset()
@@ -177,12 +736,11 @@ class BS1200(object):
         Pass True as `status` to enable, False to disable
         """
         if self.box_id_check(boxid):
-            frame = ff.cell_enable(boxid, channel, status)
+            frame = ff.cell_enable_frame.build(boxid, channel, status)
             try:
-                self.bus.send(frame)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(frame)
+                received = self.wait_readback(boxid, _V_READBACKS + _I_READBACKS) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("Error sending cell enable message:", e)
                 self.reset()
@@ -193,29 +751,31 @@ class BS1200(object):
         Pass True as `status` to enable, `False` to disable
         """
         if self.box_id_check(boxid):
-            frame = ff.cell_enable_all(boxid, status)
+            frame = ff.cell_enable_all_frame.build(boxid, status)
             try:
-                self.bus.send(frame)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(frame)
+                received = self.wait_readback(boxid, _V_READBACKS + _I_READBACKS) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("Error sending cell enable message:", e)
                 self.reset()
 
-    def set_cell_V(self, boxid: int, channel: int, voltage: float, wait: bool = False) -> Message:
+    def set_cell_V(self, boxid: int, channel: int, voltage: float, wait: bool = False) -> bool:
         """
         Set an individual cell `channel` (1-12) to designated `voltage` value input range 0.00 to 5.00 Volts
         """
         if self.box_id_check(boxid):
-            volts = self.scale_volts(voltage, False)
-            tx_msg = ff.cell_voltage_setpoint(boxid, channel, volts)
+            tx_msg = ff.voltage_setpoint_frame.build(boxid, channel, voltage)
+            if self.latency is not None:
+                self.latency.sent(boxid, 'set_cell_V', (channel,), (voltage,))
+            if self.writer is not None:
+                self.writer.set_V(boxid, {channel: voltage})
+                return self._write_behind(boxid, (_V_READBACKS[(channel-1)//4],), wait)
             try:
                 #use blocking receive function until rx message is recieved
-                self.bus.send(msg=tx_msg)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(tx_msg)
+                received = self.wait_readback(boxid, (_V_READBACKS[(channel-1)//4],)) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("An error occurred communicating with the BS1200:")
                 self.reset() #TODO implement everywhere
@@ -226,29 +786,57 @@ class BS1200(object):
         Set the cell voltage for Cells 1-12, valid inputs from 0.00 to 5.00 Volts
         """
         if self.box_id_check(boxid):    
-            scaled_volts = self.scale_volts(tgt_volt, False)
-            tx_msg = ff.cell_voltage_set_all(boxid, scaled_volts)
+            tx_msg = ff.voltage_set_all_frame.build(boxid, tgt_volt)
+            if self.latency is not None:
+                self.latency.sent(boxid, 'set_V_all', range(1, 13), 12*[tgt_volt])
+            if self.writer is not None:
+                self.writer.set_V(boxid, dict.fromkeys(range(1, 13), tgt_volt))
+                return self._write_behind(boxid, _V_READBACKS, wait)
             try:
-                self.bus.send(tx_msg, timeout=None)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(tx_msg)
+                received = self.wait_readback(boxid, _V_READBACKS) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("An error occurred communicating set cell v all the BS1200:", e)
                 self.reset()
 
+    def set_cells_V(self, boxid: int, values, wait: bool = False) -> bool:
+        """
+        Set the voltage of Cells 1-12 from a sequence (or array) of 12 values, valid inputs from 0.00 to 5.00 Volts.
+        Sends the three 4-cell setpoint frames instead of one frame per cell. These frames carry half precision
+        floats, so setpoints are rounded to steps of 0.98 mV from 1 to 2 V, 1.95 mV from 2 to 4 V and 3.9 mV
+        from 4 to 5 V (at most half a step off). Use set_cell_V or set_V_all, which resolve 0.1 mV, when 
+        readbacks are compared against exact setpoints.
+        """
+        if self.box_id_check(boxid):
+            volts = [float(v) for v in values]
+            if len(volts) != 12:
+                raise ValueError('Expected 12 cell voltages, got %d' % len(volts))
+            frames = [ff.cell_V_1_4_frame.build(boxid, *volts[0:4]),
+                      ff.cell_V_5_8_frame.build(boxid, *volts[4:8]),
+                      ff.cell_V_9_12_frame.build(boxid, *volts[8:12])]
+            if self.latency is not None:
+                self.latency.sent(boxid, 'set_cells_V', range(1, 13), volts)
+            if self.writer is not None:
+                self.writer.set_V(boxid, dict(zip(range(1, 13), volts)), half=True)
+                return self._write_behind(boxid, _V_READBACKS, wait)
+            try:
+                for tx_msg in frames:
+                    self._send(tx_msg)
+                received = self.wait_readback(boxid, _V_READBACKS) if wait else True
+                return self.bus_ok() and received
+            except(pcan.PcanError, pcan.PcanCanOperationError) as e:
+                print("An error occurred sending cell voltage setpoints to the BS1200:", e)
+                self.reset()
+
     def readback_cell_V(self, boxid: int, channel: int) -> float:
         """
         Readback voltage value of designated cell channel 1-12. 
+        NaN until the unit's first frame holding the cell is received, like every cell and AI readback.
         """
         if self.box_id_check(boxid):
             try:
-                readbacks = [self.rx_cache[288+boxid], 
-                             self.rx_cache[304+boxid], 
-                             self.rx_cache[320+boxid]]
-                frame_i, cell_i  = (channel-1) // 4, (channel-1) % 4
-                rx_msg = readbacks[frame_i]
-                cell_volts = self.scale_volts(unpack('<H', rx_msg.data[cell_i*2:cell_i*2+2])[0], True)
+                cell_volts = self._readback_channel(boxid, _V_LAYOUT, channel)
                 return cell_volts
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("Error getting cell "+str(channel)+" Voltage: ", e)
@@ -259,29 +847,23 @@ class BS1200(object):
         Return list of voltage values (V) for all cell channels.
         """
         if self.box_id_check(boxid):
-            rx_frames = [self.rx_cache[288+boxid], 
-                         self.rx_cache[304+boxid], 
-                         self.rx_cache[320+boxid]]
-            cell_volts = 12*[None]
-            
-            for channel in range(1,13):
-                frame, start, end = ((channel-1)//4, 2*((channel-1)%4), 2*((channel-1)%4)+2)
-                cell_volts[channel-1] = self.scale_volts(unpack('<H', rx_frames[frame].data[start:end])[0], True)     
+            cell_volts = self._readback_group(boxid, _V_LAYOUT, _V_CODEC)
             return cell_volts
 
-    def set_cell_I_sink(self, boxid: int, channel: int, sink_current: float, wait: bool = False) -> Message:
+    def set_cell_I_sink(self, boxid: int, channel: int, sink_current: float, wait: bool = False) -> bool:
         """
         Construct and send message to set an individual cell current sinking value
         """
         if self.box_id_check(boxid):
-            amps = self.scale_current(sink_current, False)
-            tx_msg = ff.cell_current_sink_setpoint(boxid, channel, amps)
+            if self.writer is not None:
+                self.writer.set_I(boxid, sinks={channel: sink_current})
+                return self._write_behind(boxid, (_I_READBACKS[(channel-1)//4],), wait)
+            tx_msg = ff.current_sink_frame.build(boxid, channel, sink_current)
             try:
                 #use blocking receive function until rx message is recieved
-                self.bus.send(msg=tx_msg)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(tx_msg)
+                received = self.wait_readback(boxid, (_I_READBACKS[(channel-1)//4],)) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("An error occurred communicating with the BS1200:", e)
 
@@ -290,14 +872,15 @@ class BS1200(object):
         Construct and send message to set an individual cell current sourcing value
         """
         if self.box_id_check(boxid):
-            amps = self.scale_current(source_current, False)
-            tx_msg = ff.cell_current_source_setpoint(boxid, channel, amps)
+            if self.writer is not None:
+                self.writer.set_I(boxid, sources={channel: source_current})
+                return self._write_behind(boxid, (_I_READBACKS[(channel-1)//4],), wait)
+            tx_msg = ff.current_source_frame.build(boxid, channel, source_current)
             try:
                 #use blocking receive function until rx message is recieved
-                self.bus.send(msg=tx_msg)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(tx_msg)
+                received = self.wait_readback(boxid, (_I_READBACKS[(channel-1)//4],)) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("An error occurred communicating with the BS1200:", e)
                 self.reset()
@@ -307,30 +890,53 @@ class BS1200(object):
         Set the sink and sourcing current limits for all cells. Valid in range 0-0.5 A
         """
         if self.box_id_check(boxid):
-            sink_val = self.scale_current(sink_i, False) #convert to mA before applying the scaling factor
-            source_val = self.scale_current(source_i, False)
-            tx_msg = ff.cell_current_set_all(boxid, sink_val, source_val)
+            if self.writer is not None:
+                self.writer.set_I(boxid, dict.fromkeys(range(1, 13), sink_i), dict.fromkeys(range(1, 13), source_i))
+                return self._write_behind(boxid, _I_READBACKS, wait)
+            tx_msg = ff.current_set_all_frame.build(boxid, sink_i, source_i)
             try:
-                self.bus.send(tx_msg)
-                if(wait): 
-                    self.can_wait()
-                return self.bus.status_is_ok()
+                self._send(tx_msg)
+                received = self.wait_readback(boxid, _I_READBACKS) if wait else True
+                return self.bus_ok() and received
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("error setting sink and source limits for all cells:", e)
                 self.reset()
     
+    def set_cells_I(self, boxid: int, sink_currents, source_currents, wait: bool = False) -> bool:
+        """
+        Set the sink and source current limits of Cells 1-12 from two sequences (or arrays) of 12 values, 
+        valid in range 0-0.5 A. Uniform limits are sent as a single set-all frame, otherwise the 
+        per-cell frames are sent back to back with one bus status check for the whole batch.
+        """
+        if self.box_id_check(boxid):
+            sinks = [float(i) for i in sink_currents]
+            sources = [float(i) for i in source_currents]
+            if len(sinks) != 12 or len(sources) != 12:
+                raise ValueError('Expected 12 sink and 12 source currents, got %d and %d' % (len(sinks), len(sources)))
+            if self.writer is not None:
+                self.writer.set_I(boxid, dict(zip(range(1, 13), sinks)), dict(zip(range(1, 13), sources)))
+                return self._write_behind(boxid, _I_READBACKS, wait)
+            try:
+                if len(set(sinks)) == 1 and len(set(sources)) == 1:
+                    self._send(ff.current_set_all_frame.build(boxid, sinks[0], sources[0]))
+                else:
+                    for ch, i in enumerate(sinks, 1):
+                        self._send(ff.current_sink_frame.build(boxid, ch, i))
+                    for ch, i in enumerate(sources, 1):
+                        self._send(ff.current_source_frame.build(boxid, ch, i))
+                received = self.wait_readback(boxid, _I_READBACKS) if wait else True
+                return self.bus_ok() and received
+            except(pcan.PcanError, pcan.PcanCanOperationError) as e:
+                print("error setting sink and source limits for cells:", e)
+                self.reset()
+
     def readback_cell_I(self, boxid: int, channel: int) -> float:
         """
         Readback current value (in Amps) of designated cell channel 1-12. 
         """
         if self.box_id_check(boxid):
             try:
-                readbacks = [self.rx_cache[384+boxid], 
-                             self.rx_cache[400+boxid], 
-                             self.rx_cache[416+boxid]]
-                frame_i, cell_i  = (channel-1) // 4, (channel-1) % 4
-                rx_msg = readbacks[frame_i]
-                cell_amps = self.scale_current(int.from_bytes(rx_msg.data[cell_i*2:cell_i*2+2], 'little'), True)
+                cell_amps = self._readback_channel(boxid, _I_LAYOUT, channel)
                 return cell_amps
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("Error getting cell "+str(channel)+" Current: ", e)
@@ -341,13 +947,7 @@ class BS1200(object):
         Return current readbacks (A) for all cell channels.
         """
         if self.box_id_check(boxid):
-            rx_frames = [self.rx_cache[384+boxid], 
-                         self.rx_cache[400+boxid], 
-                         self.rx_cache[416+boxid]]
-            cell_currents = 12*[None]
-            for channel in range(1,13):
-                frame, start, end = ((channel-1)//4, 2*((channel-1)%4), 2*((channel-1)%4)+2)
-                cell_currents[channel-1] = self.scale_current(int.from_bytes(rx_frames[frame].data[start:end], 'little'), True)
+            cell_currents = self._readback_group(boxid, _I_LAYOUT, _I_CODEC)
             return cell_currents
 
     def readback_ai_v(self, boxid: int, channel: int) -> float:
@@ -356,12 +956,7 @@ class BS1200(object):
         """
         if self.box_id_check(boxid) and (channel in range(1,9)):
             try:
-                readbacks = [self.rx_cache[672+boxid], 
-                            self.rx_cache[688+boxid]]
-                frame_i, cell_i  = (channel-1) // 4, (channel-1) % 4
-                rx_msg = readbacks[frame_i]
-
-                ai_volts = self.scale_volts(unpack('<H', rx_msg.data[cell_i*2:cell_i*2+2])[0], True)
+                ai_volts = self._readback_channel(boxid, _AI_LAYOUT, channel)
                 return ai_volts
             except(pcan.PcanError, pcan.PcanCanOperationError) as e:
                 print("Error getting AI Channel "+str(channel)+" Voltage: ", e)
@@ -372,26 +967,133 @@ class BS1200(object):
         Readback Analog Input Channels 1-8
         """
         if self.box_id_check(boxid):
-            rx_frames = [self.rx_cache[672+boxid], 
-                         self.rx_cache[688+boxid]]
-            ai_volts = 8*[None]
-            for channel in range(1,9):
-                frame, start, end = ((channel-1)//4, 2*((channel-1)%4), 2*((channel-1)%4)+2)
-                ai_volts[channel-1] = self.scale_volts(int.from_bytes(rx_frames[frame].data[start:end], 'little'), True)
+            ai_volts = self._readback_group(boxid, _AI_LAYOUT, _AI_CODEC)
             return ai_volts
 
+    def _received(self, arb_id: int) -> bool:
+        """
+        False until the first frame of a readback arbitration ID arrives, its slot then holds no reading
+        """
+        return self.rx_cache.counts[self.rx_cache.slot(arb_id)] > 0
+
+    def _readback_group(self, boxid: int, layout: ff.ChannelLayout, codec: ff.FrameCodec) -> list:
+        self._check_fresh((boxid,), layout.bases)
+        values = list(codec.decode(self.rx_cache.data, self.rx_cache.offset(layout.bases[0]+boxid)))
+        for frame, base in enumerate(layout.bases):
+            if not self._received(base+boxid):
+                values[frame*layout.per_frame:(frame+1)*layout.per_frame] = layout.per_frame*[float('nan')]
+        return values
+
+    def _readback_channel(self, boxid: int, layout: ff.ChannelLayout, channel: int) -> float:
+        frame, index = divmod(channel-1, layout.per_frame)
+        base = layout.bases[frame]
+        self._check_fresh((boxid,), (base,))
+        if not self._received(base+boxid):
+            return float('nan')
+        return ff.rx_codecs[base].decode(self.rx_cache.data, self.rx_cache.offset(base+boxid))[index]
+
+    def _readback_matrix(self, box_ids: list, layout: ff.ChannelLayout) -> np.ndarray:
+        self._check_fresh(self.box_ids if box_ids is None else box_ids, layout.bases)
+        first = ff.base_rx_arbids.index(layout.bases[0])
+        rows = self.rx_cache.rows(box_ids)
+        raw = self.rx_cache.words[rows, first:first+len(layout.bases)]
+        values = raw.reshape(len(raw), layout.channels) * layout.scale + layout.offset
+        missing = self.rx_cache.frame_counts[rows, first:first+len(layout.bases)] == 0
+        values.reshape(len(raw), len(layout.bases), layout.per_frame)[missing] = np.nan
+        return values
+
+    def readback_V_matrix(self, box_ids: list = None) -> np.ndarray:
+        """
+        Return cell voltages (V) of every box in `box_ids` (defaults to all configured boxes)
+        as a float array shaped (len(box_ids), 12), NaN where a frame has not been received yet
+        """
+        return self._readback_matrix(box_ids, _V_LAYOUT)
+
+    def readback_I_matrix(self, box_ids: list = None) -> np.ndarray:
+        """
+        Return cell currents (A) of every box in `box_ids` (defaults to all configured boxes)
+        as a float array shaped (len(box_ids), 12), NaN where a frame has not been received yet
+        """
+        return self._readback_matrix(box_ids, _I_LAYOUT)
+
+    def readback_ai_matrix(self, box_ids: list = None) -> np.ndarray:
+        """
+        Return analog input voltages (V) of every box in `box_ids` (defaults to all configured boxes)
+        as a float array shaped (len(box_ids), 8), NaN where a frame has not been received yet
+        """
+        return self._readback_matrix(box_ids, _AI_LAYOUT)
+
+    def readback_snapshot(self, boxid: int) -> Snapshot:
+        """
+        Return the status, cell voltage, cell current, analog input and DIO readbacks of `boxid`
+        from its latest complete publish cycle as a Snapshot, with the cycle number and timestamp.
+        Unlike separate readback_* calls, all values come from the same cycle. 
+        Returns None until the box has completed a cycle.
+        """
+        if self.box_id_check(boxid):
+            snapshot = self.rx_cache.snapshot(boxid)
+            if snapshot is not None:
+                return decode_snapshot(*snapshot)
+
+    def stream(self, box_ids: list = None, signals: tuple = ('V', 'I'), maxlen: int = 1024, 
+               overflow: str = 'drop_oldest', timeout: float = None):
+        """
+        Generator yielding a decoded `Readback` record for each readback frame received 
+        from `box_ids` (defaults to all configured boxes) whose signal is listed in `signals` 
+        ('status', 'V', 'I', 'DIO', 'AI'). Frames are buffered in a queue of at most `maxlen` frames
+        only while the generator is being iterated; `overflow` selects 'drop_oldest' or 'block' 
+        (stall the receive thread) when the consumer falls behind. 
+        Iteration ends if no frame arrives within `timeout` seconds.
+        """
+        boxes = self.box_ids if box_ids is None else box_ids
+        arb_ids = [base+box for base, (signal, _) in readback_signals.items() 
+                   if signal in signals for box in boxes]
+        queue = ReadbackStream(self.rx_cache, maxlen, overflow)
+        self.rx_cache.add_hook(arb_ids, queue.on_frame)
+        try:
+            while True:
+                frame = queue.get(timeout)
+                if frame is None:
+                    return
+                yield decode_readback(*frame)
+        finally:
+            self.rx_cache.remove_hook(arb_ids, queue.on_frame)
+            queue.close()
+
+    def enable_history(self, capacity: int = 10000) -> History:
+        """
+        Start recording the cell voltage, cell current, analog input and temperature readbacks 
+        of every configured box with their frame timestamps. Each signal keeps the latest `capacity`
+        publish cycles in a fixed size ring buffer, so memory use does not grow over long runs.
+        """
+        if self.telemetry is None:
+            self.telemetry = History(self.rx_cache, capacity)
+            self.rx_cache.add_hook(self.telemetry.arb_ids, self.telemetry.on_frame)
+        return self.telemetry
+
+    def history(self, boxid: int, signal: str, seconds: float = None) -> tuple:
+        """
+        Returns (timestamps, values) NumPy views of the recorded `signal` ('V', 'I', 'AI' or 'T') of `boxid`
+        covering the last `seconds` before the latest sample (all held samples by default).
+        values has one row per publish cycle and one column per channel. The views share memory 
+        with the ring buffer, copy them to keep data that will be overwritten.
+        """
+        if self.telemetry is None:
+            raise RuntimeError('History recording is not enabled, call enable_history() first')
+        return self.telemetry.get(boxid, signal, seconds)
+
     def ao_set(self, boxid: int, AO1_Voltage: float, AO2_Voltage: float, wait: bool = False) -> bool:
         """
         Set the BS1200's Analog Output voltage setpoints. Valid range from 0-5 V.
         """
-        ao1_volts = self.scale_volts(AO1_Voltage, False)
-        ao2_volts = self.scale_volts(AO2_Voltage, False)
-        tx_msg = ff.ao_set_1_2(boxid, ao1_volts, ao2_volts)
+        if self.writer is not None:
+            self.writer.set_ao(boxid, AO1_Voltage, AO2_Voltage)
+            return self._write_behind(boxid, _STATUS_READBACK, wait)
+        tx_msg = ff.ao_set_frame.build(boxid, AO1_Voltage, AO2_Voltage)
         try:
-            self.bus.send(tx_msg, timeout= None)
-            if(wait): 
-                self.can_wait()
-            return self.bus.status_is_ok()
+            self._send(tx_msg)
+            received = self.wait_readback(boxid, _STATUS_READBACK) if wait else True
+            return self.bus_ok() and received
         except(pcan.PcanError, pcan.PcanCanOperationError) as e:
             print("Error occurred sending AO setpoint message to BS1200 ID {:d}:".format(boxid), e)
             self.reset()
@@ -402,27 +1104,31 @@ class BS1200(object):
         dio_dir: List of Boolean values designating direction of each DIO Channel.
                  Set 1 to configure as Output, 0 to configure as Input
         dio_en: Enables the DIO line when the direction is also set to True (1).
+        With `wait` True, blocks until the next status frame, which every unit publishes.
         """
-        tx_msg = ff.dio_set_1_8(boxid, [bool(a) for a in dio_en], [bool(a) for a in dio_dir])
+        en_bits = sum(1 << i for i, v in enumerate(dio_en) if v)
+        dir_bits = sum(1 << i for i, v in enumerate(dio_dir) if v)
+        tx_msg = ff.dio_set_frame.build(boxid, en_bits, dir_bits)
         try:
-            self.bus.send(tx_msg)
-            if(wait):
-                self.can_wait()
-            
-            return self.bus.status_is_ok()
+            self._send(tx_msg)
+            #the DIO frame is not published in HIL mode unless enabled by config_can_publishing()
+            received = self.wait_readback(boxid, _STATUS_READBACK) if wait else True
+            return self.bus_ok() and received
         except(pcan.PcanError, pcan.PcanCanOperationError) as e:
             print("Error occurred transmitting DIO Set frame to BS1200:", e)
             self.reset()
         
     def readback_dio(self, boxid) -> list:
         """
-        Returns state of Digital Input/Output Lines
+        Returns state of Digital Input/Output Lines, None until the unit's first DIO frame is received
         """
+        self._check_fresh((boxid,), _DIO_READBACK)
+        if not self._received(640+boxid):
+            return None
         try:
-            dio_read = self.rx_cache[640+boxid]
-            states = format(dio_read.data[0], '08b')
-            dio_states = [False if bit == '0' else True for bit in states]
-            return dio_states.reverse()
+            dio_read, = _DIO_CODEC.decode(self.rx_cache.data, self.rx_cache.offset(640+boxid))
+            dio_states = [bool(dio_read >> bit & 1) for bit in range(8)]
+            return dio_states
         except(pcan.PcanError, pcan.PcanCanOperationError) as e:
             print("Error reading DIO states on BS1200:", e)
             self.reset()
@@ -0,0 +1,260 @@
+import socket
+import threading
+from collections import deque
+from struct import Struct
+from time import time, perf_counter, sleep
+import numpy as np
+import can
+
+"""
+UDP readback datagrams and TCP command streams are sequences of fixed size 18 byte big endian records:
+    arbitration ID (uint32), extended ID flag (bool), frame type (uint8), 4 reserved bytes, 8 data bytes
+"""
+udp_record_dtype = np.dtype([('arb_id', '>u4'),
+                             ('extended', '?'),
+                             ('type', 'u1'),
+                             ('reserved', 'V4'),
+                             ('data', 'u1', 8)])
+UDP_RECORD_SIZE = udp_record_dtype.itemsize
+_UDP_DATA_OFFSET = udp_record_dtype.fields['data'][1]
+record_codec = Struct('>I?B4x8s')
+
+class UdpReadback(object):
+    """
+    Receives the readback datagrams BS1200 units report on UDP `port` and stores every record
+    in a RxCache from a dedicated thread. Datagrams are received into one preallocated buffer,
+    the arbitration IDs of all records are decoded in a single NumPy call and the payloads are
+    copied from the buffer straight into their cache slots.
+    """
+    def __init__(self, rx_cache, port: int, ip: str = '', buffer_size: int = 1 << 16):
+        self.rx_cache = rx_cache
+        self.port = port
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.datagrams = 0
+        self.frames = 0
+        self.malformed = 0 #datagrams whose length is not a whole number of records
+        self.error = None
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            self.socket.bind((ip, port))
+            self.socket.settimeout(0.1)
+        except OSError:
+            self.socket.close()
+            raise
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bs1200-udp-%d' % port, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        recv_into, view = self.socket.recv_into, self.view
+        while not self._stop.is_set():
+            try:
+                n = recv_into(self.buffer)
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if not self._stop.is_set():
+                    self.error = e
+                return
+            timestamp = time()
+            count, extra = divmod(n, UDP_RECORD_SIZE)
+            self.datagrams += 1
+            self.frames += count
+            if extra:
+                self.malformed += 1
+            records = np.frombuffer(self.buffer, dtype=udp_record_dtype, count=count)
+            #extended IDs are moved out of the cached 11 bit range
+            arb_ids = (records['arb_id'] | records['extended'].astype('>u4') << 31).tolist()
+            put = self.rx_cache.put #looked up per datagram, the driver can replace the cache
+            start = _UDP_DATA_OFFSET
+            for arb_id in arb_ids:
+                put(arb_id, view[start:start+8], timestamp)
+                start += UDP_RECORD_SIZE
+
+    def close(self):
+        """
+        Stop the receive thread and close the socket
+        """
+        self._stop.set()
+        self._thread.join()
+        self.socket.close()
+
+class TcpUnit(object):
+    """
+    Persistent TCP command connection to one BS1200 unit. Queued records are written by a dedicated
+    thread: everything queued since the previous write is joined into a single sendall(), 
+    and writes are paced at least `interval_ms` apart. Socket errors are kept in `error`, 
+    the connection is reopened on the next write. Records that could not be written stay queued 
+    and are retried every `retry_ms` (or `interval_ms` if longer), only records still unwritten 
+    when the connection is closed are given up and counted in `dropped`.
+    """
+    def __init__(self, ip: str, port: int, interval_ms: float, connect_timeout: float = 1.0, retry_ms: float = 100):
+        self.address = (ip, port)
+        self.interval = interval_ms / 1000
+        self.retry = max(retry_ms / 1000, self.interval)
+        self.connect_timeout = connect_timeout
+        self.socket = None
+        self.error = None
+        self.writes = 0
+        self.records = 0
+        self.dropped = 0
+        #records queued and records written (or dropped) so far, flush() waits for the second to catch up
+        self.queued = 0
+        self.done = 0
+        self._queue = deque()
+        lock = threading.Lock()
+        self._cond = threading.Condition(lock)
+        self._written = threading.Condition(lock)
+        self._closed = False
+        self._connect()
+        self._thread = threading.Thread(target=self._run, name='bs1200-tcp-%s:%d' % self.address, daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        try:
+            self.socket = socket.create_connection(self.address, self.connect_timeout)
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.error = None
+        except OSError as e:
+            self.socket = None
+            self.error = e
+
+    def put(self, record: bytes):
+        with self._cond:
+            self._queue.append(record)
+            self.queued += 1
+            self._cond.notify()
+
+    def _run(self):
+        queue = self._queue
+        next_write = perf_counter()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: queue or self._closed)
+                if not queue:
+                    return
+                closed = self._closed
+            delay = next_write - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            with self._cond:
+                records = list(queue)
+                queue.clear()
+            if self.socket is None:
+                self._connect()
+            written = False
+            if self.socket is not None:
+                try:
+                    self.socket.sendall(b''.join(records))
+                    self.writes += 1
+                    self.records += len(records)
+                    written = True
+                except OSError as e:
+                    self.error = e
+                    self.socket.close()
+                    self.socket = None
+            with self._cond:
+                if written or closed:
+                    if not written:
+                        self.dropped += len(records)
+                    self.done += len(records)
+                    self._written.notify_all()
+                else:
+                    #keep them ahead of the records queued meanwhile for the next attempt
+                    queue.extendleft(reversed(records))
+            next_write = perf_counter() + (self.interval if written else self.retry)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until the records queued before this call have been written to the socket, returns False on timeout
+        """
+        with self._cond:
+            target = self.queued
+            return self._written.wait_for(lambda: self.done >= target or not self._thread.is_alive(), timeout)
+
+    def close(self):
+        """
+        Write the queued records, stop the writer thread and close the connection
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+class TcpCommandBus(can.BusABC):
+    """
+    can.BusABC sending BS1200 commands over TCP, so the driver's setters work unchanged with units 
+    configured for Protocol.Ethernet. `ethernet` maps Box IDs to their Ethernet_Settings, and one 
+    TcpUnit connection is kept per unit. Frames for other Box IDs are passed to the `fallback` bus
+    (e.g. a PcanBus) if one is given. send() only packs and queues the frame, so it is safe to 
+    reuse the Message right after, and flush() waits until the frames queued for a unit are written
+    to its socket. status_is_ok() reports the connection state, see stats() for the record counts.
+    Receiving is not supported, readbacks arrive over UDP (see UdpReadback).
+    """
+    def __init__(self, ethernet: dict, fallback: can.BusABC = None, connect_timeout: float = 1.0, **kwargs):
+        super().__init__(channel='tcp', **kwargs)
+        self.channel_info = 'BS1200 TCP command transport'
+        self.fallback = fallback
+        self.units = 16*[None]
+        connections = {}
+        try:
+            for boxid, eth in ethernet.items():
+                key = (eth.IP_Address, eth.Command_Port)
+                if key not in connections:
+                    connections[key] = TcpUnit(eth.IP_Address, eth.Command_Port, eth.Command_Interval_ms, connect_timeout)
+                self.units[boxid] = connections[key]
+        except Exception:
+            for unit in connections.values():
+                unit.close()
+            raise
+        self.connections = list(connections.values())
+
+    def send(self, msg: can.Message, timeout: float = None):
+        unit = self.units[msg.arbitration_id & 0xF] if not msg.is_extended_id else None
+        if unit is None:
+            if self.fallback is None:
+                raise can.CanOperationError('No transport for arbitration ID %d' % msg.arbitration_id)
+            return self.fallback.send(msg, timeout)
+        unit.put(record_codec.pack(msg.arbitration_id, False, 0, bytes(msg.data)))
+
+    def _recv_internal(self, timeout):
+        return None, False
+
+    def status_is_ok(self) -> bool:
+        ok = all(unit.error is None for unit in self.connections)
+        status_is_ok = getattr(self.fallback, 'status_is_ok', None)
+        if status_is_ok is not None:
+            ok = status_is_ok() and ok
+        return ok
+
+    def flush(self, boxid: int = None, timeout: float = None) -> bool:
+        """
+        Wait until the frames queued for `boxid` (every unit by default) are written to the unit's socket.
+        Returns False on timeout, True right away for Box IDs sent over the fallback bus.
+        """
+        units = self.connections if boxid is None else [u for u in self.units[boxid:boxid+1] if u is not None]
+        return all([unit.flush(timeout) for unit in units])
+
+    def flush_tx_buffer(self):
+        self.flush()
+
+    def stats(self) -> dict:
+        """
+        Returns per unit address: sendall() writes, records written, records waiting to be written
+        and records dropped because they were still unwritten when the connection was closed
+        """
+        return {'%s:%d' % unit.address: {'writes': unit.writes, 'records': unit.records,
+                                         'pending': unit.queued - unit.done, 'dropped': unit.dropped}
+                for unit in self.connections}
+
+    def shutdown(self):
+        for unit in self.connections:
+            unit.close()
+        if self.fallback is not None:
+            self.fallback.shutdown()
+        super().shutdown()
@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from bs1200.driver import BS1200
+
+class BS1200Fleet(object):
+    """
+    Coordinates BS1200 units spread over several PCAN channels.
+    Class constructor has the following arguments:
+        - units    (required): dict mapping a unit name to its (pcan_channel, box_id)
+        - bit_rate (optional): Bitrate used on every channel, defaults to 1000000
+        - readback_timeout_ms (optional): passed to each channel's BS1200
+        - interface (optional): python-can interface of the channels, defaults to 'pcan'
+    Each channel gets its own BS1200 (whose notifier thread receives that bus) and its own
+    transmit thread, so commands fanned out to units on different channels are sent in parallel.
+    """
+    def __init__(self, units: dict, bit_rate = 1000000, readback_timeout_ms = 100, interface: str = 'pcan'):
+        self.units = OrderedDict(units)
+        self.names = list(self.units)
+        boxes = OrderedDict()
+        for name, (channel, boxid) in self.units.items():
+            if boxid in boxes.setdefault(channel, []):
+                raise ValueError('Box ID %d is assigned twice on %s' % (boxid, channel))
+            boxes[channel].append(boxid)
+        self.channels = OrderedDict()
+        self._tx = OrderedDict()
+        try:
+            for channel, box_ids in boxes.items():
+                self.channels[channel] = BS1200(list(box_ids), channel, bit_rate,
+                                                readback_timeout_ms = readback_timeout_ms, interface = interface)
+                self._tx[channel] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bs1200-tx-'+channel)
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, execption_val, tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        """
+        Stops the transmit threads and shuts down every bus
+        """
+        for executor in self._tx.values():
+            executor.shutdown(wait=True)
+        for bs in self.channels.values():
+            bs.close()
+
+    def unit(self, name: str) -> tuple:
+        """
+        Returns the (BS1200, box_id) driving unit `name`
+        """
+        channel, boxid = self.units[name]
+        return self.channels[channel], boxid
+
+    def _by_channel(self, names: list) -> OrderedDict:
+        """
+        Group unit names by channel: {channel: [(position in names, name, box_id), ...]}
+        """
+        groups = OrderedDict()
+        for i, name in enumerate(names):
+            channel, boxid = self.units[name]
+            groups.setdefault(channel, []).append((i, name, boxid))
+        return groups
+
+    def _run(self, names: list, call) -> dict:
+        """
+        Run call(bs, name, box_id) for every unit in `names` on the transmit thread of its channel,
+        waits for all channels and returns the results keyed by unit name
+        """
+        def run(bs, units):
+            return [(name, call(bs, name, boxid)) for _, name, boxid in units]
+        futures = [self._tx[channel].submit(run, self.channels[channel], units)
+                   for channel, units in self._by_channel(names).items()]
+        results = {}
+        for future in futures:
+            results.update(future.result())
+        return results
+
+    def fan_out(self, method: str, *args, names: list = None, **kwargs) -> dict:
+        """
+        Call the BS1200 `method` with (box_id, *args, **kwargs) for every unit in `names`
+        (all units by default, `names` is keyword only), channels are served in parallel by their transmit threads.
+        Returns the results keyed by unit name.
+        """
+        return self._run(self.names if names is None else names, 
+                         lambda bs, name, boxid: getattr(bs, method)(boxid, *args, **kwargs))
+
+    def set_cells_V(self, values, names: list = None, wait: bool = False) -> dict:
+        """
+        Set the 12 cell voltages of each unit in `names` (all units by default)
+        from the matching row of `values`, an array shaped (len(names), 12)
+        """
+        names = self.names if names is None else names
+        values = np.asarray(values, dtype=float)
+        if values.shape != (len(names), 12):
+            raise ValueError('Expected cell voltages shaped (%d, 12), got %s' % (len(names), values.shape))
+        rows = dict(zip(names, values))
+        return self._run(names, lambda bs, name, boxid: bs.set_cells_V(boxid, rows[name], wait))
+
+    def set_V_all(self, tgt_volt: float, names: list = None, wait: bool = False) -> dict:
+        return self.fan_out('set_V_all', tgt_volt, wait, names=names)
+
+    def set_I_all(self, sink_i: float, source_i: float, names: list = None, wait: bool = False) -> dict:
+        return self.fan_out('set_I_all', sink_i, source_i, wait, names=names)
+
+    def cell_enable_all(self, status: bool, names: list = None, wait: bool = False) -> dict:
+        return self.fan_out('cell_enable_all', status, wait, names=names)
+
+    def hil_mode(self, enable_HIL: bool, names: list = None, wait: bool = False) -> dict:
+        return self.fan_out('hil_mode', enable_HIL, wait, names=names)
+
+    def _readback_matrix(self, names: list, method: str, channels: int) -> np.ndarray:
+        names = self.names if names is None else names
+        out = np.empty((len(names), channels))
+        for channel, units in self._by_channel(names).items():
+            rows = [i for i, _, _ in units]
+            out[rows] = getattr(self.channels[channel], method)([boxid for _, _, boxid in units])
+        return out
+
+    def readback_V_matrix(self, names: list = None) -> np.ndarray:
+        """
+        Return the cell voltages (V) of the units in `names` (all units by default) shaped (len(names), 12)
+        """
+        return self._readback_matrix(names, 'readback_V_matrix', 12)
+
+    def readback_I_matrix(self, names: list = None) -> np.ndarray:
+        """
+        Return the cell currents (A) of the units in `names` (all units by default) shaped (len(names), 12)
+        """
+        return self._readback_matrix(names, 'readback_I_matrix', 12)
+
+    def readback_ai_matrix(self, names: list = None) -> np.ndarray:
+        """
+        Return the analog input voltages (V) of the units in `names` (all units by default) shaped (len(names), 8)
+        """
+        return self._readback_matrix(names, 'readback_ai_matrix', 8)
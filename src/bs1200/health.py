@@ -0,0 +1,99 @@
+import threading
+from can.interfaces.pcan import basic as pcan_basic
+
+#PCAN-Basic status bits counted by HealthMonitor, checked in this order
+_STATUS_EVENTS = (('bus_off', pcan_basic.PCAN_ERROR_BUSOFF),
+                  ('bus_passive', pcan_basic.PCAN_ERROR_BUSPASSIVE),
+                  ('bus_warning', pcan_basic.PCAN_ERROR_BUSHEAVY | pcan_basic.PCAN_ERROR_BUSLIGHT),
+                  ('overruns', pcan_basic.PCAN_ERROR_QOVERRUN | pcan_basic.PCAN_ERROR_OVERRUN),
+                  ('tx_queue_full', pcan_basic.PCAN_ERROR_QXMTFULL))
+
+class HealthMonitor(object):
+    """
+    Watches the bus state from a background thread instead of querying it after every send.
+    Every `interval` seconds the thread reads status_is_ok() of `bus` into `ok`, and the PCAN-Basic
+    status code of `can_bus` when it reports one (PcanBus.status()). Entering bus-off, error passive,
+    bus warning, receive overrun or full transmit queue states is counted once per transition.
+    on_message() is a notifier listener counting error frames. PCAN error frames carry the direction
+    (0 transmit, 1 receive) in data byte 0 and the controller's receive and transmit error counters
+    in data bytes 2 and 3. send_failed() records frames the driver could not send from its own threads
+    (e.g. the frames replayed after a reconnect) instead of raising them into a caller.
+    """
+    def __init__(self, bus, can_bus = None, interval: float = 0.05):
+        self.bus = bus
+        self.can_bus = can_bus
+        self.interval = interval
+        self.ok = True
+        self.status = pcan_basic.PCAN_ERROR_OK
+        self.polls = 0
+        self.failed_polls = 0
+        self.counts = dict.fromkeys([name for name, _ in _STATUS_EVENTS], 0)
+        self.error_frames = 0
+        self.tx_errors = 0
+        self.rx_errors = 0
+        self.tx_error_counter = 0
+        self.rx_error_counter = 0
+        self.send_errors = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bs1200-health', daemon=True)
+        self._thread.start()
+
+    def _poll(self):
+        #looked up on every poll, the driver replaces the buses when it reconnects
+        status_is_ok = getattr(self.bus, 'status_is_ok', None)
+        get_status = getattr(self.can_bus, 'status', None)
+        try:
+            ok = status_is_ok() if status_is_ok is not None else True
+            status = get_status() if get_status is not None else pcan_basic.PCAN_ERROR_OK
+        except Exception as e:
+            #e.g. the adapter was unplugged, keep polling so recovery is seen
+            self.error = e
+            ok, status = False, self.status
+        for name, bits in _STATUS_EVENTS:
+            if status & bits and not self.status & bits:
+                self.counts[name] += 1
+        self.status = status
+        self.ok = ok
+        self.polls += 1
+        if not ok:
+            self.failed_polls += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._poll()
+
+    def on_message(self, msg):
+        if msg.is_error_frame:
+            self.error_frames += 1
+            data = msg.data
+            if len(data) >= 4:
+                if data[0]:
+                    self.rx_errors += 1
+                else:
+                    self.tx_errors += 1
+                self.rx_error_counter = data[2]
+                self.tx_error_counter = data[3]
+
+    def send_failed(self, error: Exception):
+        """
+        Count a failed send, the bus is reported not ok until the next poll
+        """
+        self.send_errors += 1
+        self.error = error
+        self.ok = False
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        """
+        Returns the latest bus state and the cumulative error counts
+        """
+        result = {'ok': self.ok, 'status': self.status, 'polls': self.polls, 'failed_polls': self.failed_polls}
+        result.update(self.counts)
+        result.update({'error_frames': self.error_frames, 'tx_errors': self.tx_errors, 'rx_errors': self.rx_errors,
+                       'tx_error_counter': self.tx_error_counter, 'rx_error_counter': self.rx_error_counter,
+                       'send_errors': self.send_errors, 'last_error': self.error})
+        return result
@@ -0,0 +1,98 @@
+import numpy as np
+import bs1200.can_frames as ff
+from bs1200.rx_cache import FRAME_SIZE
+
+#Channel layouts of the signals recorded by History, the row of a signal 
+#advances each time its first frame is received
+history_signals = {signal: ff.channel_layout(signal) for signal in ('V', 'I', 'AI', 'T')}
+
+class SignalRing(object):
+    """
+    Fixed capacity ring of timestamped rows. Every row is written twice, at `head` and `head+capacity`,
+    so the latest `capacity` rows are always available as one contiguous slice of the arrays.
+    """
+    def __init__(self, capacity: int, channels: int):
+        self.capacity = capacity
+        self.times = np.zeros(2*capacity)
+        self.values = np.zeros((2*capacity, channels))
+        self.head = -1
+        self.count = 0
+
+    def advance(self, timestamp: float):
+        """
+        Start a new row, carrying forward the previous row's values until they are overwritten
+        """
+        prev = self.head
+        head = self.head = (prev + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+        self.times[head] = self.times[head+self.capacity] = timestamp
+        if prev >= 0:
+            self.values[head] = self.values[head+self.capacity] = self.values[prev]
+
+    def write(self, start: int, values):
+        """
+        Write `values` to the current row from column `start`
+        """
+        head = self.head
+        if head >= 0:
+            stop = start + len(values)
+            self.values[head, start:stop] = values
+            self.values[head+self.capacity, start:stop] = values
+
+    def last(self, seconds: float = None) -> tuple:
+        """
+        Returns (times, values) views of the rows received within `seconds` of the latest row,
+        or all rows held by the ring if `seconds` is None
+        """
+        stop = self.head + self.capacity + 1
+        start = stop - self.count
+        if seconds is not None and self.count:
+            start += int(np.searchsorted(self.times[start:stop], self.times[stop-1] - seconds))
+        return self.times[start:stop], self.values[start:stop]
+
+class History(object):
+    """
+    Records the V, I, AI and temperature readbacks of every box in a RxCache into SignalRings,
+    holding the latest `capacity` publish cycles of each signal. Attach on_frame() as a RxCache hook.
+    """
+    def __init__(self, rx_cache, capacity: int = 10000):
+        if capacity < 1:
+            raise ValueError('History capacity must be at least 1')
+        self.rx_cache = rx_cache
+        self.capacity = capacity
+        self.rings = {}
+        #per slot (ring, first column, starts row, raw value view, scale, offset), None for slots not recorded
+        self._targets = len(rx_cache.timestamps)*[None]
+        self.arb_ids = []
+        for box in rx_cache.box_ids:
+            for signal, layout in history_signals.items():
+                ring = self.rings[(box, signal)] = SignalRing(capacity, layout.channels)
+                for i, base in enumerate(layout.bases):
+                    slot = rx_cache.slot(base+box)
+                    raw = np.frombuffer(rx_cache.data, dtype='<'+layout.code, count=layout.per_frame, 
+                                        offset=slot*FRAME_SIZE + layout.start)
+                    self._targets[slot] = (ring, i*layout.per_frame, i == 0, raw, layout.scale, layout.offset)
+                    self.arb_ids.append(base+box)
+
+    def on_frame(self, arb_id: int, slot: int, timestamp: float):
+        """
+        RxCache hook, decodes the stored frame into its signal ring
+        """
+        target = self._targets[slot]
+        if target is None:
+            return
+        ring, column, starts_row, raw, scale, offset = target
+        if starts_row:
+            ring.advance(timestamp)
+        ring.write(column, raw*scale + offset)
+
+    def get(self, boxid: int, signal: str, seconds: float = None) -> tuple:
+        """
+        Returns (times, values) array views of the `signal` history of `boxid`
+        """
+        try:
+            ring = self.rings[(boxid, signal)]
+        except KeyError:
+            raise KeyError('No %s history for Box ID %d' % (signal, boxid))
+        return ring.last(seconds)
@@ -0,0 +1,163 @@
+import threading
+from time import perf_counter
+import numpy as np
+import bs1200.can_frames as ff
+
+_V_LAYOUT = ff.channel_layout('V')
+
+class LatencyHistogram(object):
+    """
+    HDR style histogram of latencies recorded in microseconds. Values below 2**`precision_bits`
+    have their own bucket, larger values share log-linear buckets holding 2**(precision_bits-1)
+    sub-buckets per power of two, so the relative error of any reported value is below 2**(1-precision_bits).
+    Memory use is fixed by the `highest_s` trackable latency, larger values are clamped.
+    """
+    def __init__(self, highest_s: float = 10.0, precision_bits: int = 7):
+        self.bits = precision_bits
+        self.sub = 1 << precision_bits
+        self.half = self.sub >> 1
+        self.highest = int(highest_s*1e6)
+        self.counts = np.zeros(self._index(self.highest) + 1, dtype=np.int64)
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, us: int) -> int:
+        if us < self.sub:
+            return us
+        shift = us.bit_length() - self.bits
+        return self.sub + (shift-1)*self.half + (us >> shift) - self.half
+
+    def _value(self, index: int) -> int:
+        """
+        Lowest value counted in bucket `index`
+        """
+        if index < self.sub:
+            return index
+        shift, sub = divmod(index - self.sub, self.half)
+        return (sub + self.half) << (shift + 1)
+
+    def record(self, seconds: float):
+        us = min(max(int(seconds*1e6), 0), self.highest)
+        self.counts[self._index(us)] += 1
+        self.total += 1
+        self.sum += us
+        if self.min is None or us < self.min:
+            self.min = us
+        if self.max is None or us > self.max:
+            self.max = us
+
+    def percentile(self, p: float) -> float:
+        """
+        Returns the latency in seconds at or below which `p` percent of the recorded values fall
+        """
+        if not self.total:
+            return None
+        rank = max(int(np.ceil(p/100*self.total)), 1)
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self._value(index), self.max)/1e6
+
+    def summary(self) -> dict:
+        """
+        Returns the count and the min, mean, 50th, 90th, 99th percentile and max latency in seconds
+        """
+        if not self.total:
+            return {'count': 0}
+        return {'count': self.total, 'min': self.min/1e6, 'mean': self.sum/self.total/1e6,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'max': self.max/1e6}
+
+class LatencyMonitor(object):
+    """
+    Measures the time from sending a cell voltage setpoint until the readback of every commanded
+    channel is within `tolerance` Volts of the setpoint. Setters register the sent setpoint with
+    sent(), and on_frame() runs as a RxCache hook on the cell voltage readbacks to detect convergence.
+    Setpoints are pending per cell, so setpoints to different cells of a box are measured side by side.
+    Latencies are recorded in one LatencyHistogram per (Box ID, command). A setpoint that does not
+    converge within `timeout` seconds, or one of whose cells is given a newer setpoint first,
+    is counted in `timeouts` or `superseded` instead.
+    """
+    def __init__(self, rx_cache, tolerance: float = 0.005, timeout: float = 1.0):
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.histograms = {}
+        self.timeouts = 0
+        self.superseded = 0
+        self._lock = threading.Lock()
+        #pending (sent time, command, channel indices, targets) of each cell, per Box ID
+        self._pending = [_V_LAYOUT.channels*[None] for _ in range(16)]
+        self._raw = 16*[None]
+        #cell indices read back by each voltage frame
+        self._cells = {base: (i*_V_LAYOUT.per_frame, (i+1)*_V_LAYOUT.per_frame) for i, base in enumerate(_V_LAYOUT.bases)}
+        self.arb_ids = []
+        first = ff.base_rx_arbids.index(_V_LAYOUT.bases[0])
+        for row, box in enumerate(rx_cache.box_ids):
+            self._raw[box] = rx_cache.words[row, first:first+len(_V_LAYOUT.bases)].reshape(-1)
+            self.arb_ids.extend(base+box for base in _V_LAYOUT.bases)
+
+    def sent(self, boxid: int, command: str, channels, targets):
+        """
+        Register a setpoint sent to `boxid`: `targets` Volts for the 1-based cell `channels`
+        """
+        entry = (perf_counter(), command, np.asarray(channels) - 1, np.asarray(targets, dtype=float))
+        pending = self._pending[boxid]
+        with self._lock:
+            for c in entry[2]:
+                old = pending[c]
+                if old is not None:
+                    self.superseded += 1
+                    self._clear(pending, old)
+                pending[c] = entry
+
+    def _clear(self, pending: list, entry) -> bool:
+        """
+        Remove `entry` from the pending cells, returns False if it was no longer pending
+        """
+        found = False
+        for c in entry[2]:
+            if pending[c] is entry:
+                pending[c] = None
+                found = True
+        return found
+
+    def on_frame(self, arb_id: int, slot: int, timestamp: float):
+        """
+        RxCache hook, records the latency of the pending setpoints of the frame's cells once their readbacks converge
+        """
+        boxid = arb_id & 0xF
+        pending = self._pending[boxid]
+        lo, hi = self._cells[arb_id - boxid]
+        now = None
+        checked = None
+        for entry in pending[lo:hi]:
+            if entry is None or entry is checked:
+                continue
+            checked = entry
+            if now is None:
+                now = perf_counter()
+            start, command, channels, targets = entry
+            volts = self._raw[boxid][channels]*_V_LAYOUT.scale + _V_LAYOUT.offset
+            converged = bool(np.all(np.abs(volts - targets) <= self.tolerance))
+            if not converged and now - start <= self.timeout:
+                continue
+            with self._lock:
+                if not self._clear(pending, entry):
+                    continue
+                if converged:
+                    key = (boxid, command)
+                    if key not in self.histograms:
+                        self.histograms[key] = LatencyHistogram()
+                    self.histograms[key].record(now - start)
+                else:
+                    self.timeouts += 1
+
+    def stats(self) -> dict:
+        """
+        Returns latency summaries keyed by (Box ID, command), plus the 'timeouts' and 'superseded' counts
+        """
+        with self._lock:
+            result = {key: hist.summary() for key, hist in sorted(self.histograms.items())}
+            result['timeouts'] = self.timeouts
+            result['superseded'] = self.superseded
+        return result
@@ -0,0 +1,121 @@
+import threading
+import warnings
+from collections import deque
+from time import perf_counter
+import bs1200.can_frames as ff
+
+#nominal bits on the wire of a classic standard ID frame with 8 data bytes,
+#including the interframe space but not stuff bits
+FRAME_BITS = 111
+
+class StaleReadbackError(RuntimeError):
+    """
+    Raised by readback methods when the frames they read are older than the monitor's limit
+    """
+
+class RxMonitor(object):
+    """
+    Watches the receive rate, inter-arrival gaps and age of every readback frame of a RxCache.
+    The per frame bookkeeping is done by RxCache.put(), this monitor only reads it:
+        - a background thread polls every `stale_after`/2 seconds, measures the receive rates over
+          `rate_window` seconds from the arrival counts, and records a ('stale' or 'fresh')
+          event when a frame has not been received for `stale_after` seconds or starts arriving again,
+          `callback(arb_id, stale, age)` is called for each event if given
+        - stats(), rates() and bus_load() summarize the frames received so far
+        - check() is used by the readback methods, `action` selects 'raise' (StaleReadbackError),
+          'warn' (a RuntimeWarning, the stale values are still returned) or 'ignore'
+    Frames that have never been received are stale.
+    """
+    actions = ('raise', 'warn', 'ignore')
+
+    def __init__(self, rx_cache, stale_after: float = 0.05, action: str = 'raise', callback = None,
+                 bit_rate: int = 1000000, max_events: int = 1000, rate_window: float = 1.0):
+        if action not in self.actions:
+            raise ValueError('Invalid stale readback action: %s' % action)
+        self.rx_cache = rx_cache
+        self.stale_after = stale_after
+        self.action = action
+        self.callback = callback
+        self.bit_rate = bit_rate
+        self.arb_ids = [base+box for box in rx_cache.box_ids for base in ff.base_rx_arbids]
+        self.rate_window = rate_window
+        self._slots = [rx_cache.slot(a) for a in self.arb_ids]
+        self._window = (perf_counter(), list(rx_cache.counts))
+        self._rates = len(self.arb_ids)*[0.0]
+        self.events = deque(maxlen=max_events)
+        self.stale = set(self.arb_ids)
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bs1200-rx-monitor', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.stale_after/2):
+            now = perf_counter()
+            start, counts = self._window
+            if now - start >= self.rate_window:
+                latest = list(self.rx_cache.counts)
+                self._rates = [(latest[s] - counts[s])/(now - start) for s in self._slots]
+                self._window = (now, latest)
+            for arb_id, age in zip(self.arb_ids, self.rx_cache.ages(self.arb_ids)):
+                stale = age > self.stale_after
+                if stale == (arb_id in self.stale):
+                    continue
+                if stale:
+                    self.stale.add(arb_id)
+                else:
+                    self.stale.discard(arb_id)
+                self.events.append((perf_counter(), arb_id, 'stale' if stale else 'fresh'))
+                if self.callback is not None:
+                    try:
+                        self.callback(arb_id, stale, age)
+                    except Exception as e:
+                        self.error = e
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def check(self, arb_ids: list):
+        """
+        Apply the stale `action` if any frame of `arb_ids` is older than `stale_after`
+        """
+        if self.action == 'ignore':
+            return
+        ages = self.rx_cache.ages(arb_ids)
+        stale = [(a, age) for a, age in zip(arb_ids, ages) if age > self.stale_after]
+        if stale:
+            text = ', '.join('ID %d (%.1f ms)' % (a, age*1000) if age != float('inf') else 'ID %d (never received)' % a
+                             for a, age in stale)
+            if self.action == 'raise':
+                raise StaleReadbackError('Stale readback frames: ' + text)
+            warnings.warn('Stale readback frames: ' + text, RuntimeWarning, stacklevel=3)
+
+    def rates(self) -> dict:
+        """
+        Returns the receive rate in frames per second of every readback arbitration ID,
+        measured over the last complete `rate_window` (0.0 until the first window completes)
+        """
+        return dict(zip(self.arb_ids, self._rates))
+
+    def bus_load(self) -> float:
+        """
+        Estimate the fraction of the bus bandwidth used by the readback frames of the monitored boxes
+        """
+        return sum(self.rates().values())*FRAME_BITS/self.bit_rate
+
+    def stats(self) -> dict:
+        """
+        Returns per readback arbitration ID: frames received, receive rate (Hz), mean and longest
+        inter-arrival time and age of the last frame (seconds), and whether the frame is stale
+        """
+        cache = self.rx_cache
+        rates = self.rates()
+        ages = cache.ages(self.arb_ids)
+        result = {}
+        for a, age in zip(self.arb_ids, ages):
+            slot = cache.slot(a)
+            result[a] = {'count': cache.counts[slot], 'rate_hz': rates[a], 
+                         'interval': 1/rates[a] if rates[a] else float('inf'),
+                         'max_gap': cache.max_gaps[slot], 'age': age, 'stale': age > self.stale_after}
+        return result
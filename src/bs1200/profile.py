@@ -0,0 +1,120 @@
+import threading
+from time import perf_counter, sleep
+import numpy as np
+import can
+import bs1200.can_frames as ff
+from bs1200.latency import LatencyHistogram
+
+
+class ProfilePlayer(object):
+    """
+    Plays cell voltage profiles to one or more boxes from a dedicated thread at a fixed rate.
+    `profiles` maps each Box ID to an array of cell voltages shaped (samples, 12), row k is sent
+    at the absolute deadline start + k*period on the monotonic perf_counter() clock, so sleep jitter
+    does not accumulate. Samples whose deadline passed by a whole period are skipped (an overrun)
+    to keep the playback aligned with time. The lateness of every sent row, over every pass of a
+    looped profile, is recorded in the `lateness` LatencyHistogram with a running sum of squares.
+        - spin_s: the last part of each wait is spent polling the clock instead of sleeping
+        - loop:   restart the profile when the last row has been sent, until stop() is called
+    """
+    def __init__(self, bus: can.BusABC, profiles: dict, rate_hz: float, spin_s: float = 0.001, loop: bool = False):
+        if rate_hz <= 0:
+            raise ValueError('Profile rate must be positive')
+        self.bus = bus
+        self.profiles = {}
+        for boxid, values in profiles.items():
+            values = np.asarray(values, dtype=float)
+            if values.ndim != 2 or values.shape[1] != 12:
+                raise ValueError('Profile for Box ID %d must be shaped (samples, 12), got %s' % (boxid, values.shape))
+            self.profiles[boxid] = values
+        samples = set(len(values) for values in self.profiles.values())
+        if len(samples) != 1:
+            raise ValueError('All profiles must have the same number of samples')
+        self.samples = samples.pop()
+        self.period = 1/rate_hz
+        self.spin = spin_s
+        self.loop = loop
+        self.lateness = LatencyHistogram()
+        self._late_sum = 0.0
+        self._late_squares = 0.0
+        self.sent = 0
+        self.overruns = 0
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bs1200-profile', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = None):
+        """
+        Stop playback after the current row and wait for the thread to exit
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def join(self, timeout: float = None) -> bool:
+        """
+        Wait for playback to finish, returns True if the thread has exited
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def _send_row(self, row: int):
+        for boxid, values in self.profiles.items():
+            volts = values[row].tolist()
+            for i, template in enumerate(ff.cell_V_frames):
+                self.bus.send(template.build(boxid, *volts[4*i:4*i+4]))
+
+    def _run(self):
+        period, spin = self.period, self.spin
+        start = perf_counter()
+        k = 0
+        try:
+            while not self._stop.is_set():
+                row = k % self.samples
+                if k and row == 0 and not self.loop:
+                    break
+                deadline = start + k*period
+                remaining = deadline - perf_counter()
+                if remaining > spin:
+                    sleep(remaining - spin)
+                while perf_counter() < deadline:
+                    pass
+                self._send_row(row)
+                late = perf_counter() - deadline
+                self.lateness.record(late)
+                self._late_sum += late
+                self._late_squares += late*late
+                self.sent += 1
+                #skip rows whose deadline has already passed
+                missed = int(late // period)
+                if missed:
+                    self.overruns += missed
+                    if not self.loop:
+                        missed = min(missed, self.samples - row - 1)
+                        if missed <= 0:
+                            break
+                k += 1 + missed
+        except can.CanError as e:
+            self.error = e
+
+    def stats(self) -> dict:
+        """
+        Returns the achieved timing of every row sent so far: rows sent, rows skipped as overruns, and the
+        min, mean, standard deviation, 50th, 90th, 99th percentile and maximum lateness in seconds
+        """
+        result = {'sent': self.sent, 'overruns': self.overruns, 'period': self.period}
+        n = self.lateness.total
+        if n:
+            summary = self.lateness.summary()
+            mean = self._late_sum/n
+            result.update(min=summary['min'], mean=mean, std=max(self._late_squares/n - mean*mean, 0.0)**0.5,
+                          p50=summary['p50'], p90=summary['p90'], p99=summary['p99'], max=summary['max'])
+        return result
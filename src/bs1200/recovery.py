@@ -0,0 +1,83 @@
+import threading
+from collections import OrderedDict
+from time import perf_counter
+import can
+from bs1200.latency import LatencyHistogram
+
+#transmit frames holding one channel's setting, identified by their channel byte:
+#current sink and source setpoints, cell voltage setpoint and cell enable
+_CHANNEL_FRAMES = (1184, 1200, 1296, 1360)
+
+class BusRecovery(object):
+    """
+    Keeps the last frame of every setting sent by the driver's setters, so that the HIL mode,
+    configuration and setpoints can be sent again after the bus was reopened. Frames replace the
+    earlier frame setting the same thing (same arbitration ID, and channel for per channel frames)
+    and are replayed in the order they were last sent, which reproduces the final state.
+    A background thread calls `check()` every `interval` seconds, and on a fault calls `recover()`
+    every `retry` seconds until it returns True. The time from detecting a fault until the bus is
+    recovered is recorded in a LatencyHistogram.
+    """
+    def __init__(self, check, recover, interval: float = 0.1, retry: float = 1.0):
+        self.check = check
+        self.recover = recover
+        self.interval = interval
+        self.retry = retry
+        self.faults = 0
+        self.recoveries = 0
+        self.failed_attempts = 0
+        self.times = LatencyHistogram(highest_s=600.0)
+        self.error = None
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='bs1200-recovery', daemon=True)
+        self._thread.start()
+
+    def record(self, msg: can.Message):
+        """
+        Remember a frame sent by a setter
+        """
+        arb_id = msg.arbitration_id
+        data = bytes(msg.data)
+        key = (arb_id, data[0]) if arb_id & ~0xF in _CHANNEL_FRAMES else arb_id
+        with self._lock:
+            self._frames[key] = data
+            self._frames.move_to_end(key)
+
+    def frames(self) -> list:
+        """
+        Returns the remembered frames in the order they were last sent
+        """
+        with self._lock:
+            items = list(self._frames.items())
+        return [can.Message(arbitration_id=key[0] if isinstance(key, tuple) else key, data=data, is_extended_id=False)
+                for key, data in items]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.check():
+                    continue
+                self.faults += 1
+                start = perf_counter()
+                while not self.recover():
+                    self.failed_attempts += 1
+                    if self._stop.wait(self.retry):
+                        return
+                self.recoveries += 1
+                self.times.record(perf_counter() - start)
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def stats(self) -> dict:
+        """
+        Returns the faults detected, recoveries, failed reopen attempts, the number of remembered
+        frames and the recovery time summary (count, min, mean, p50, p90, p99, max in seconds)
+        """
+        return {'faults': self.faults, 'recoveries': self.recoveries, 'failed_attempts': self.failed_attempts,
+                'frames': len(self._frames), 'recovery_time': self.times.summary(), 'last_error': self.error}
@@ -0,0 +1,268 @@
+from array import array
+import threading
+from time import perf_counter, sleep
+import numpy as np
+import bs1200.can_frames as ff
+
+FRAME_SIZE = 8 #classic CAN payload, every BS1200 readback fits in one slot
+MAX_STD_ID = 2048 #11 bit arbitration IDs
+
+#byte offset of each readback frame within a box record,
+#records hold the frames in the order listed by can_frames.base_rx_arbids
+frame_offsets = {base: i*FRAME_SIZE for i, base in enumerate(ff.base_rx_arbids)}
+
+class RxCache(object):
+    """
+    Preallocated store for the latest payload of every BS1200 readback frame.
+    Each configured box owns one contiguous record of len(base_rx_arbids) 8 byte slots,
+    with parallel arrays of frame timestamps (0.0 until the first frame arrives) and arrival counts.
+    Arrivals are also timed on the local perf_counter() clock, keeping the last arrival time 
+    and the longest gap between arrivals of every slot, so the age of each readback can be checked.
+    Storing a frame copies the payload into its slot, so memory use stays flat
+    no matter how many frames are received.
+    Threads may block in wait_for() until new frames arrive for a set of slots,
+    and hooks may be attached to individual arbitration IDs to run as their frames are stored.
+
+    Frames are also grouped into publish cycles per box. Units send a cycle in arbitration ID order
+    (the order of base_rx_arbids), so a cycle starts with the box's lowest readback frame, normally
+    the status frame. Frames received before that anchor frame first arrives belong to a cycle seen
+    only partly, and are stored but never published. A cycle is complete when every frame received 
+    in the box's previous cycle has arrived again, or when the anchor frame or a repeated frame 
+    arrives before that. The completed record is then copied to `published` under a per box 
+    sequence lock (odd while the copy is in progress), so snapshot() returns all readbacks of one box 
+    from a single publish cycle without a lock.
+    """
+    def __init__(self, boxids: list):
+        self.box_ids = list(boxids)
+        self.frames_per_box = len(ff.base_rx_arbids)
+        self.record_size = self.frames_per_box * FRAME_SIZE
+        n_slots = self.frames_per_box * len(self.box_ids)
+        self.data = bytearray(n_slots * FRAME_SIZE)
+        self.view = memoryview(self.data)
+        self.timestamps = array('d', bytes(8*n_slots))
+        self.counts = array('Q', bytes(8*n_slots))
+        #arrival times start at the cache creation, so the first gap is the wait for the first frame
+        self.received = array('d', n_slots*[perf_counter()])
+        self.max_gaps = array('d', bytes(8*n_slots))
+        #publish cycles, per box: frames seen in the current cycle as a bit mask (-1 while waiting for
+        #the anchor frame), frames seen in the previous cycle, the anchor frame bit (lowest frame 
+        #received so far), first frame timestamp of the current cycle, and the published copies
+        n_boxes = len(self.box_ids)
+        self.published = bytearray(len(self.data))
+        self.cycle_seq = array('Q', bytes(8*n_boxes))
+        self.cycle_times = array('d', bytes(8*n_boxes))
+        self._seen = n_boxes*[-1]
+        self._expected = n_boxes*[(1 << self.frames_per_box) - 1]
+        self._anchor = n_boxes*[0]
+        self._cycle_start = n_boxes*[0.0]
+        self._slot_bits = [(slot // self.frames_per_box, 1 << (slot % self.frames_per_box)) for slot in range(n_slots)]
+        #only notified while a thread is blocked in wait_for()
+        self._arrival = threading.Condition()
+        self._waiters = 0
+        #per slot tuples of hooks, replaced (never mutated) when hooks are added or removed
+        self._hooks = n_slots*[()]
+        self._hook_lock = threading.Lock()
+        #(box, frame, word) view of the store for vectorized decoding
+        self.words = np.frombuffer(self.data, dtype='<u2').reshape(len(self.box_ids), 
+                                                                   self.frames_per_box, 
+                                                                   FRAME_SIZE//2)
+        #(box, frame) view of the arrival counts, 0 for frames never received
+        self.frame_counts = np.frombuffer(self.counts, dtype=np.uint64).reshape(len(self.box_ids), 
+                                                                               self.frames_per_box)
+        #lookup tables indexed by arbitration ID and box ID, -1 for untracked IDs
+        self._slots = MAX_STD_ID*[-1]
+        self._records = 16*[-1]
+        for b, box in enumerate(self.box_ids):
+            self._records[box] = b*self.record_size
+            for f, base in enumerate(ff.base_rx_arbids):
+                self._slots[base+box] = b*self.frames_per_box + f
+
+    def slot(self, arb_id: int) -> int:
+        """
+        Returns the slot index of a readback arbitration ID, or -1 if the ID is not cached
+        """
+        return self._slots[arb_id] if arb_id < MAX_STD_ID else -1
+
+    def _cached_slot(self, arb_id: int) -> int:
+        slot = self.slot(arb_id)
+        if slot < 0:
+            raise KeyError('Arbitration ID %d is not cached' % arb_id)
+        return slot
+
+    def offset(self, arb_id: int) -> int:
+        """
+        Returns the byte offset into `data` of the slot for a readback arbitration ID
+        """
+        return self._cached_slot(arb_id)*FRAME_SIZE
+
+    def record_offset(self, boxid: int) -> int:
+        """
+        Returns the byte offset into `data` of the record for a box ID
+        """
+        offset = self._records[boxid] if boxid in range(0, 16) else -1
+        if offset < 0:
+            raise KeyError('Box ID %d is not cached' % boxid)
+        return offset
+
+    def rows(self, boxids: list = None) -> list:
+        """
+        Returns the record indices of `boxids` (all configured boxes by default),
+        used to index the first axis of `words`
+        """
+        if boxids is None:
+            return list(range(len(self.box_ids)))
+        return [self.record_offset(b)//self.record_size for b in boxids]
+
+    def put(self, arb_id: int, data, timestamp: float) -> int:
+        """
+        Copy a received payload into its slot. Returns the slot index,
+        or -1 if the frame is not a readback for a configured box.
+        """
+        if arb_id < MAX_STD_ID:
+            slot = self._slots[arb_id]
+            if slot >= 0:
+                row, bit = self._slot_bits[slot]
+                seen = self._seen[row]
+                anchor = self._anchor[row]
+                if bit == anchor:
+                    #next cycle, the previous one ended without some of the expected frames
+                    if seen > 0:
+                        self._publish(row, seen)
+                    seen = 0
+                    self._cycle_start[row] = timestamp
+                elif not anchor or bit < anchor:
+                    #lowest frame so far, drop the partly seen cycle and start at this frame
+                    self._anchor[row] = bit
+                    seen = 0
+                    self._cycle_start[row] = timestamp
+                elif seen > 0 and seen & bit:
+                    #repeated frame, the anchor frame of the next cycle was lost
+                    self._publish(row, seen)
+                    seen = -1
+                start = slot*FRAME_SIZE
+                n = len(data)
+                if n > FRAME_SIZE:
+                    data, n = data[:FRAME_SIZE], FRAME_SIZE
+                self.view[start:start+n] = data
+                self.timestamps[slot] = timestamp
+                self.counts[slot] += 1
+                now = perf_counter()
+                gap = now - self.received[slot]
+                self.received[slot] = now
+                if gap > self.max_gaps[slot]:
+                    self.max_gaps[slot] = gap
+                if seen >= 0:
+                    seen |= bit
+                    if seen == self._expected[row]:
+                        self._publish(row, seen)
+                        seen = -1
+                else:
+                    #frame after its cycle was published, wait for it in the next cycles
+                    self._expected[row] |= bit
+                self._seen[row] = seen
+                if self._waiters:
+                    with self._arrival:
+                        self._arrival.notify_all()
+                for hook in self._hooks[slot]:
+                    hook(arb_id, slot, timestamp)
+            return slot
+        return -1
+
+    def _publish(self, row: int, seen: int):
+        """
+        Copy the record of box `row` to its published snapshot, called from put() at the end of a cycle
+        """
+        self._expected[row] = seen
+        start = row*self.record_size
+        self.cycle_seq[row] += 1
+        self.published[start:start+self.record_size] = self.view[start:start+self.record_size]
+        self.cycle_times[row] = self._cycle_start[row]
+        self.cycle_seq[row] += 1
+
+    def snapshot(self, boxid: int) -> tuple:
+        """
+        Returns (cycle number, timestamp of the cycle's first frame, record bytes) of the latest
+        complete publish cycle of `boxid`, or None before the first cycle completes.
+        Frames are at the record offsets listed in `frame_offsets`.
+        """
+        row = self.record_offset(boxid)//self.record_size
+        start = row*self.record_size
+        while True:
+            seq = self.cycle_seq[row]
+            if not seq:
+                return None
+            if seq & 1:
+                sleep(0) #let the receive thread finish the copy
+                continue
+            record = bytes(self.published[start:start+self.record_size])
+            timestamp = self.cycle_times[row]
+            if self.cycle_seq[row] == seq:
+                return seq//2, timestamp, record
+
+    def timestamp(self, arb_id: int) -> float:
+        """
+        Returns the timestamp of the last frame received for an arbitration ID
+        """
+        return self.timestamps[self._cached_slot(arb_id)]
+
+    def ages(self, arb_ids: list) -> list:
+        """
+        Returns the seconds since the last frame of each arbitration ID in `arb_ids` was stored,
+        inf for IDs that have not received a frame yet
+        """
+        now = perf_counter()
+        ages = []
+        for a in arb_ids:
+            slot = self._cached_slot(a)
+            ages.append(now - self.received[slot] if self.counts[slot] else float('inf'))
+        return ages
+
+    def sequence(self, arb_ids: list) -> list:
+        """
+        Returns the number of frames received so far for each arbitration ID in `arb_ids`
+        """
+        return [self.counts[self._cached_slot(a)] for a in arb_ids]
+
+    def wait_for(self, arb_ids: list, since: list, timeout: float = None) -> bool:
+        """
+        Block until every arbitration ID in `arb_ids` has received a frame beyond the
+        counts in `since` (as returned by sequence()). Returns False if `timeout` seconds elapse first.
+        """
+        slots = [self._cached_slot(a) for a in arb_ids]
+        def fresh():
+            return all(self.counts[s] > n for s, n in zip(slots, since))
+        with self._arrival:
+            self._waiters += 1
+            try:
+                return self._arrival.wait_for(fresh, timeout)
+            finally:
+                self._waiters -= 1
+
+    def add_hook(self, arb_ids: list, hook):
+        """
+        Call `hook(arb_id, slot, timestamp)` from the receive thread each time a frame
+        for one of `arb_ids` has been stored
+        """
+        with self._hook_lock:
+            for a in arb_ids:
+                slot = self._cached_slot(a)
+                self._hooks[slot] = self._hooks[slot] + (hook,)
+
+    def remove_hook(self, arb_ids: list, hook):
+        """
+        Detach a hook previously attached with add_hook()
+        """
+        with self._hook_lock:
+            for a in arb_ids:
+                slot = self._cached_slot(a)
+                self._hooks[slot] = tuple(h for h in self._hooks[slot] if h != hook)
+
+    def __getitem__(self, arb_id: int) -> memoryview:
+        """
+        Returns a read-only view of the 8 byte payload slot for an arbitration ID
+        """
+        start = self.offset(arb_id)
+        return self.view[start:start+FRAME_SIZE].toreadonly()
+
+    def __contains__(self, arb_id: int) -> bool:
+        return self.slot(arb_id) >= 0
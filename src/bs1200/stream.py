@@ -0,0 +1,123 @@
+from collections import deque, namedtuple
+import threading
+import bs1200.can_frames as ff
+from bs1200.rx_cache import FRAME_SIZE, frame_offsets
+
+"""
+Decoded readback frame yielded by BS1200.stream()
+    - timestamp: receive timestamp of the frame
+    - boxid:     Box ID of the unit that published the frame
+    - signal:    one of 'status', 'V', 'I', 'DIO' or 'AI'
+    - channel:   channel number of the first value in `values`
+    - values:    tuple of decoded values, (fan status, temp 1, temp 2, temp 3) for 'status' frames,
+                 Volts for 'V' and 'AI', Amps for 'I' and 8 booleans for 'DIO'
+"""
+Readback = namedtuple('Readback', ['timestamp', 'boxid', 'signal', 'channel', 'values'])
+
+#signal name and first channel of each readback frame, keyed by base arbitration ID
+readback_signals = {256: ('status', 1),
+                    288: ('V', 1), 304: ('V', 5), 320: ('V', 9),
+                    384: ('I', 1), 400: ('I', 5), 416: ('I', 9),
+                    640: ('DIO', 1),
+                    672: ('AI', 1), 688: ('AI', 5)}
+
+def decode_readback(timestamp: float, arb_id: int, data) -> Readback:
+    """
+    Decode a BS1200 readback frame payload into a Readback record
+    """
+    base, boxid = arb_id & 0x7F0, arb_id & 0xF
+    signal, channel = readback_signals[base]
+    values = ff.rx_codecs[base].decode(data)
+    if signal == 'DIO':
+        values = tuple(bool(values[0] >> bit & 1) for bit in range(8))
+    return Readback(timestamp, boxid, signal, channel, values)
+
+"""
+Decoded readbacks of one box from a single publish cycle, returned by BS1200.readback_snapshot()
+    - cycle:     number of publish cycles completed by the box
+    - timestamp: receive timestamp of the first frame of the cycle
+    - status:    (fan status, temp 1, temp 2, temp 3)
+    - V, I:      12 cell voltages (V) and currents (A)
+    - AI:        8 analog input voltages (V)
+    - DIO:       8 booleans
+"""
+Snapshot = namedtuple('Snapshot', ['cycle', 'timestamp', 'status', 'V', 'I', 'AI', 'DIO'])
+
+#(signal, frame codecs) of each Snapshot field, the frames of a signal are decoded in order
+_snapshot_fields = [(signal, [ff.codecs[name] for name in names]) 
+                    for signal, names in (('status', ['status']), ('V', ff.readback_groups['V']), 
+                                          ('I', ff.readback_groups['I']), ('AI', ff.readback_groups['AI']), 
+                                          ('DIO', ['dio_states_1_8']))]
+
+def decode_snapshot(cycle: int, timestamp: float, record) -> Snapshot:
+    """
+    Decode a box record returned by RxCache.snapshot() into a Snapshot
+    """
+    fields = {}
+    for signal, frames in _snapshot_fields:
+        values = []
+        for codec in frames:
+            values.extend(codec.decode(record, frame_offsets[codec.base_id]))
+        fields[signal] = tuple(values)
+    fields['DIO'] = tuple(bool(fields['DIO'][0] >> bit & 1) for bit in range(8))
+    return Snapshot(cycle, timestamp, **fields)
+
+class ReadbackStream(object):
+    """
+    Bounded queue of readback frames filled from the receive thread by on_frame().
+    When the queue is full the `overflow` policy applies:
+        - 'drop_oldest': discard the oldest queued frame, counted in `dropped`
+        - 'block':       block the receive thread until the consumer makes room
+    """
+    overflow_policies = ('drop_oldest', 'block')
+
+    def __init__(self, rx_cache, maxlen: int = 1024, overflow: str = 'drop_oldest'):
+        if overflow not in self.overflow_policies:
+            raise ValueError('Invalid overflow policy: %s' % overflow)
+        if maxlen < 1:
+            raise ValueError('Stream queue length must be at least 1')
+        self.rx_cache = rx_cache
+        self.maxlen = maxlen
+        self.overflow = overflow
+        self.dropped = 0
+        self.closed = False
+        self.frames = deque(maxlen = maxlen if overflow == 'drop_oldest' else None)
+        self._cond = threading.Condition()
+
+    def on_frame(self, arb_id: int, slot: int, timestamp: float):
+        """
+        RxCache hook, copies the stored payload into the queue
+        """
+        start = slot*FRAME_SIZE
+        data = self.rx_cache.data[start:start+FRAME_SIZE]
+        with self._cond:
+            if len(self.frames) >= self.maxlen:
+                if self.overflow == 'block':
+                    self._cond.wait_for(lambda: len(self.frames) < self.maxlen or self.closed)
+                    if self.closed:
+                        return
+                else:
+                    self.dropped += 1
+            self.frames.append((timestamp, arb_id, data))
+            self._cond.notify_all()
+
+    def get(self, timeout: float = None) -> tuple:
+        """
+        Pop the oldest queued (timestamp, arb_id, payload) frame,
+        or return None if `timeout` seconds elapse or the stream is closed first
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.frames or self.closed, timeout) or not self.frames:
+                return None
+            frame = self.frames.popleft()
+            self._cond.notify_all()
+            return frame
+
+    def close(self):
+        """
+        Stop queueing frames and release a receive thread blocked on a full queue
+        """
+        with self._cond:
+            self.closed = True
+            self.frames.clear()
+            self._cond.notify_all()
@@ -0,0 +1,205 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from time import perf_counter, sleep
+import can
+
+#HIL_Msg_IDs of the BS1200 configuration template: HIL mode, 4-cell voltages, DIO and AO setpoints
+HIL_MSG_IDS = (128, 160, 176, 192, 512, 544)
+#base arbitration ID of the CAN publishing configuration frame
+CONFIG_ID = 1024
+
+#transmit priorities, lower values are sent first
+PRIORITY_HIL = 0
+PRIORITY_SETPOINT = 1
+PRIORITY_CONFIG = 2
+
+#setting changed by each transmit frame, keyed by base arbitration ID. Frames of one box changing
+#the same setting keep their order, and HIL mode and configuration frames ('mode') are not reordered
+#with any frame of their box
+_SETTINGS = {128: 'mode', 1024: 'mode',
+             160: 'V', 176: 'V', 192: 'V', 1280: 'V', 1296: 'V',
+             1152: 'I', 1184: 'I', 1200: 'I',
+             1344: 'enable', 1360: 'enable',
+             512: 'DIO', 544: 'AO'}
+
+class TxThread(can.BusABC):
+    """
+    can.BusABC sending the frames of the wrapped `bus` from a single transmit thread.
+    send() copies the frame into a bounded priority queue, submit() does the same and returns a 
+    concurrent.futures.Future completed once the frame has been written to `bus`. Frames of the `hil_ids`
+    go first, then other setpoints, then configuration frames, in call order within each priority. 
+    A frame never overtakes a queued frame changing the same setting of the same box (it is sent at the 
+    lower priority of the two), and HIL mode and configuration frames are sent in call order with 
+    every frame of their box, so no frame is moved across a HIL enable or disable.
+    When the queue is full send() blocks for up to `timeout` seconds (forever by default) before raising can.CanOperationError.
+    A can.CanOperationError from `bus` (e.g. a full PCAN transmit queue) is retried up to `retries`
+    times with an exponential backoff starting at `backoff` seconds, the last error is set on the
+    frame's future and kept in `error` until a frame is sent again. Any other exception raised by `bus`
+    fails the frame's future the same way and is printed, the thread keeps sending the following frames.
+    status_is_ok() also reports the wrapped bus status.
+    Receiving is not supported, the wrapped bus keeps its notifier.
+    """
+    def __init__(self, bus: can.BusABC, maxsize: int = 256, hil_ids: tuple = HIL_MSG_IDS,
+                 retries: int = 8, backoff: float = 0.0005, **kwargs):
+        super().__init__(channel='tx', **kwargs)
+        self.channel_info = 'BS1200 transmit thread'
+        self.bus = bus
+        self.retries = retries
+        self.backoff = backoff
+        self.error = None
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self._priority = 2048*[PRIORITY_SETPOINT]
+        for base in hil_ids:
+            self._priority[base:base+16] = 16*[PRIORITY_HIL]
+        self._priority[CONFIG_ID:CONFIG_ID+16] = 16*[PRIORITY_CONFIG]
+        self._queue = queue.PriorityQueue(maxsize)
+        self._order = itertools.count()
+        #per (Box ID, setting) and per Box ID: [queued frames, priority of the latest queued frame]
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='bs1200-tx', daemon=True)
+        self._thread.start()
+
+    def _keys(self, arb_id: int, extended: bool) -> tuple:
+        """
+        Returns the (Box ID, setting) key of a frame and its Box ID key
+        """
+        if extended or arb_id >= 2048:
+            return ('ext', arb_id), ('ext', arb_id)
+        box, base = arb_id & 0xF, arb_id & ~0xF
+        return (box, _SETTINGS.get(base, base)), box
+
+    def _enqueue(self, arb_id: int, extended: bool) -> tuple:
+        """
+        Returns the (priority, order) sort key of a new frame and registers it as queued
+        """
+        priority = self._priority[arb_id] if not extended and arb_id < 2048 else PRIORITY_SETPOINT
+        key, box = self._keys(arb_id, extended)
+        with self._lock:
+            pending = self._pending
+            if key[1] == 'mode':
+                #after every queued frame of the box
+                if box in pending:
+                    priority = max(priority, pending[box][1])
+            else:
+                for k in (key, (box, 'mode')):
+                    if k in pending:
+                        priority = max(priority, pending[k][1])
+            for k in (key, box):
+                entry = pending.setdefault(k, [0, priority])
+                entry[0] += 1
+                entry[1] = max(entry[1], priority)
+            return priority, next(self._order)
+
+    def _dequeue(self, arb_id: int, extended: bool):
+        with self._lock:
+            for k in self._keys(arb_id, extended):
+                entry = self._pending[k]
+                entry[0] -= 1
+                if not entry[0]:
+                    del self._pending[k]
+
+    def send(self, msg: can.Message, timeout: float = None, future: Future = None):
+        """
+        Queue `msg` for the transmit thread, returns once the frame is queued
+        """
+        arb_id, extended = msg.arbitration_id, msg.is_extended_id
+        priority, order = self._enqueue(arb_id, extended)
+        #only the frame's contents are queued, the caller may reuse the Message
+        try:
+            self._queue.put((priority, order, arb_id, extended, bytes(msg.data), future), timeout=timeout)
+        except queue.Full:
+            self._dequeue(arb_id, extended)
+            raise can.CanOperationError('BS1200 transmit queue is full')
+
+    def submit(self, msg: can.Message, timeout: float = None) -> Future:
+        """
+        Queue `msg` like send(), returns a Future completed when the frame has been sent
+        """
+        future = Future()
+        self.send(msg, timeout, future)
+        return future
+
+    def _run(self):
+        frame = can.Message(is_extended_id=False, check=False) #sent by the wrapped bus before the next frame
+        while True:
+            _, _, arb_id, extended, data, future = self._queue.get()
+            if data is None:
+                self._queue.task_done()
+                return
+            self._dequeue(arb_id, extended)
+            if future is not None and not future.set_running_or_notify_cancel():
+                #cancelled by the caller while queued
+                self._queue.task_done()
+                continue
+            frame.arbitration_id = arb_id
+            frame.is_extended_id = extended
+            frame.data = data
+            frame.dlc = len(data)
+            delay = self.backoff
+            for attempt in range(self.retries + 1):
+                try:
+                    self.bus.send(frame)
+                    self.sent += 1
+                    self.error = None
+                    if future is not None:
+                        future.set_result(None)
+                    break
+                except can.CanOperationError as e:
+                    if attempt == self.retries:
+                        self._fail(future, e)
+                        break
+                    self.retried += 1
+                    sleep(delay)
+                    delay *= 2
+                except can.CanError as e:
+                    self._fail(future, e)
+                    break
+                except Exception as e:
+                    print("Error sending frame %d from the transmit thread:" % arb_id, repr(e))
+                    self._fail(future, e)
+                    break
+            self._queue.task_done()
+
+    def _fail(self, future: Future, error: Exception):
+        self.failed += 1
+        self.error = error
+        if future is not None and not future.done():
+            future.set_exception(error)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Wait until the queued frames have been sent, returns False on timeout
+        """
+        deadline = None if timeout is None else perf_counter() + timeout
+        while self._queue.unfinished_tasks and self._thread.is_alive():
+            if deadline is not None and perf_counter() > deadline:
+                return False
+            sleep(0.0002)
+        return True
+
+    def _recv_internal(self, timeout):
+        return None, False
+
+    def status_is_ok(self) -> bool:
+        status_is_ok = getattr(self.bus, 'status_is_ok', None)
+        return self.error is None and (status_is_ok() if status_is_ok is not None else True)
+
+    def stop(self):
+        """
+        Send the queued frames and stop the transmit thread, the wrapped bus stays open
+        """
+        if self._thread.is_alive():
+            #sorts after every queued frame
+            self._queue.put((PRIORITY_CONFIG + 1, next(self._order), None, False, None, None))
+            self._thread.join()
+        #done as a bus, so collecting it does not shut the wrapped bus down
+        super().shutdown()
+
+    def shutdown(self):
+        self.stop()
+        self.bus.shutdown()
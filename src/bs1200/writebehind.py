@@ -0,0 +1,293 @@
+import threading
+from struct import Struct
+from time import perf_counter, sleep
+import can
+import bs1200.can_frames as ff
+
+_HALF = Struct('<e')
+
+def _raw(value: float) -> int:
+    """
+    Setpoint in the 0.1 mV (or 0.1 mA) steps of the per-cell and set-all frames
+    """
+    return round(value*10000)
+
+def _half(value: float) -> float:
+    """
+    `value` as carried by the float16 values of the 4-cell frames
+    """
+    return _HALF.unpack(_HALF.pack(value))[0]
+
+def _half_exact(value: float) -> bool:
+    """
+    True when the float16 values of the 4-cell frames carry `value` at the per-cell frame resolution
+    """
+    return abs(_half(value) - value) < 0.00005
+
+class WriteBehind(object):
+    """
+    Write-behind cache of the cell voltage, cell current limit and analog output setpoints of every box.
+    Setters only record the commanded values, calls repeating the setpoints last sent are dropped.
+    A writer thread sends the changed setpoints at most once every `period` seconds (the first write
+    after an idle period goes out immediately), merged into the fewest frames:
+        - a set-all frame to the most common value of the 12 cells, when it saves frames
+        - a 4-cell voltage frame when several cells of a group changed, and the float16 values of
+          the frame carry every cell of the group at the setpoint resolution (cells commanded
+          through set_cells_V, which uses these frames anyway, are commanded their float16 value)
+        - per-cell setpoint frames otherwise
+    The values of a batch count as sent from the moment it is planned, so setters compare against
+    the values in flight, and the values last sent to a box become unknown when sending to it fails.
+    Frames sent around the cache (profile player, battery model) are not tracked, call forget() after
+    them so the next setpoints are sent. Send errors are kept in `error` and the setpoints of the box
+    are retried in the next period.
+    """
+    def __init__(self, bus: can.BusABC, period: float, status = None):
+        self.bus = bus
+        self.period = period
+        self.status = status #optional callable returning the bus status, checked once per batch
+        self.error = None
+        self.bus_ok = True
+        self.calls = 0
+        self.dropped = 0
+        self.frames = 0
+        self.batches = 0
+        #commanded values per Box ID, None until commanded
+        self._V = [12*[None] for _ in range(16)]
+        self._sink = [12*[None] for _ in range(16)]
+        self._source = [12*[None] for _ in range(16)]
+        self._ao = 16*[None]
+        #raw values last sent per Box ID, None when unknown
+        self._V_sent = [12*[None] for _ in range(16)]
+        self._sink_sent = [12*[None] for _ in range(16)]
+        self._source_sent = [12*[None] for _ in range(16)]
+        self._ao_sent = 16*[None]
+        self._dirty = set()
+        self._cond = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='bs1200-write-behind', daemon=True)
+        self._thread.start()
+
+    def _mark(self, boxid: int, changed: bool):
+        self.calls += 1
+        if changed:
+            self._dirty.add(boxid)
+            self._cond.notify()
+        else:
+            self.dropped += 1
+
+    def set_V(self, boxid: int, volts: dict, half: bool = False):
+        """
+        Command cell voltages, `volts` maps 1-based channels to Volts. With `half` the cells are
+        commanded the float16 values of `volts`, as sent by the 4-cell frames
+        """
+        with self._cond:
+            values, sent = self._V[boxid], self._V_sent[boxid]
+            changed = False
+            for ch, v in volts.items():
+                v = _half(v) if half else v
+                values[ch-1] = v
+                changed = changed or _raw(v) != sent[ch-1]
+            self._mark(boxid, changed)
+
+    def set_I(self, boxid: int, sinks: dict = None, sources: dict = None):
+        """
+        Command cell current limits, `sinks` and `sources` map 1-based channels to Amps
+        """
+        with self._cond:
+            changed = False
+            for currents, values, sent in ((sinks, self._sink[boxid], self._sink_sent[boxid]),
+                                           (sources, self._source[boxid], self._source_sent[boxid])):
+                for ch, i in (currents or {}).items():
+                    values[ch-1] = i
+                    changed = changed or _raw(i) != sent[ch-1]
+            self._mark(boxid, changed)
+
+    def set_ao(self, boxid: int, ao1: float, ao2: float):
+        """
+        Command both analog output voltages
+        """
+        with self._cond:
+            self._ao[boxid] = (ao1, ao2)
+            self._mark(boxid, (_raw(ao1), _raw(ao2)) != self._ao_sent[boxid])
+
+    def forget(self, box_ids: list = None):
+        """
+        Mark the setpoints last sent to `box_ids` (all boxes by default) as unknown,
+        so the next commanded values are sent even if they repeat the cached ones
+        """
+        with self._cond:
+            for box in range(1, 16) if box_ids is None else box_ids:
+                self._forget(box)
+
+    def _forget(self, box: int):
+        self._V_sent[box] = 12*[None]
+        self._sink_sent[box] = 12*[None]
+        self._source_sent[box] = 12*[None]
+        self._ao_sent[box] = None
+
+    def resend(self):
+        """
+        Send every commanded setpoint again, e.g. after the bus was reopened
+        """
+        self.forget()
+        with self._cond:
+            for box in range(1, 16):
+                if (self._ao[box] is not None or
+                        any(v is not None for v in self._V[box] + self._sink[box] + self._source[box])):
+                    self._dirty.add(box)
+            self._cond.notify()
+
+    def _V_frames(self, box: int, raw: list, held: list) -> list:
+        """
+        Voltage frames bringing the cells from the `held` raw values to the commanded `raw` values
+        """
+        values = self._V[box]
+        changed = [r is not None and r != h for r, h in zip(raw, held)]
+        frames = []
+        for g, template in enumerate(ff.cell_V_frames):
+            first = 4*g
+            group = range(first, first+4)
+            if (sum(changed[i] for i in group) > 1 and
+                    all(raw[i] is not None and _half_exact(values[i]) for i in group)):
+                frames.append((template, (box, *values[first:first+4])))
+            else:
+                frames.extend((ff.voltage_setpoint_frame, (box, i+1, values[i])) for i in group if changed[i])
+        return frames
+
+    def _I_frames(self, box: int, sink_raw: list, source_raw: list, sink_held: list, source_held: list) -> list:
+        """
+        Current limit frames bringing the cells from the held raw limits to the commanded ones
+        """
+        sinks, sources = self._sink[box], self._source[box]
+        return ([(ff.current_sink_frame, (box, ch+1, sinks[ch])) for ch in range(12)
+                 if sink_raw[ch] is not None and sink_raw[ch] != sink_held[ch]] +
+                [(ff.current_source_frame, (box, ch+1, sources[ch])) for ch in range(12)
+                 if source_raw[ch] is not None and source_raw[ch] != source_held[ch]])
+
+    def _plan_V(self, box: int, frames: list) -> list:
+        values, sent = self._V[box], self._V_sent[box]
+        raw = [None if v is None else _raw(v) for v in values]
+        planned = self._V_frames(box, raw, sent)
+        if len(planned) > 1 and None not in raw:
+            #a set-all frame to the most common value, then the cells differing from it
+            common = max(set(raw), key=raw.count)
+            merged = [(ff.voltage_set_all_frame, (box, values[raw.index(common)]))]
+            merged += self._V_frames(box, raw, 12*[common])
+            if len(merged) < len(planned):
+                planned = merged
+        frames.extend(planned)
+        #raw values held by the cells once the planned frames are sent
+        held = list(sent)
+        for template, args in planned:
+            if template is ff.voltage_set_all_frame:
+                held = 12*[_raw(args[1])]
+            elif template is ff.voltage_setpoint_frame:
+                held[args[1]-1] = _raw(args[2])
+            else:
+                first = 4*ff.cell_V_frames.index(template)
+                held[first:first+4] = [_raw(_half(v)) for v in args[1:]]
+        return held
+
+    def _plan_I(self, box: int, frames: list) -> tuple:
+        sinks, sources = self._sink[box], self._source[box]
+        sink_raw = [None if i is None else _raw(i) for i in sinks]
+        source_raw = [None if i is None else _raw(i) for i in sources]
+        sink_sent, source_sent = self._sink_sent[box], self._source_sent[box]
+        planned = self._I_frames(box, sink_raw, source_raw, sink_sent, source_sent)
+        if len(planned) > 1 and None not in sink_raw and None not in source_raw:
+            sink = max(set(sink_raw), key=sink_raw.count)
+            source = max(set(source_raw), key=source_raw.count)
+            merged = [(ff.current_set_all_frame, (box, sinks[sink_raw.index(sink)], sources[source_raw.index(source)]))]
+            merged += self._I_frames(box, sink_raw, source_raw, 12*[sink], 12*[source])
+            if len(merged) < len(planned):
+                planned = merged
+        frames.extend(planned)
+        return ([s if r is None else r for r, s in zip(sink_raw, sink_sent)],
+                [s if r is None else r for r, s in zip(source_raw, source_sent)])
+
+    def _plan(self, box: int) -> tuple:
+        """
+        Returns the frames sending the changed setpoints of `box` and the raw values sent by them
+        """
+        frames = []
+        V_sent = self._plan_V(box, frames)
+        sink_sent, source_sent = self._plan_I(box, frames)
+        ao_sent = self._ao_sent[box]
+        if self._ao[box] is not None:
+            ao1, ao2 = self._ao[box]
+            if (_raw(ao1), _raw(ao2)) != ao_sent:
+                frames.append((ff.ao_set_frame, (box, ao1, ao2)))
+                ao_sent = (_raw(ao1), _raw(ao2))
+        return frames, (V_sent, sink_sent, source_sent, ao_sent)
+
+    def _write(self):
+        with self._send_lock:
+            with self._cond:
+                plans = []
+                for box in sorted(self._dirty):
+                    frames, sent = self._plan(box)
+                    #setters compare against the values in flight from here on
+                    self._V_sent[box], self._sink_sent[box], self._source_sent[box], self._ao_sent[box] = sent
+                    plans.append((box, frames))
+                self._dirty.clear()
+            if not plans:
+                return
+            error = None
+            for box, frames in plans:
+                try:
+                    for template, args in frames:
+                        self.bus.send(template.build(*args))
+                        self.frames += 1
+                except can.CanError as e:
+                    error = e
+                    with self._cond:
+                        #the setpoints held by the box are unknown, send all commanded ones next period
+                        self._forget(box)
+                        self._dirty.add(box)
+            self.error = error
+            self.batches += 1
+            if self.status is not None:
+                self.bus_ok = self.status()
+
+    def _run(self):
+        next_write = perf_counter()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._dirty or self._closed)
+                if self._closed:
+                    break
+            delay = next_write - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            self._write()
+            next_write = perf_counter() + self.period
+        self._write()
+
+    def flush(self) -> bool:
+        """
+        Send the pending setpoints now from the calling thread, returns ok()
+        """
+        self._write()
+        return self.ok()
+
+    def ok(self) -> bool:
+        """
+        False if the last batch failed to send or the bus reported an error after it
+        """
+        return self.error is None and self.bus_ok
+
+    def stats(self) -> dict:
+        """
+        Returns the setter calls recorded, calls dropped as duplicates, frames sent and batches written
+        """
+        return {'calls': self.calls, 'dropped': self.dropped, 'frames': self.frames, 'batches': self.batches}
+
+    def close(self):
+        """
+        Send the pending setpoints and stop the writer thread
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
@@ -0,0 +1,99 @@
+"""
+Check the alarm rules evaluated in the receive path. Readback frames with known values are stored
+in a RxCache directly, so every transition, its value and the rule's event can be checked
+frame by frame. Does not need hardware.
+"""
+import struct
+import sys
+sys.path.append('src')
+from bs1200.rx_cache import RxCache
+from bs1200.alarms import AlarmRule, AlarmMonitor
+
+def volts_frame(first: int, values: list) -> tuple:
+    """
+    (base ID, payload) of the cell voltage readback frame starting at cell `first`
+    """
+    return {1: 288, 5: 304, 9: 320}[first], struct.pack('<4H', *[int(round(v*10000)) for v in values])
+
+def check_rules():
+    cache = RxCache([1, 2])
+    monitor = AlarmMonitor(cache)
+    alarms = []
+    rule = monitor.add(AlarmRule(1, 'V', high=4.0, channels=[1, 9], deadband=0.1, callback=alarms.append))
+    assert rule.frames() == {288: ((0, 1),), 320: ((0, 9),)}
+
+    def put(first, values, timestamp, boxid=1):
+        base, data = volts_frame(first, values)
+        cache.put(base + boxid, data, timestamp)
+
+    #channels outside the rule and other boxes do not raise alarms
+    put(1, [3.0, 4.5, 4.5, 4.5], 1.0)
+    put(5, [4.5, 4.5, 4.5, 4.5], 1.1)
+    put(1, [4.5, 4.5, 4.5, 4.5], 1.2, boxid=2)
+    assert alarms == [] and not rule.event.is_set()
+
+    #a transition is reported once, with the value and timestamp of the frame causing it
+    put(1, [4.2, 3.0, 3.0, 3.0], 2.0)
+    put(1, [4.3, 3.0, 3.0, 3.0], 2.1)
+    assert [(a.boxid, a.signal, a.channel, a.active, a.timestamp) for a in alarms] == [(1, 'V', 1, True, 2.0)]
+    assert abs(alarms[0].value - 4.2) < 1e-9 and rule.event.is_set()
+    put(9, [4.1, 3.0, 3.0, 3.0], 2.2)
+    assert monitor.active() == [(1, 'V', 1), (1, 'V', 9)]
+
+    #a channel clears only once it is back inside the window by the deadband
+    put(1, [3.95, 3.0, 3.0, 3.0], 3.0)
+    assert len(alarms) == 2 and rule.active == {1, 9}
+    put(1, [3.85, 3.0, 3.0, 3.0], 3.1)
+    assert alarms[-1][:4] == (1, 'V', 1, False) and rule.event.is_set()
+    put(9, [3.0, 3.0, 3.0, 3.0], 3.2)
+    assert alarms[-1][:4] == (1, 'V', 9, False) and not rule.event.is_set()
+    assert monitor.active() == [] and list(rule.events) == alarms
+
+    #a fan fault is any status byte other than 16
+    fan = monitor.add(AlarmRule(2, 'fan', low=16, high=16))
+    cache.put(256+2, bytes([16, 25, 25, 25]), 4.0)
+    assert not fan.event.is_set()
+    cache.put(256+2, bytes([0, 25, 25, 25]), 4.1)
+    assert fan.event.is_set() and monitor.active() == [(2, 'fan', 1)]
+
+    #a failing callback is kept in `error` and does not stop the receive path
+    def fail(alarm):
+        raise RuntimeError('callback failed')
+    low = monitor.add(AlarmRule(1, 'V', low=1.0, channels=[2], callback=fail))
+    put(1, [3.0, 0.5, 3.0, 3.0], 5.0)
+    assert isinstance(low.error, RuntimeError) and low.active == {2}
+
+    #removed rules are no longer evaluated
+    monitor.remove(rule)
+    put(1, [4.5, 0.5, 3.0, 3.0], 6.0)
+    assert rule.active == set() and len(alarms) == 4
+    monitor.remove(low)
+    monitor.remove(fan)
+    assert monitor.rules == [] and all(entry is None for entry in monitor._table)
+
+def check_errors():
+    monitor = AlarmMonitor(RxCache([1]))
+    for args, kwargs, error in ((('V',), {'high': 1.0}, None),
+                                (('X',), {'high': 1.0}, ValueError),
+                                (('V',), {}, ValueError),
+                                (('AI',), {'high': 1.0, 'channels': [9]}, IndexError)):
+        try:
+            AlarmRule(1, *args, **kwargs)
+        except Exception as e:
+            assert type(e) is error, (args, kwargs, e)
+        else:
+            assert error is None, (args, kwargs)
+    try:
+        monitor.add(AlarmRule(2, 'V', high=1.0))
+    except IndexError:
+        pass
+    else:
+        raise AssertionError('a rule on an unconfigured box was accepted')
+
+def main():
+    check_rules()
+    check_errors()
+    print('alarm test passed')
+
+if __name__ == '__main__':
+    main()
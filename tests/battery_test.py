@@ -0,0 +1,91 @@
+"""
+Check the battery model and its closed loop in the receive path. Cell current readbacks with known
+values are stored in a RxCache, and the cell voltage frames the engine sends in reply are recorded
+by RecordingBus and compared with the model's equations. Does not need hardware.
+"""
+import struct
+import sys
+sys.path.append('src')
+import can
+import numpy as np
+import bs1200.can_frames as ff
+from bs1200.rx_cache import RxCache
+from bs1200.battery import BatteryModel, BatteryEngine
+
+OCV_SOC = [0.0, 1.0]
+OCV_V = [3.0, 4.2]
+
+class RecordingBus(can.BusABC):
+    def __init__(self, **kwargs):
+        super().__init__(channel='recording', **kwargs)
+        self.fail = False
+        self.sent = []
+
+    def send(self, msg, timeout=None):
+        if self.fail:
+            raise can.CanOperationError('injected failure')
+        self.sent.append((msg.arbitration_id, bytes(msg.data)))
+
+    def _recv_internal(self, timeout):
+        return None, False
+
+def put_currents(cache: RxCache, boxid: int, amps: list, timestamp: float):
+    raw = [int(round((i + 3.2768)*10000)) for i in amps]
+    for f, base in enumerate((384, 400, 416)):
+        cache.put(base + boxid, struct.pack('<4H', *raw[4*f:4*f+4]), timestamp)
+
+def cell_frames(boxid: int, volts) -> list:
+    frames = []
+    for i, template in enumerate(ff.cell_V_frames):
+        msg = template.build(boxid, *volts[4*i:4*i+4])
+        frames.append((msg.arbitration_id, bytes(msg.data)))
+    return frames
+
+def main():
+    model = BatteryModel([1, 2], capacity_ah=1.0, ocv_soc=OCV_SOC, ocv_v=OCV_V, r_series=0.01, soc=0.5)
+    assert np.allclose(model.voltage, 3.6)
+    bus = RecordingBus()
+    cache = RxCache([1, 2])
+    engine = BatteryEngine(bus, cache, model)
+    cache.add_hook(engine.arb_ids, engine.on_frame)
+
+    #the first complete readback only sets the time base
+    amps = [3.0 - 0.5*i for i in range(12)]
+    put_currents(cache, 1, amps, 100.0)
+    assert bus.sent == [] and engine.updates == 0
+
+    #each following one steps the box by the time since the previous one and sends its voltages
+    put_currents(cache, 1, amps, 101.0)
+    soc = 0.5 - np.array(amps)/3600
+    volts = 3.0 + 1.2*soc - 0.01*np.array(amps)
+    assert np.allclose(model.soc[0], soc, atol=1e-7) and np.allclose(model.voltage[0], volts, atol=1e-5)
+    assert np.allclose(model.soc[1], 0.5) and engine.updates == 1
+    assert bus.sent == cell_frames(1, model.voltage[0].tolist()), bus.sent
+
+    #the state of charge stays within 0..1
+    bus.sent.clear()
+    put_currents(cache, 1, 12*[3.0], 3701.0)
+    assert np.all(model.soc[0] == 0.0) and np.allclose(model.voltage[0], 3.0 - 0.03)
+    put_currents(cache, 2, 12*[-3.0], 0.0)
+    put_currents(cache, 2, 12*[-3.0], 3600.0)
+    assert np.all(model.soc[1] == 1.0) and len(bus.sent) == 6
+
+    #send errors are kept and the loop keeps running
+    bus.fail = True
+    put_currents(cache, 1, 12*[0.0], 3702.0)
+    assert isinstance(engine.error, can.CanError) and engine.updates == 3
+    bus.fail = False
+    put_currents(cache, 1, 12*[0.0], 3703.0)
+    assert engine.updates == 4
+    bus.shutdown()
+
+    try:
+        BatteryModel([1], 1.0, [0.0, 0.5, 0.5], [3.0, 3.5, 4.0])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('an OCV table with repeated SOC was accepted')
+    print('battery test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Benchmark offline decoding of a synthetic capture file: 15 boxes publishing all
+10 readback frames. Pass the number of publish cycles as the first argument.
+"""
+import os
+import sys
+import tempfile
+from time import perf_counter
+sys.path.append('src')
+import numpy as np
+import bs1200.can_frames as ff
+from bs1200.capture import CaptureReader, capture_dtype
+
+cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+boxes = list(range(1, 16))
+arb_ids = np.array([base+box for box in boxes for base in ff.base_rx_arbids], dtype='<u4')
+
+records = np.zeros(cycles*len(arb_ids), dtype=capture_dtype)
+records['arb_id'] = np.tile(arb_ids, cycles)
+records['timestamp'] = np.repeat(np.arange(cycles)*0.005, len(arb_ids))
+records['dlc'] = 8
+records['data'] = np.random.randint(0, 256, (len(records), 8), dtype=np.uint8)
+
+path = os.path.join(tempfile.gettempdir(), 'bs1200_bench_capture.bin')
+records.tofile(path)
+size_mb = os.path.getsize(path)/1e6
+try:
+    start = perf_counter()
+    reader = CaptureReader(path)
+    for signal in ('V', 'I', 'AI', 'T'):
+        decoded = reader.signals(signal)
+    assert sorted(decoded) == boxes
+    elapsed = perf_counter() - start
+    print("{:,d} frames ({:.1f} MB) decoded for {:d} boxes in {:.2f} s ({:.0f} MB/s)".format(
+          len(reader), size_mb, len(boxes), elapsed, size_mb/elapsed))
+finally:
+    del reader
+    os.remove(path)
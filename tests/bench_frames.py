@@ -0,0 +1,38 @@
+"""
+Microbenchmark of frames built per second by the can_frames builder functions
+against the precompiled FrameTemplates used by the driver. Does not need hardware.
+"""
+import sys
+from timeit import timeit
+sys.path.append('src')
+import bs1200.can_frames as ff
+
+N = 20000
+
+cases = [
+    ("cell_voltage_setpoint", lambda: ff.cell_voltage_setpoint(3, 5, 25000),
+                              lambda: ff.voltage_setpoint_frame.build(3, 5, 2.5)),
+    ("cell_voltage_set_all",  lambda: ff.cell_voltage_set_all(3, 25000),
+                              lambda: ff.voltage_set_all_frame.build(3, 2.5)),
+    ("cell_V_set_1_4",        lambda: ff.cell_V_set_1_4(3, [1.0, 2.0, 3.0, 4.0]),
+                              lambda: ff.cell_V_1_4_frame.build(3, 1.0, 2.0, 3.0, 4.0)),
+    ("cell_current_set_all",  lambda: ff.cell_current_set_all(3, 5000, 5000),
+                              lambda: ff.current_set_all_frame.build(3, 0.5, 0.5)),
+    ("cell_current_sink",     lambda: ff.cell_current_sink_setpoint(3, 5, 5000),
+                              lambda: ff.current_sink_frame.build(3, 5, 0.5)),
+    ("ao_set_1_2",            lambda: ff.ao_set_1_2(3, 10000, 20000),
+                              lambda: ff.ao_set_frame.build(3, 1.0, 2.0)),
+    ("dio_set_1_8",           lambda: ff.dio_set_1_8(3, 8*[True], 8*[True]),
+                              lambda: ff.dio_set_frame.build(3, 255, 255)),
+    ("cell_enable",           lambda: ff.cell_enable(3, 5, True),
+                              lambda: ff.cell_enable_frame.build(3, 5, True)),
+]
+
+print("{:24s} {:>14s} {:>14s} {:>8s}".format("frame", "builder fps", "template fps", "speedup"))
+for name, builder, template in cases:
+    old = builder()
+    new = template()
+    assert (old.arbitration_id, bytes(old.data)) == (new.arbitration_id, bytes(new.data)), name
+    t_old = timeit(builder, number=N)
+    t_new = timeit(template, number=N)
+    print("{:24s} {:14,.0f} {:14,.0f} {:7.1f}x".format(name, N/t_old, N/t_new, t_old/t_new))
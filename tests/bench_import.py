@@ -0,0 +1,54 @@
+"""
+Benchmark the import time of the bs1200 package and of its lazily loaded public names.
+Each statement runs in a fresh interpreter, best of --repeat runs, and the heavy third party
+modules it loaded are listed. Statements failing because an optional dependency is not installed
+(e.g. nisyscfg for ConfigTools) are reported with the error.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+STATEMENTS = [
+    'import bs1200',
+    'from bs1200 import CAN_Settings, Ethernet_Settings, Protocol',
+    'from bs1200 import BS1200',
+    'from bs1200 import BS1200Fleet',
+    'from bs1200 import ConfigTools',
+]
+HEAVY = ('can', 'numpy', 'nisyscfg', 'paramiko', 'scp')
+
+PROBE = '''
+import sys
+from time import perf_counter
+start = perf_counter()
+try:
+    exec(sys.argv[1])
+    error = ''
+except Exception as e:
+    error = '%s: %s' % (type(e).__name__, e)
+elapsed = perf_counter() - start
+loaded = [m for m in sys.argv[2].split(',') if m in sys.modules]
+print(repr((elapsed, loaded, error)))
+'''
+
+def measure(statement: str) -> tuple:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, ['src', env.get('PYTHONPATH')]))
+    out = subprocess.run([sys.executable, '-c', PROBE, statement, ','.join(HEAVY)], env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return eval(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreter runs per statement')
+    args = parser.parse_args()
+    for statement in STATEMENTS:
+        runs = [measure(statement) for _ in range(args.repeat)]
+        elapsed, loaded, error = min(runs)
+        print('{:62s} {:8.1f} ms  loads: {}'.format(statement, elapsed*1000, ', '.join(loaded) or '-'))
+        if error:
+            print('    ' + error)
+
+if __name__ == '__main__':
+    main()
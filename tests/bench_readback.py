@@ -0,0 +1,33 @@
+"""
+Benchmark per-box list readbacks against the vectorized readback matrices for 15 boxes.
+Runs without hardware over a python-can virtual bus, the receive cache is filled directly.
+"""
+import sys
+from struct import pack
+from timeit import timeit
+sys.path.append('src')
+from bs1200.driver import BS1200
+
+BOXES = list(range(1, 16))
+N = 2000
+
+def fill_cache(bs):
+    for box in BOXES:
+        for base in (288, 304, 320, 384, 400, 416, 672, 688):
+            bs.rx_cache.put(base+box, pack('<4H', 10000+box, 20000, 30000, 40000), 0.0)
+
+with BS1200(BOXES, 'bench', interface='virtual') as bs:
+    fill_cache(bs)
+    assert all(abs(a-b) < 1e-9 for a, b in zip(bs.readback_V_all(7), bs.readback_V_matrix()[6]))
+    assert all(abs(a-b) < 1e-9 for a, b in zip(bs.readback_I_all(7), bs.readback_I_matrix()[6]))
+    cases = [
+        ("readback_V_all x15",  lambda: [bs.readback_V_all(b) for b in BOXES]),
+        ("readback_V_matrix",   lambda: bs.readback_V_matrix()),
+        ("readback_I_all x15",  lambda: [bs.readback_I_all(b) for b in BOXES]),
+        ("readback_I_matrix",   lambda: bs.readback_I_matrix()),
+        ("readback_ai_all x15", lambda: [bs.readback_ai_all(b) for b in BOXES]),
+        ("readback_ai_matrix",  lambda: bs.readback_ai_matrix()),
+    ]
+    for name, fn in cases:
+        t = timeit(fn, number=N)
+        print("{:22s} {:8.2f} us/call".format(name, t/N*1e6))
@@ -0,0 +1,190 @@
+"""
+Reproducible benchmark suite of the driver hot paths, run over a python-can virtual bus (no hardware):
+    - builders:  frames built per second by each can_frames builder function and FrameTemplate
+    - receive:   cost of the notifier callback (_get_message) storing one readback frame
+    - readbacks: cost of each readback_* decode of one box and of the 15 box readback matrices
+    - setters:   setter calls per second for 1 to 15 boxes, both to return from the setters and
+                 until every frame has been received by a second virtual bus ('.delivered')
+Results are written as JSON to stdout, or to --output. Pass --compare with the JSON of a previous run
+to print the relative change of every metric (ratios above 1 are faster).
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import threading
+from struct import pack
+from time import perf_counter, sleep, strftime
+from timeit import repeat
+sys.path.append('src')
+import can
+import bs1200.can_frames as ff
+from bs1200.driver import BS1200
+
+CHANNEL = 'bs1200-bench'
+
+def rate(fn, number: int) -> float:
+    """
+    Best of 5 runs of `number` calls, in calls per second
+    """
+    return number/min(repeat(fn, number=number, repeat=5))
+
+def cost_us(fn, number: int) -> float:
+    """
+    Best of 5 runs of `number` calls, in microseconds per call
+    """
+    return min(repeat(fn, number=number, repeat=5))/number*1e6
+
+def bench_builders(n: int) -> dict:
+    cases = {
+        'cell_V_set_1_4':               lambda: ff.cell_V_set_1_4(3, [1.0, 2.0, 3.0, 4.0]),
+        'cell_V_set_5_8':               lambda: ff.cell_V_set_5_8(3, [1.0, 2.0, 3.0, 4.0]),
+        'cell_V_set_9_12':              lambda: ff.cell_V_set_9_12(3, [1.0, 2.0, 3.0, 4.0]),
+        'hil_mode_trig':                lambda: ff.hil_mode_trig(3, True),
+        'dio_set_1_8':                  lambda: ff.dio_set_1_8(3, 8*[True], 8*[False]),
+        'ao_set_1_2':                   lambda: ff.ao_set_1_2(3, 10000, 20000),
+        'config':                       lambda: ff.config(3, True, True, True, True, True, False),
+        'cell_current_set_all':         lambda: ff.cell_current_set_all(3, 5000, 5000),
+        'cell_current_sink_setpoint':   lambda: ff.cell_current_sink_setpoint(3, 5, 5000),
+        'cell_current_source_setpoint': lambda: ff.cell_current_source_setpoint(3, 5, 5000),
+        'cell_voltage_set_all':         lambda: ff.cell_voltage_set_all(3, 25000),
+        'cell_voltage_setpoint':        lambda: ff.cell_voltage_setpoint(3, 5, 25000),
+        'cell_enable_all':              lambda: ff.cell_enable_all(3, True),
+        'cell_enable':                  lambda: ff.cell_enable(3, 5, True),
+        'template.voltage_setpoint':    lambda: ff.voltage_setpoint_frame.build(3, 5, 2.5),
+        'template.cell_V_1_4':          lambda: ff.cell_V_1_4_frame.build(3, 1.0, 2.0, 3.0, 4.0),
+        'template.current_set_all':     lambda: ff.current_set_all_frame.build(3, 0.5, 0.5),
+        'template.dio_set':             lambda: ff.dio_set_frame.build(3, 255, 0),
+    }
+    return {name: rate(fn, n) for name, fn in cases.items()}
+
+def fill_cache(bs):
+    for box in bs.box_ids:
+        for base in ff.base_rx_arbids:
+            bs.rx_cache.put(base+box, pack('<4H', 10000+box, 20000, 30000, 40000), 0.0)
+
+def bench_receive(bs, n: int) -> dict:
+    msg = can.Message(arbitration_id=288+7, data=pack('<4H', 1, 2, 3, 4), is_extended_id=False)
+    untracked = can.Message(arbitration_id=1234, data=bytes(8), is_extended_id=False)
+    return {'_get_message': cost_us(lambda: bs._get_message(msg), n),
+            '_get_message.untracked_id': cost_us(lambda: bs._get_message(untracked), n)}
+
+def bench_readbacks(bs, n: int) -> dict:
+    cases = {
+        'readback_cell_V':      lambda: bs.readback_cell_V(7, 5),
+        'readback_V_all':       lambda: bs.readback_V_all(7),
+        'readback_cell_I':      lambda: bs.readback_cell_I(7, 5),
+        'readback_I_all':       lambda: bs.readback_I_all(7),
+        'readback_ai_all':      lambda: bs.readback_ai_all(7),
+        'readback_dio':         lambda: bs.readback_dio(7),
+        'query_system_status':  lambda: bs.query_system_status(7, False),
+        'readback_V_matrix':    lambda: bs.readback_V_matrix(),
+        'readback_I_matrix':    lambda: bs.readback_I_matrix(),
+        'readback_ai_matrix':   lambda: bs.readback_ai_matrix(),
+    }
+    return {name: cost_us(fn, n) for name, fn in cases.items()}
+
+class Sink(object):
+    """
+    Second virtual bus counting the frames sent by the driver
+    """
+    def __init__(self):
+        self.bus = can.Bus(interface='virtual', channel=CHANNEL)
+        self.frames = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            if self.bus.recv(0.05) is not None:
+                self.frames += 1
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.bus.shutdown()
+
+def bench_setters(n: int) -> dict:
+    results = {}
+    volts = [i/4 for i in range(12)]
+    for boxes in (1, 2, 4, 8, 15):
+        box_ids = list(range(1, boxes+1))
+        cases = {
+            'set_cell_V':  (lambda bs, b, i: bs.set_cell_V(b, i % 12 + 1, 2.5), 1),
+            'set_V_all':   (lambda bs, b, i: bs.set_V_all(b, 2.5), 1),
+            'set_cells_V': (lambda bs, b, i: bs.set_cells_V(b, volts), 3),
+            'set_I_all':   (lambda bs, b, i: bs.set_I_all(b, 0.5, 0.5), 1),
+            'dio_set':     (lambda bs, b, i: bs.dio_set(b, 8*[True], 8*[True]), 1),
+        }
+        sink = Sink()
+        with BS1200(list(box_ids), CHANNEL, interface='virtual') as bs:
+            for name, (setter, frames) in cases.items():
+                calls = max(n//boxes, 1)*boxes
+                sent_times, delivered_times = [], []
+                for run in range(3):
+                    sent = sink.frames
+                    start = perf_counter()
+                    for i in range(calls//boxes):
+                        for b in box_ids:
+                            setter(bs, b, i)
+                    sent_times.append(perf_counter() - start)
+                    while sink.frames < sent + calls*frames and perf_counter() - start < 10:
+                        sleep(0.0005)
+                    delivered_times.append(perf_counter() - start)
+                results['%s.%d_boxes' % (name, boxes)] = calls/min(sent_times)
+                results['%s.%d_boxes.delivered' % (name, boxes)] = calls/min(delivered_times)
+        sink.close()
+    return results
+
+def metadata() -> dict:
+    try:
+        revision = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                                  text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ''
+    return {'time': strftime('%Y-%m-%dT%H:%M:%S'), 'revision': revision, 'python': platform.python_version(),
+            'python-can': can.__version__, 'platform': platform.platform()}
+
+def compare(results: dict, baseline: dict):
+    """
+    Print the ratio of every metric against `baseline`, oriented so that values above 1 are faster
+    """
+    for group in ('builders', 'receive', 'readbacks', 'setters'):
+        lower_is_better = group in ('receive', 'readbacks')
+        for name, value in results[group].items():
+            old = baseline.get(group, {}).get(name)
+            if old:
+                ratio = old/value if lower_is_better else value/old
+                print('{:10s} {:42s} {:6.2f}x'.format(group, name, ratio), file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='JSON results file, defaults to stdout')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    parser.add_argument('--quick', action='store_true', help='fewer iterations, for smoke tests')
+    args = parser.parse_args()
+    n = 2000 if args.quick else 20000
+
+    results = {'meta': metadata(), 'units': {'builders': 'frames/s', 'receive': 'us/call',
+                                             'readbacks': 'us/call', 'setters': 'calls/s'}}
+    results['builders'] = bench_builders(n)
+    with BS1200(list(range(1, 16)), CHANNEL, interface='virtual') as bs:
+        fill_cache(bs)
+        results['receive'] = bench_receive(bs, n)
+        results['readbacks'] = bench_readbacks(bs, n)
+    results['setters'] = bench_setters(n//10)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Measures setpoint commands per second sent over the Ethernet TCP command transport
+to a local socket stand-in for a BS1200, which counts the 18 byte command records it receives.
+Does not need hardware. Pass the command interval in milliseconds as the first argument (default 0).
+"""
+import socket
+import sys
+import threading
+from time import perf_counter
+sys.path.append('src')
+from bs1200 import BS1200, Ethernet_Settings
+from bs1200.ethernet import UDP_RECORD_SIZE
+
+interval_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 0
+N = 20000
+
+server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+server.bind(('127.0.0.1', 0))
+server.listen(1)
+received = {'bytes': 0, 'reads': 0}
+
+def stand_in():
+    conn, _ = server.accept()
+    while True:
+        data = conn.recv(1 << 16)
+        if not data:
+            break
+        received['bytes'] += len(data)
+        received['reads'] += 1
+    conn.close()
+
+listener = threading.Thread(target=stand_in, daemon=True)
+listener.start()
+eth = Ethernet_Settings('127.0.0.1', server.getsockname()[1], interval_ms, 0, 5)
+
+with BS1200([1], None, ethernet={1: eth}) as bs:
+    start = perf_counter()
+    for i in range(N):
+        bs.set_cell_V(1, i % 12 + 1, (i % 500)/100)
+    queued = perf_counter() - start
+    bs.bus.flush_tx_buffer()
+    elapsed = perf_counter() - start
+    unit = bs.bus.connections[0]
+    writes = unit.writes
+listener.join(5)
+server.close()
+records = received['bytes'] // UDP_RECORD_SIZE
+assert records == N, records
+print("{:,d} commands queued in {:.3f} s ({:,.0f}/s), written in {:.3f} s ({:,.0f}/s)".format(
+      N, queued, N/queued, elapsed, N/elapsed))
+print("{:,d} sendall() writes, {:.1f} commands per write, interval {:g} ms".format(writes, N/writes, interval_ms))
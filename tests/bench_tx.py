@@ -0,0 +1,71 @@
+"""
+Benchmark bursty multi-threaded setter calls over a python-can virtual bus (no hardware), sending
+from the calling threads and through the transmit thread started by start_tx_thread().
+Reports the setter calls per second and the delivered frames per second seen by a second virtual bus.
+"""
+import sys
+import threading
+from time import perf_counter, sleep
+sys.path.append('src')
+import can
+from bs1200.driver import BS1200
+
+CHANNEL = 'bench-tx'
+BOXES = list(range(1, 9))
+THREADS = 4
+BURSTS = 50
+BURST = 20
+
+class Sink(object):
+    """
+    Second virtual bus counting the frames sent by the driver
+    """
+    def __init__(self):
+        self.bus = can.Bus(interface='virtual', channel=CHANNEL)
+        self.frames = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            if self.bus.recv(0.05) is not None:
+                self.frames += 1
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.bus.shutdown()
+
+def burst(bs, boxid: int):
+    for _ in range(BURSTS):
+        for ch in range(BURST):
+            bs.set_cell_V(boxid, ch % 12 + 1, 2.5)
+        sleep(0.001)
+
+def run(bs, sink) -> tuple:
+    sent = sink.frames
+    total = THREADS*BURSTS*BURST
+    threads = [threading.Thread(target=burst, args=(bs, BOXES[i % len(BOXES)])) for i in range(THREADS)]
+    start = perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    called = perf_counter() - start
+    while sink.frames < sent + total and perf_counter() - start < 30:
+        sleep(0.0005)
+    return total/called, (sink.frames - sent)/(perf_counter() - start)
+
+def main():
+    sink = Sink()
+    with BS1200(list(BOXES), CHANNEL, interface='virtual') as bs:
+        direct = max(run(bs, sink) for _ in range(3))
+        bs.start_tx_thread()
+        queued = max(run(bs, sink) for _ in range(3))
+    sink.close()
+    for name, (calls, delivered) in (('caller threads', direct), ('tx thread', queued)):
+        print('{:16s} {:10.0f} calls/s {:10.0f} frames/s delivered'.format(name, calls, delivered))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Check the acceptance filters of the configured boxes and changing the boxes of a running driver.
+A second virtual bus stands in for the units and sends the cell voltage readbacks of every box,
+only the configured ones must reach the receive cache. Does not need hardware.
+"""
+import struct
+import sys
+from time import perf_counter, sleep
+sys.path.append('src')
+import can
+import numpy as np
+import bs1200.can_frames as ff
+from bs1200.driver import BS1200
+
+CHANNEL = 'box-ids-test'
+
+def accepted(filters: list, arb_id: int) -> bool:
+    return any(arb_id & f['can_mask'] == f['can_id'] & f['can_mask'] for f in filters)
+
+def check_filters():
+    for boxids in ([1], [2, 3], [1, 4, 9, 15], list(range(1, 15)), list(range(1, 16))):
+        filters = ff.acceptance_filters(boxids)
+        expected = set(base+box for base in ff.base_rx_arbids for box in boxids)
+        if len(boxids) == 15:
+            expected.update(ff.base_rx_arbids) #Box ID 0 is never assigned
+        wrong = [a for a in range(2048) if accepted(filters, a) != (a in expected)]
+        assert wrong == [], (boxids, wrong[:10])
+        assert all(f['can_id'] & ~f['can_mask'] & 0x7FF == 0 for f in filters)
+    assert len(ff.acceptance_filters(list(range(1, 16)))) <= len(ff.base_rx_arbids)
+
+def send_volts(peer: can.BusABC, boxes: range, volts: float):
+    raw = int(round(volts*10000))
+    for box in boxes:
+        for base in (288, 304, 320):
+            peer.send(can.Message(arbitration_id=base+box, data=struct.pack('<4H', *4*[raw]), is_extended_id=False))
+
+def wait_volts(bs: BS1200, boxid: int, volts: float) -> bool:
+    deadline = perf_counter() + 2
+    while perf_counter() < deadline:
+        if np.allclose(bs.readback_V_all(boxid), volts):
+            return True
+        sleep(0.005)
+    return False
+
+def check_driver():
+    peer = can.Bus(interface='virtual', channel=CHANNEL)
+    with BS1200([1, 2], CHANNEL, interface='virtual') as bs:
+        history = bs.enable_history(100)
+        monitor = bs.enable_rx_monitor(1000, 'ignore')
+        kept = bs.add_alarm(2, 'V', high=4.0)
+        bs.add_alarm(1, 'V', high=4.0)
+        send_volts(peer, range(1, 16), 2.0)
+        assert wait_volts(bs, 1, 2.0) and wait_volts(bs, 2, 2.0)
+
+        bs.set_box_ids([3, 2])
+        assert bs.box_ids == [2, 3] and bs.rx_cache.box_ids == [2, 3]
+        assert bs.readback_V_all(1) is None and np.all(np.isnan(bs.readback_V_all(2)))
+        #history and monitoring restart for the new boxes, alarm rules of served boxes are kept
+        assert bs.telemetry is not history and bs.telemetry.capacity == 100
+        assert sorted(set(box for box, _ in bs.telemetry.rings)) == [2, 3]
+        assert bs.monitor is not monitor and not monitor._thread.is_alive()
+        assert bs.monitor.action == 'ignore' and bs.monitor.arb_ids[0] == 256+2
+        assert bs.alarm_monitor.rules == [kept]
+        send_volts(peer, range(1, 16), 4.5)
+        assert wait_volts(bs, 2, 4.5) and wait_volts(bs, 3, 4.5)
+        assert bs.active_alarms() == [(2, 'V', ch) for ch in range(1, 13)]
+        assert len(bs.history(3, 'V')[0]) == 1
+        try:
+            bs.set_box_ids([2, 16])
+        except IndexError:
+            pass
+        else:
+            raise AssertionError('Box ID 16 was accepted')
+        assert bs.box_ids == [2, 3]
+    peer.shutdown()
+
+def main():
+    check_filters()
+    check_driver()
+    print('box ids test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Check the Ethernet transports against a local stand-in for a BS1200: commands are counted as they
+arrive over TCP, and cell voltage readbacks are reported over UDP every 10 ms. A setter called with
+wait=True must only return once its command has reached the unit, and commands queued while the
+TCP connection is down must be written once it is back. Does not need hardware.
+"""
+import socket
+import struct
+import sys
+import threading
+from time import perf_counter, sleep
+sys.path.append('src')
+from bs1200 import BS1200, Ethernet_Settings
+from bs1200.ethernet import TcpUnit, UDP_RECORD_SIZE, record_codec
+
+INTERVAL_MS = 200
+
+class StandIn(object):
+    """
+    Accepts one command connection and reports cell voltage readbacks of Box ID 1 to `udp_port`
+    """
+    def __init__(self, udp_port: int):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_port = udp_port
+        self.commands = 0
+        self.running = True
+        self.threads = [threading.Thread(target=self._commands, daemon=True),
+                        threading.Thread(target=self._report, daemon=True)]
+        for t in self.threads:
+            t.start()
+
+    def _commands(self):
+        conn, _ = self.server.accept()
+        received = 0
+        while True:
+            data = conn.recv(1 << 16)
+            if not data:
+                break
+            received += len(data)
+            self.commands = received // UDP_RECORD_SIZE
+        conn.close()
+
+    def _report(self):
+        data = struct.pack('<4H', *4*[25000])
+        datagram = b''.join(record_codec.pack(base+1, False, 0, data) for base in (288, 304, 320))
+        while self.running:
+            self.udp.sendto(datagram, ('127.0.0.1', self.udp_port))
+            sleep(0.01)
+
+    def close(self):
+        self.running = False
+        self.threads[1].join()
+        self.udp.close()
+        self.server.close()
+
+def free_port(kind) -> int:
+    s = socket.socket(socket.AF_INET, kind)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def check_wait():
+    udp_port = free_port(socket.SOCK_DGRAM)
+    unit = StandIn(udp_port)
+    eth = Ethernet_Settings('127.0.0.1', unit.port, INTERVAL_MS, udp_port, 10)
+    with BS1200([1], None, readback_timeout_ms=500, ethernet={1: eth}) as bs:
+        #the first command is written right away, the next one a whole interval later
+        assert bs.set_cell_V(1, 1, 2.5) and bs.tcp.flush(1, 1.0)
+        start = perf_counter()
+        assert bs.set_cell_V(1, 2, 2.5, wait=True)
+        elapsed = perf_counter() - start
+        assert unit.commands == 2, 'wait=True returned %.1f ms after the call, before the command was written' % (elapsed*1000)
+        assert elapsed > INTERVAL_MS/2000, elapsed
+        #a command that cannot be written within the readback timeout is not reported as verified
+        bs.readback_timeout = 0.05
+        bs.set_cell_V(1, 3, 2.5)
+        assert not bs.set_cell_V(1, 4, 2.5, wait=True)
+        assert bs.tcp.flush(1, 1.0) and unit.commands == 4
+        stats = bs.tcp.stats()['127.0.0.1:%d' % unit.port]
+        assert (stats['records'], stats['pending'], stats['dropped']) == (4, 0, 0), stats
+    unit.close()
+
+def check_reconnect():
+    #nothing listens on the port yet: the records stay queued until the connection can be opened
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    port = server.getsockname()[1]
+    tcp = TcpUnit('127.0.0.1', port, 0, retry_ms=20)
+    assert tcp.error is not None
+    records = [record_codec.pack(1281, False, 0, bytes(8)) for _ in range(3)]
+    for record in records:
+        tcp.put(record)
+    assert not tcp.flush(0.1)
+    server.listen(1)
+    assert tcp.flush(2.0) and tcp.error is None
+    conn, _ = server.accept()
+    conn.settimeout(1.0)
+    data = b''
+    while len(data) < len(records)*UDP_RECORD_SIZE:
+        data += conn.recv(1 << 16)
+    assert data == b''.join(records) and tcp.dropped == 0
+    tcp.close()
+    conn.close()
+    server.close()
+    #records still unwritten when the connection is closed are counted as dropped
+    tcp = TcpUnit('127.0.0.1', port, 0, retry_ms=20)
+    for record in records:
+        tcp.put(record)
+    tcp.close()
+    assert tcp.dropped == len(records) and tcp.records == 0
+
+def main():
+    check_wait()
+    check_reconnect()
+    print('ethernet test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Check that BS1200Fleet fan-out commands the right values on every channel. Two virtual channels
+serve the same Box IDs, each unit is given its own cell voltages, and the channels' transmit threads
+send them at the same time. Every frame received on a channel must carry the values of the unit
+it is addressed to. Does not need hardware.
+"""
+import sys
+from time import perf_counter, sleep
+sys.path.append('src')
+from virtual_peer import Peer
+import numpy as np
+import bs1200.can_frames as ff
+from bs1200.fleet import BS1200Fleet
+
+CHANNELS = ('fleet-a', 'fleet-b')
+BOXES = (1, 2)
+ROUNDS = 3000
+
+def main():
+    units = {'%s-%d' % (channel, box): (channel, box) for channel in CHANNELS for box in BOXES}
+    names = list(units)
+    #distinct, exactly representable voltages for every unit
+    values = np.array([[(i*12 + cell) / 64 for cell in range(12)] for i in range(len(names))])
+    expected = {channel: {} for channel in CHANNELS}
+    for name, row in zip(names, values):
+        channel, box = units[name]
+        for i, template in enumerate(ff.cell_V_frames):
+            frame = template.build(box, *row[4*i:4*i+4])
+            expected[channel][frame.arbitration_id] = bytes(frame.data)
+
+    peers = {channel: Peer(channel) for channel in CHANNELS}
+    #switch threads often so the channels' transmit threads interleave while building frames
+    sys.setswitchinterval(1e-6)
+    with BS1200Fleet(units, interface='virtual') as fleet:
+        for _ in range(ROUNDS):
+            fleet.set_cells_V(values)
+        total = ROUNDS*len(BOXES)*3
+        deadline = perf_counter() + 10
+        while any(len(p.frames) < total for p in peers.values()) and perf_counter() < deadline:
+            sleep(0.01)
+        #setter arguments are passed positionally after the method name, names only by keyword
+        assert fleet.fan_out('set_V_all', 0.5) == dict.fromkeys(names, True)
+        assert fleet.fan_out('set_V_all', 0.25, names=names[:1]) == {names[0]: True}
+        counts = {channel: total + len(BOXES) + (channel == CHANNELS[0]) for channel in CHANNELS}
+        deadline = perf_counter() + 10
+        while any(len(p.frames) < counts[c] for c, p in peers.items()) and perf_counter() < deadline:
+            sleep(0.01)
+    set_all = {box: bytes(ff.voltage_set_all_frame.build(box, 0.5).data) for box in BOXES}
+    for channel, peer in peers.items():
+        peer.close()
+        assert len(peer.frames) == counts[channel], (channel, len(peer.frames), counts[channel])
+        assert sorted(peer.frames[total:total+2]) == [(ff.voltage_set_all_frame.base_id + box, set_all[box]) for box in BOXES]
+        wrong = sum(data != expected[channel].get(arb_id) for arb_id, data in peer.frames[:total])
+        assert wrong == 0, '%d of %d frames on %s carried another unit\'s values' % (wrong, total, channel)
+    print('fleet test passed')
+
+if __name__ == '__main__':
+    main()
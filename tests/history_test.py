@@ -0,0 +1,69 @@
+"""
+Check the readback history rings against cycles stored in a RxCache: rows start on the first frame
+of a signal, carry the other frames' values forward, wrap around at the capacity and stay contiguous.
+Does not need hardware.
+"""
+import struct
+import sys
+sys.path.append('src')
+import numpy as np
+from bs1200.rx_cache import RxCache
+from bs1200.history import History
+
+def put_volts(cache: RxCache, boxid: int, volts: list, timestamp: float, frames: tuple = (0, 1, 2)):
+    raw = [int(round(v*10000)) for v in volts]
+    for f in frames:
+        cache.put((288, 304, 320)[f] + boxid, struct.pack('<4H', *raw[4*f:4*f+4]), timestamp + f*0.001)
+
+def main():
+    cache = RxCache([1, 2])
+    history = History(cache, capacity=4)
+    cache.add_hook(history.arb_ids, history.on_frame)
+    times, values = history.get(1, 'V')
+    assert times.shape == (0,) and values.shape == (0, 12)
+
+    #one row per cycle, timestamped by the signal's first frame
+    for k in range(3):
+        put_volts(cache, 1, [k + ch/100 for ch in range(12)], 10.0 + k)
+    times, values = history.get(1, 'V')
+    assert np.allclose(times, [10.0, 11.0, 12.0])
+    assert np.allclose(values, [[k + ch/100 for ch in range(12)] for k in range(3)])
+    assert history.get(2, 'V')[0].shape == (0,)
+
+    #a cycle missing frames carries the previous values of their channels forward
+    put_volts(cache, 1, 12*[5.0], 13.0, frames=(0,))
+    times, values = history.get(1, 'V')
+    assert np.allclose(values[-1], 4*[5.0] + [2 + ch/100 for ch in range(4, 12)])
+
+    #the ring keeps the latest `capacity` rows in order, as one contiguous view
+    for k in range(4, 7):
+        put_volts(cache, 1, 12*[float(k)], 10.0 + k)
+    times, values = history.get(1, 'V')
+    assert np.allclose(times, [13.0, 14.0, 15.0, 16.0]) and np.allclose(values[1:, 0], [4.0, 5.0, 6.0])
+    assert np.shares_memory(values, history.rings[(1, 'V')].values) and values.flags['C_CONTIGUOUS']
+    times, values = history.get(1, 'V', seconds=1.5)
+    assert np.allclose(times, [15.0, 16.0]) and values.shape == (2, 12)
+
+    #temperatures and analog inputs are scaled to engineering units
+    cache.put(256+2, bytes([16, 20, 30, 40]), 20.0)
+    cache.put(672+2, struct.pack('<4H', 10000, 20000, 30000, 40000), 20.1)
+    assert np.allclose(history.get(2, 'T')[1], [[20, 30, 40]])
+    assert np.allclose(history.get(2, 'AI')[1][0, :4], [1.0, 2.0, 3.0, 4.0])
+
+    for args in ((3, 'V'), (1, 'DIO')):
+        try:
+            history.get(*args)
+        except KeyError:
+            pass
+        else:
+            raise AssertionError('history of %s was returned' % (args,))
+    try:
+        History(cache, capacity=0)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('a history without capacity was accepted')
+    print('history test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Check the setpoint to readback latency statistics without hardware: a second virtual bus
+stands in for the unit and publishes cell voltage readbacks. Setpoints to different cells
+sent back to back must each be measured, a newer setpoint to the same cell supersedes the
+older one, and setpoints that never converge are counted as timeouts.
+"""
+import sys
+import struct
+from time import sleep
+sys.path.append('src')
+import can
+from bs1200.driver import BS1200
+
+CHANNEL = 'latency-test'
+
+def readback(peer, boxid: int, volts: list):
+    for i, base in enumerate((288, 304, 320)):
+        data = struct.pack('<4H', *[int(round(v*10000)) for v in volts[4*i:4*i+4]])
+        peer.send(can.Message(arbitration_id=base+boxid, data=data, is_extended_id=False))
+    sleep(0.05)
+
+def main():
+    peer = can.Bus(interface='virtual', channel=CHANNEL)
+    with BS1200([1], CHANNEL, interface='virtual') as bs:
+        bs.enable_latency_stats(timeout_s=0.3)
+        #burst writes to different cells are each matched to their own readback
+        bs.set_cell_V(1, 1, 2.0)
+        bs.set_cell_V(1, 2, 2.5)
+        bs.set_cell_V(1, 9, 3.0)
+        volts = 12*[0.0]
+        volts[0] = 2.0
+        readback(peer, 1, volts)
+        volts[1], volts[8] = 2.5, 3.0
+        readback(peer, 1, volts)
+        stats = bs.stats()
+        assert stats[(1, 'set_cell_V')]['count'] == 3 and stats['superseded'] == 0, stats
+
+        #a newer setpoint to one of its cells supersedes the set-all setpoint
+        bs.set_V_all(1, 1.0)
+        bs.set_cell_V(1, 3, 1.5)
+        assert bs.stats()['superseded'] == 1
+        volts = 12*[1.0]
+        volts[2] = 1.5
+        readback(peer, 1, volts)
+        assert bs.stats()[(1, 'set_cell_V')]['count'] == 4
+
+        #readbacks that never reach the setpoint time out
+        bs.set_cell_V(1, 4, 4.0)
+        sleep(0.35)
+        readback(peer, 1, volts)
+        assert bs.stats()['timeouts'] == 1
+    peer.shutdown()
+    print('latency test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Check the receive monitor against frames stored in a RxCache at a known rate: one readback frame of
+box 1 is fed every 10 ms, then stopped. Its rate, gaps, stale and fresh events and the stale readback
+actions are checked, every other frame must stay stale. Does not need hardware.
+"""
+import sys
+import threading
+import warnings
+from time import perf_counter, sleep
+sys.path.append('src')
+from bs1200.rx_cache import RxCache
+from bs1200.monitor import RxMonitor, StaleReadbackError, FRAME_BITS
+
+ARB_ID = 288+1
+INTERVAL = 0.01
+
+def feed(cache: RxCache, seconds: float):
+    start = perf_counter()
+    k = 0
+    while perf_counter() - start < seconds:
+        cache.put(ARB_ID, bytes(8), perf_counter())
+        k += 1
+        sleep(max(start + k*INTERVAL - perf_counter(), 0))
+
+def main():
+    cache = RxCache([1, 2])
+    events = []
+    monitor = RxMonitor(cache, stale_after=0.05, callback=lambda arb_id, stale, age: events.append((arb_id, stale)),
+                        rate_window=0.2)
+    try:
+        #frames never received are stale
+        assert monitor.stale == set(monitor.arb_ids) and len(monitor.arb_ids) == 20
+        try:
+            monitor.check([ARB_ID])
+        except StaleReadbackError as e:
+            assert 'never received' in str(e), e
+        else:
+            raise AssertionError('a frame never received passed the check')
+
+        feed(cache, 0.6)
+        monitor.check([ARB_ID])
+        assert events == [(ARB_ID, False)], events
+        assert monitor.stale == set(monitor.arb_ids) - {ARB_ID}
+        stats = monitor.stats()[ARB_ID]
+        assert 50 <= stats['count'] <= 61, stats
+        assert 60 < stats['rate_hz'] < 120 and stats['max_gap'] < 0.05 and not stats['stale'], stats
+        assert abs(monitor.bus_load() - stats['rate_hz']*FRAME_BITS/1e6) < 1e-12
+        assert all(rate == 0.0 for arb_id, rate in monitor.rates().items() if arb_id != ARB_ID)
+
+        #once the frame stops it goes stale, the actions select how readbacks report it
+        sleep(0.15)
+        assert events == [(ARB_ID, False), (ARB_ID, True)], events
+        try:
+            monitor.check([ARB_ID])
+        except StaleReadbackError:
+            pass
+        else:
+            raise AssertionError('a stale frame passed the check')
+        monitor.action = 'warn'
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            monitor.check([ARB_ID])
+        assert len(caught) == 1 and issubclass(caught[0].category, RuntimeWarning)
+        monitor.action = 'ignore'
+        monitor.check([ARB_ID])
+
+        #a failing callback is kept in `error` and does not stop the monitor
+        def fail(arb_id, stale, age):
+            raise RuntimeError('callback failed')
+        monitor.callback = fail
+        feeder = threading.Thread(target=feed, args=(cache, 0.1))
+        feeder.start()
+        feeder.join()
+        assert isinstance(monitor.error, RuntimeError) and monitor._thread.is_alive()
+    finally:
+        monitor.close()
+    try:
+        RxMonitor(cache, action='retry')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('an invalid action was accepted')
+    print('monitor test passed')
+
+if __name__ == '__main__':
+    main()
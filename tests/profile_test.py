@@ -0,0 +1,20 @@
+"""
+Plays a 1 Hz sine drive cycle on all 12 cells of Box ID 1 at 100 rows per second
+and prints the achieved timing reported by the ProfilePlayer.
+"""
+import numpy as np
+import bs1200
+
+rate_hz = 100
+t = np.arange(10*rate_hz)/rate_hz
+cycle = 2.5 + 1.0*np.sin(2*np.pi*t)
+profile = np.repeat(cycle[:, None], 12, axis=1)
+
+with bs1200.BS1200([1], 'PCAN_USBBUS1', 1000000) as bs:
+	bs.set_I_all(1, 0.5, 0.5)
+	bs.cell_enable_all(1, True, True)
+	player = bs.play_profile({1: profile}, rate_hz)
+	player.join()
+	print(player.stats())
+	bs.set_V_all(1, 0.0)
+	bs.cell_enable_all(1, False)
@@ -0,0 +1,185 @@
+"""
+Check the frame codecs, the receive cache and the driver's readback methods against known frames.
+A second virtual bus stands in for the unit and publishes readback cycles with known payloads.
+Does not need hardware.
+"""
+import sys
+import struct
+from time import sleep
+sys.path.append('src')
+import can
+import numpy as np
+import bs1200.can_frames as ff
+from bs1200.rx_cache import RxCache, FRAME_SIZE
+from bs1200.stream import decode_readback, decode_snapshot
+from bs1200.driver import BS1200
+
+CHANNEL = 'readback-test'
+
+#known readback values, cycle_frames() returns one publish cycle of a box as (arbitration ID, payload) in the order the unit sends them
+VOLTS = [0.5*i for i in range(1, 13)]
+AMPS = [0.1*i - 0.6 for i in range(12)]
+AI = [0.25*i for i in range(8)]
+def cycle_frames(boxid: int, fan: int = 16, temps: tuple = (25, 30, 35)) -> list:
+    raw_v = [int(round(v*10000)) for v in VOLTS]
+    raw_i = [int(round((i + 3.2768)*10000)) for i in AMPS]
+    raw_ai = [int(round(v*10000)) for v in AI]
+    return [(256+boxid, bytes([fan, *temps])),
+            (288+boxid, struct.pack('<4H', *raw_v[0:4])),
+            (304+boxid, struct.pack('<4H', *raw_v[4:8])),
+            (320+boxid, struct.pack('<4H', *raw_v[8:12])),
+            (384+boxid, struct.pack('<4H', *raw_i[0:4])),
+            (400+boxid, struct.pack('<4H', *raw_i[4:8])),
+            (416+boxid, struct.pack('<4H', *raw_i[8:12])),
+            (640+boxid, bytes([0b10100101])),
+            (672+boxid, struct.pack('<4H', *raw_ai[0:4])),
+            (688+boxid, struct.pack('<4H', *raw_ai[4:8]))]
+
+def close(a, b, tol: float = 1e-9) -> bool:
+    return np.allclose(np.asarray(a, dtype=float), np.asarray(b, dtype=float), atol=tol, rtol=0)
+
+def check_codecs():
+    #transmit frames, templates and builder functions give the same known payloads
+    frame = ff.voltage_setpoint_frame.build(3, 5, 2.5)
+    assert (frame.arbitration_id, bytes(frame.data)) == (1299, bytes([4, 0xA8, 0x61]))
+    old = ff.cell_voltage_setpoint(3, 5, 25000)
+    assert (old.arbitration_id, bytes(old.data)) == (1299, bytes([4, 0xA8, 0x61]))
+    frame = ff.current_set_all_frame.build(1, 0.5, 0.25)
+    assert (frame.arbitration_id, bytes(frame.data)) == (1153, struct.pack('<2H', 5000, 2500))
+    frame = ff.cell_V_1_4_frame.build(2, 1.0, 2.0, 3.0, 4.5)
+    assert (frame.arbitration_id, bytes(frame.data)) == (162, struct.pack('<4e', 1.0, 2.0, 3.0, 4.5))
+    frame = ff.cell_enable_frame.build(4, 12, True)
+    assert (frame.arbitration_id, bytes(frame.data)) == (1364, bytes([11, 1]))
+    assert ff.codecs['cell_voltage_setpoint'].decode(bytes([4, 0xA8, 0x61])) == (5, 2.5)
+
+    #readback frames decode to engineering values
+    frames = dict(cycle_frames(2))
+    assert ff.rx_codecs[256].decode(frames[258]) == (16, 25, 30, 35)
+    assert close(ff.rx_codecs[304].decode(frames[306]), VOLTS[4:8])
+    assert close(ff.rx_codecs[400].decode(frames[402]), AMPS[4:8])
+    assert close(ff.rx_codecs[688].decode(frames[690]), AI[4:8])
+    readback = decode_readback(1.0, 642, frames[642])
+    assert readback.signal == 'DIO' and readback.values == (True, False, True, False, False, True, False, True)
+    readback = decode_readback(1.0, 322, frames[322])
+    assert (readback.boxid, readback.signal, readback.channel) == (2, 'V', 9) and close(readback.values, VOLTS[8:])
+
+def check_cache():
+    cache = RxCache([2, 5])
+    assert cache.put(1024+2, bytes(3), 1.0) == -1 #transmit ID
+    assert cache.put(288+7, bytes(8), 1.0) == -1 #unconfigured box
+    hooked = []
+    cache.add_hook([304+5], lambda arb_id, slot, timestamp: hooked.append((arb_id, slot, timestamp)))
+    frames = cycle_frames(5)
+    for i, (arb_id, data) in enumerate(frames):
+        slot = cache.put(arb_id, data, 10.0 + i)
+        assert slot == cache.slot(arb_id) and slot >= 0
+        assert bytes(cache[arb_id][:len(data)]) == data
+    assert hooked == [(309, cache.slot(309), 12.0)]
+    assert cache.timestamp(304+5) == 12.0 and cache.sequence([304+5, 288+2]) == [1, 0]
+    #payloads longer than a classic frame are truncated to the slot
+    cache.put(288+2, bytes(range(12)), 20.0)
+    assert bytes(cache[288+2]) == bytes(range(FRAME_SIZE))
+    #one complete cycle was published for box 5, none for box 2
+    cycle, timestamp, record = cache.snapshot(5)
+    assert (cycle, timestamp) == (1, 10.0)
+    snapshot = decode_snapshot(cycle, timestamp, record)
+    assert snapshot.status == (16, 25, 30, 35)
+    assert close(snapshot.V, VOLTS) and close(snapshot.I, AMPS) and close(snapshot.AI, AI)
+    assert snapshot.DIO == (True, False, True, False, False, True, False, True)
+    assert cache.snapshot(2) is None
+
+def tagged_cycle(boxid: int, tag: int, skip: tuple = ()) -> list:
+    """
+    Publish cycle whose temperatures and raw channel values all equal `tag`, without the frames of `skip`
+    """
+    return [(base+boxid, bytes([16, tag, tag, tag]) if base == 256 else 
+                         bytes([tag]) if base == 640 else struct.pack('<4H', *4*[tag]))
+            for base in ff.base_rx_arbids if base not in skip]
+
+def snapshot_tags(cache, boxid: int) -> set:
+    cycle, timestamp, record = cache.snapshot(boxid)
+    snapshot = decode_snapshot(cycle, timestamp, record)
+    tags = set(snapshot.status[1:])
+    for signal, values in (('V', snapshot.V), ('I', snapshot.I), ('AI', snapshot.AI)):
+        layout = ff.channel_layout(signal)
+        tags.update(int(round((v - layout.offset)/layout.scale)) for v in values)
+    return tags
+
+def check_cycles():
+    #the cache starts receiving in the middle of cycle 1: snapshots never mix two cycles
+    cache = RxCache([4])
+    frames = tagged_cycle(4, 1)[2:] + tagged_cycle(4, 2) + tagged_cycle(4, 3)[:5]
+    for i, (arb_id, data) in enumerate(frames):
+        cache.put(arb_id, data, float(i))
+        if i < len(frames) - 13:
+            assert cache.snapshot(4) is None, 'partial first cycle was published'
+    cycle, timestamp, _ = cache.snapshot(4)
+    assert (cycle, timestamp) == (1, float(len(tagged_cycle(4, 1)) - 2))
+    assert snapshot_tags(cache, 4) == {2}
+    #a cycle missing its status frame is not published, the next complete one is
+    for tag, skip in ((4, (256,)), (5, ())):
+        for arb_id, data in tagged_cycle(4, tag, skip):
+            cache.put(arb_id, data, 100.0 + tag)
+    assert cache.snapshot(4)[0] == 3 and snapshot_tags(cache, 4) == {5}
+    #AI broadcasts disabled: the published frames come from one cycle, AI keeps its last values
+    for tag in (6, 7):
+        for arb_id, data in tagged_cycle(4, tag, skip=(672, 688)):
+            cache.put(arb_id, data, 100.0 + tag)
+    assert snapshot_tags(cache, 4) == {5, 7}
+    #enabled again: AI is expected in every cycle from the second one on
+    for tag in (8, 9):
+        for arb_id, data in tagged_cycle(4, tag):
+            cache.put(arb_id, data, 100.0 + tag)
+    assert snapshot_tags(cache, 4) == {9}
+
+def check_driver():
+    peer = can.Bus(interface='virtual', channel=CHANNEL)
+    with BS1200([2, 3], CHANNEL, interface='virtual') as bs:
+        #nothing received yet: no made-up readings
+        assert np.isnan(bs.readback_V_all(2)).all() and np.isnan(bs.readback_cell_I(2, 1))
+        assert np.isnan(bs.readback_ai_matrix()).all() and np.isnan(bs.readback_I_matrix([3])).all()
+        assert bs.query_system_status(2, printout=False) is None and bs.readback_dio(2) is None
+        #only the first voltage frame of box 2 received
+        arb_id, data = cycle_frames(2)[1]
+        peer.send(can.Message(arbitration_id=arb_id, data=data, is_extended_id=False))
+        for _ in range(200):
+            if bs.rx_cache.sequence([arb_id]) == [1]:
+                break
+            sleep(0.005)
+        volts = bs.readback_V_all(2)
+        assert close(volts[:4], VOLTS[:4]) and np.isnan(volts[4:]).all()
+        assert close(bs.readback_cell_V(2, 4), VOLTS[3]) and np.isnan(bs.readback_cell_V(2, 5))
+        matrix = bs.readback_V_matrix()
+        assert close(matrix[0, :4], VOLTS[:4]) and np.isnan(matrix[0, 4:]).all() and np.isnan(matrix[1]).all()
+        for arb_id, data in cycle_frames(2) + cycle_frames(3, fan=0, temps=(70, 71, 72)):
+            peer.send(can.Message(arbitration_id=arb_id, data=data, is_extended_id=False))
+        last = [688+2, 688+3]
+        for _ in range(200):
+            if bs.rx_cache.sequence(last) == [1, 1]:
+                break
+            sleep(0.005)
+        assert bs.rx_cache.sequence(last) == [1, 1]
+        assert bs.readback_dio(2) == [True, False, True, False, False, True, False, True]
+        assert close(bs.readback_V_all(2), VOLTS)
+        assert close(bs.readback_cell_V(2, 7), VOLTS[6])
+        assert close(bs.readback_I_all(2), AMPS)
+        assert close(bs.readback_cell_I(2, 12), AMPS[11])
+        assert close(bs.readback_ai_all(2), AI) and close(bs.readback_ai_v(2, 3), AI[2])
+        assert close(bs.readback_V_matrix([3, 2]), [VOLTS, VOLTS])
+        assert close(bs.readback_I_matrix(), [AMPS, AMPS])
+        assert close(bs.readback_ai_matrix([2]), [AI])
+        assert bs.query_system_status(2, printout=False) == [25, 30, 35]
+        assert bs.query_system_status(3, printout=False) == [70, 71, 72]
+        snapshot = bs.readback_snapshot(3)
+        assert snapshot.cycle == 1 and snapshot.status == (0, 70, 71, 72) and close(snapshot.V, VOLTS)
+    peer.shutdown()
+
+def main():
+    check_codecs()
+    check_cache()
+    check_cycles()
+    check_driver()
+    print('readback test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Exercise automatic bus-off recovery and reconnection without hardware. FaultyBus is a python-can
+virtual bus with injectable faults: 'busoff' makes status() report PCAN bus-off and send() fail,
+'unplug' also fails receiving and reopening until the adapter is plugged back in. While `broken`
+is set every send fails, also on a reopened bus. Each FaultyBus records the PCAN parameters set on
+its channel through a stand-in for the PCAN-Basic API.
+A second virtual bus stands in for the unit and checks that the HIL mode and setpoints are sent
+again after each recovery.
+"""
+import sys
+import threading
+from time import perf_counter, sleep
+sys.path.append('src')
+import can
+from can.interfaces.pcan import basic as pcan_basic
+from can.interfaces.pcan import pcan
+from can.interfaces.virtual import VirtualBus
+from bs1200.driver import BS1200
+
+CHANNEL = 'bs1200-faulty'
+
+class PcanBasicStandIn(object):
+    def __init__(self):
+        self.values = {}
+
+    def SetValue(self, handle, parameter, value):
+        #the parameters are ctypes values
+        self.values[parameter.value] = getattr(value, 'value', value)
+        return pcan_basic.PCAN_ERROR_OK
+
+    def FilterMessages(self, handle, low, high, mode):
+        return pcan_basic.PCAN_ERROR_OK
+
+class FaultyBus(VirtualBus):
+    fault = None #injected into the open bus
+    unplugged = False #reopening fails while set
+    broken = False #sends fail while set
+
+    def __init__(self, channel=None, bitrate=None, **kwargs):
+        if FaultyBus.unplugged:
+            raise can.CanInitializationError('adapter unplugged')
+        super().__init__(channel=channel, **kwargs)
+        self.m_objPCANBasic = PcanBasicStandIn()
+        self.m_PcanHandle = pcan_basic.PCAN_USBBUS1
+        FaultyBus.fault = None
+
+    def status(self) -> int:
+        if FaultyBus.fault == 'busoff':
+            return pcan_basic.PCAN_ERROR_BUSOFF
+        if FaultyBus.fault == 'unplug':
+            return pcan_basic.PCAN_ERROR_ILLHW
+        return pcan_basic.PCAN_ERROR_OK
+
+    def status_is_ok(self) -> bool:
+        return self.status() == pcan_basic.PCAN_ERROR_OK
+
+    def send(self, msg, timeout=None):
+        if FaultyBus.broken:
+            raise pcan.PcanCanOperationError('injected send failure')
+        if FaultyBus.fault is not None:
+            raise can.CanOperationError('injected %s' % FaultyBus.fault)
+        super().send(msg, timeout)
+
+    def _recv_internal(self, timeout):
+        if FaultyBus.fault == 'unplug':
+            raise can.CanOperationError('adapter unplugged')
+        return super()._recv_internal(timeout)
+
+class Unit(object):
+    """
+    Records the frames received by the simulated unit
+    """
+    def __init__(self):
+        self.bus = can.Bus(interface='virtual', channel=CHANNEL)
+        self.frames = []
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            msg = self.bus.recv(0.02)
+            if msg is not None:
+                self.frames.append((msg.arbitration_id, bytes(msg.data)))
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.bus.shutdown()
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = perf_counter() + timeout
+    while not condition():
+        if perf_counter() > deadline:
+            return False
+        sleep(0.005)
+    return True
+
+def main():
+    unit = Unit()
+    with BS1200([1], CHANNEL, interface=FaultyBus) as bs:
+        recovery = bs.enable_auto_recovery(interval_ms=10, retry_ms=50)
+        bs.hil_mode(1, True)
+        bs.set_V_all(1, 3.0)
+        bs.set_cell_V(1, 5, 2.5)
+        assert wait_for(lambda: len(unit.frames) == 3)
+        expected = list(unit.frames)
+
+        #bus-off: the channel is reopened and the settings sent again
+        unit.frames.clear()
+        FaultyBus.fault = 'busoff'
+        assert wait_for(lambda: recovery.recoveries == 1), recovery.stats()
+        assert wait_for(lambda: len(unit.frames) == 3)
+        assert unit.frames == expected, unit.frames
+
+        #unplugged adapter: reopening fails until it is plugged back in
+        unit.frames.clear()
+        FaultyBus.unplugged = True
+        FaultyBus.fault = 'unplug'
+        sleep(0.2)
+        assert recovery.recoveries == 1 and recovery.failed_attempts > 0, recovery.stats()
+        FaultyBus.unplugged = False
+        assert wait_for(lambda: recovery.recoveries == 2), recovery.stats()
+        assert wait_for(lambda: len(unit.frames) == 3)
+        assert unit.frames == expected, unit.frames
+
+        #the reopened bus fails again while the settings are replayed: counted, not raised
+        assert pcan_basic.PCAN_ALLOW_ERROR_FRAMES.value not in bs.can_bus.m_objPCANBasic.values
+        bs.enable_health_monitor()
+        FaultyBus.broken = True
+        assert not bs.set_cell_V(1, 6, 1.5)
+        assert not bs.reconnect()
+        assert bs.health()['send_errors'] == 2, bs.health()
+        FaultyBus.broken = False
+        assert bs.reconnect()
+        #the reopened channel receives error frames for the health monitor again
+        assert bs.can_bus.m_objPCANBasic.values.get(pcan_basic.PCAN_ALLOW_ERROR_FRAMES.value) == pcan_basic.PCAN_PARAMETER_ON
+        assert wait_for(lambda: bs.health()['ok'])
+        bs.disable_health_monitor()
+
+        #reset() after a send error reopens the bus instead of recursing
+        FaultyBus.fault = 'busoff'
+        bs.disable_auto_recovery()
+        assert bs.reset()
+        assert bs.set_cell_V(1, 6, 1.5)
+        print(recovery.stats())
+    unit.close()
+    print('recovery test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Check that frames built from the shared FrameTemplates are never overwritten by another caller:
+two BS1200 instances on separate virtual channels set different voltages on the same Box ID
+from concurrent threads, and every frame received on a channel must carry that channel's voltage.
+Does not need hardware.
+"""
+import sys
+import threading
+from time import perf_counter, sleep
+sys.path.append('src')
+from virtual_peer import Peer
+import can
+import bs1200.can_frames as ff
+from bs1200.driver import BS1200
+
+CALLS = 20000
+VOLTS = {'template-a': 1.25, 'template-b': 3.75}
+
+def main():
+    #every build() returns a new Message
+    a = ff.voltage_set_all_frame.build(1, 1.0)
+    b = ff.voltage_set_all_frame.build(1, 2.0)
+    assert a is not b and a.data != b.data
+    assert isinstance(a, can.Message) and isinstance(a.data, bytearray)
+    assert (a.arbitration_id, a.dlc, a.is_extended_id, a.is_fd, a.is_remote_frame) == (1281, 2, False, False, False)
+    for box in (0, 16):
+        try:
+            ff.voltage_set_all_frame.build(box, 1.0)
+            assert False, 'Box ID %d accepted' % box
+        except IndexError:
+            pass
+
+    peers = {channel: Peer(channel) for channel in VOLTS}
+    drivers = {channel: BS1200([1], channel, interface='virtual') for channel in VOLTS}
+    def run(channel):
+        for _ in range(CALLS):
+            drivers[channel].set_V_all(1, VOLTS[channel])
+    threads = [threading.Thread(target=run, args=(channel,)) for channel in VOLTS]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    deadline = perf_counter() + 10
+    while any(len(p.frames) < CALLS for p in peers.values()) and perf_counter() < deadline:
+        sleep(0.01)
+    for bs in drivers.values():
+        bs.close()
+    for channel, peer in peers.items():
+        peer.close()
+        expected = (ff.voltage_set_all_frame.base_id + 1, bytes(ff.voltage_set_all_frame.build(1, VOLTS[channel]).data))
+        wrong = sum(frame != expected for frame in peer.frames)
+        assert len(peer.frames) == CALLS, (channel, len(peer.frames))
+        assert wrong == 0, '%d of %d frames on %s carried the wrong payload' % (wrong, CALLS, channel)
+    print('template test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Check the send order and error handling of the transmit thread without hardware. GatedBus records
+the frames written by the TxThread and holds the first one until released, so the frames queued
+meanwhile are sent in the order chosen by the thread. Stopping the thread of a driver on a virtual
+bus must leave its background senders on the wrapped bus.
+"""
+import gc
+import sys
+import threading
+from time import perf_counter, sleep
+sys.path.append('src')
+from virtual_peer import Peer
+import can
+import bs1200.can_frames as ff
+from bs1200.driver import BS1200
+from bs1200.transmit import TxThread
+
+class GatedBus(can.BusABC):
+    def __init__(self, fail_ids: tuple = (), **kwargs):
+        super().__init__(channel='gated', **kwargs)
+        self.gate = threading.Event()
+        self.holding = threading.Event()
+        self.fail_ids = fail_ids
+        self.sent = []
+
+    def send(self, msg, timeout=None):
+        self.holding.set()
+        self.gate.wait()
+        if msg.arbitration_id in self.fail_ids:
+            raise ValueError('injected failure')
+        self.sent.append(msg.arbitration_id)
+
+    def _recv_internal(self, timeout):
+        return None, False
+
+def run(frames: list, fail_ids: tuple = ()) -> tuple:
+    """
+    Queue `frames` behind a held frame, returns the IDs sent after it and the frames' futures
+    """
+    bus = GatedBus(fail_ids)
+    tx = TxThread(bus)
+    tx.send(ff.cell_enable_all_frame.build(15, True))
+    assert bus.holding.wait(5.0)
+    futures = [tx.submit(frame) for frame in frames]
+    bus.gate.set()
+    assert tx.flush(5.0)
+    tx.shutdown()
+    return bus.sent[1:], futures
+
+def check_stop():
+    peer = Peer('transmit-test')
+    with BS1200([1], 'transmit-test', interface='virtual') as bs:
+        bs.start_tx_thread()
+        writer = bs.enable_write_behind(1)
+        assert writer.bus is bs.tx
+        bs.stop_tx_thread()
+        assert bs.tx is None and bs.bus is bs.can_bus and writer.bus is bs.can_bus
+        #the stopped thread leaves the wrapped bus open when collected
+        gc.collect()
+        assert bs.set_cell_V(1, 1, 2.5)
+        expected = ff.voltage_setpoint_frame.build(1, 1, 2.5)
+        deadline = perf_counter() + 2
+        while not peer.frames and perf_counter() < deadline:
+            sleep(0.01)
+        assert peer.frames == [(expected.arbitration_id, bytes(expected.data))], peer.frames
+    peer.close()
+
+def main():
+    #configuration, HIL enable and voltage setpoints of one box keep their call order
+    config = ff.config(1, dio_hil_set_en=False, ao_hil_set_en=False, dio_hil_bcast_en=False,
+                       ai_1_4_bcast_en=True, ai_5_8_bcast_en=True, cal_mode=False)
+    frames = [config,
+              ff.hil_mode_frame.build(1, True),
+              ff.voltage_set_all_frame.build(1, 2.0),
+              ff.voltage_setpoint_frame.build(1, 3, 2.5),
+              ff.cell_V_1_4_frame.build(1, 1.0, 1.0, 1.0, 1.0),
+              ff.cell_V_5_8_frame.build(1, 1.0, 1.0, 1.0, 1.0),
+              ff.cell_V_9_12_frame.build(1, 1.0, 1.0, 1.0, 1.0)]
+    sent, _ = run(frames)
+    assert sent == [1025, 129, 1281, 1297, 161, 177, 193], sent
+
+    #HIL frames still go first across settings and boxes, but not across a HIL mode frame
+    frames = [ff.current_set_all_frame.build(1, 0.5, 0.5),
+              ff.config(2, False, False, False, True, True, False),
+              ff.cell_V_1_4_frame.build(1, 1.0, 1.0, 1.0, 1.0),
+              ff.cell_V_1_4_frame.build(2, 1.0, 1.0, 1.0, 1.0),
+              ff.hil_mode_frame.build(3, False),
+              ff.cell_V_1_4_frame.build(3, 1.0, 1.0, 1.0, 1.0),
+              ff.current_set_all_frame.build(3, 0.5, 0.5)]
+    sent, _ = run(frames)
+    assert sent == [161, 131, 163, 1153, 1155, 1026, 162], sent
+
+    #an unexpected exception from the bus fails only its frame's future
+    frames = [ff.voltage_set_all_frame.build(1, 2.0), ff.voltage_set_all_frame.build(2, 2.0)]
+    sent, futures = run(frames, fail_ids=(1281,))
+    assert sent == [1282], sent
+    assert isinstance(futures[0].exception(1.0), ValueError) and futures[1].result(1.0) is None
+
+    #cancelled frames are not sent
+    bus = GatedBus()
+    tx = TxThread(bus)
+    tx.send(ff.cell_enable_all_frame.build(15, True))
+    assert bus.holding.wait(5.0)
+    futures = [tx.submit(ff.voltage_set_all_frame.build(box, 2.0)) for box in (1, 2)]
+    assert futures[0].cancel()
+    bus.gate.set()
+    assert futures[1].result(5.0) is None
+    tx.shutdown()
+    assert bus.sent == [1359, 1282], bus.sent
+    check_stop()
+    print('transmit test passed')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+"""
+Stand-in for the units in the virtual bus tests: collects the frames received on one virtual channel.
+"""
+import threading
+import can
+
+class Peer(object):
+    """
+    Collects (arbitration ID, payload) of the frames received on one virtual channel
+    """
+    def __init__(self, channel: str):
+        self.bus = can.Bus(interface='virtual', channel=channel)
+        self.frames = []
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            msg = self.bus.recv(0.05)
+            if msg is not None:
+                self.frames.append((msg.arbitration_id, bytes(msg.data)))
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.bus.shutdown()
@@ -0,0 +1,128 @@
+"""
+Check the frames sent by the write-behind cache without hardware. The merging cases run on a virtual
+channel and compare the frames received by a peer with the expected ones. The races run on GatedBus,
+which holds a batch in send() until released, so setters can be called while it is in flight.
+"""
+import sys
+import threading
+from time import perf_counter, sleep
+sys.path.append('src')
+from virtual_peer import Peer
+import can
+import bs1200.can_frames as ff
+from bs1200.writebehind import WriteBehind
+
+CHANNEL = 'write-behind'
+
+class GatedBus(can.BusABC):
+    def __init__(self, **kwargs):
+        super().__init__(channel='gated', **kwargs)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.holding = threading.Event()
+        self.fail = False
+        self.sent = []
+
+    def send(self, msg, timeout=None):
+        self.holding.set()
+        self.gate.wait()
+        if self.fail:
+            raise can.CanOperationError('injected failure')
+        self.sent.append((msg.arbitration_id, bytes(msg.data)))
+
+    def _recv_internal(self, timeout):
+        return None, False
+
+def frame(template, *args) -> tuple:
+    msg = template.build(*args)
+    return (msg.arbitration_id, bytes(msg.data))
+
+def received(peer: Peer, count: int) -> list:
+    deadline = perf_counter() + 5
+    while len(peer.frames) < count and perf_counter() < deadline:
+        sleep(0.01)
+    sleep(0.05)
+    frames = list(peer.frames)
+    peer.frames.clear()
+    return frames
+
+def check_merging():
+    peer = Peer(CHANNEL)
+    bus = can.Bus(interface='virtual', channel=CHANNEL)
+    wb = WriteBehind(bus, 0.01)
+    #repeated setpoints are dropped
+    wb.set_V(1, {1: 2.5})
+    assert wb.flush()
+    wb.set_V(1, {1: 2.5})
+    wb.set_I(1, {2: 1.0}, {2: 1.0})
+    assert wb.flush()
+    wb.set_I(1, {2: 1.0}, {2: 1.0})
+    assert wb.flush()
+    assert received(peer, 3) == [frame(ff.voltage_setpoint_frame, 1, 1, 2.5),
+                                 frame(ff.current_sink_frame, 1, 2, 1.0),
+                                 frame(ff.current_source_frame, 1, 2, 1.0)]
+    assert wb.stats()['dropped'] == 2, wb.stats()
+
+    #twelve cells to nearly the same value: a set-all frame, then the cell differing from it
+    volts = {ch: 3.0 for ch in range(1, 13)}
+    volts[5] = 3.1
+    wb.set_V(1, volts)
+    assert wb.flush()
+    assert received(peer, 2) == [frame(ff.voltage_set_all_frame, 1, 3.0),
+                                 frame(ff.voltage_setpoint_frame, 1, 5, 3.1)]
+
+    #several cells of a group whose values the float16 frame carries: one 4-cell frame
+    wb.set_V(1, {1: 1.0, 2: 1.5, 3: 2.0, 4: 2.5})
+    assert wb.flush()
+    assert received(peer, 1) == [frame(ff.cell_V_1_4_frame, 1, 1.0, 1.5, 2.0, 2.5)]
+
+    #set_cells_V values are sent at float16 resolution: repeating them is a duplicate,
+    #commanding a cell its exact value afterwards is not
+    cells = [3.3001, 3.2001, 3.1001, 3.0001]
+    wb.set_V(2, dict(zip(range(1, 13), 3*cells)), half=True)
+    assert wb.flush()
+    assert received(peer, 3) == [frame(template, 2, *cells) for template in ff.cell_V_frames]
+    dropped = wb.dropped
+    wb.set_V(2, dict(zip(range(1, 13), 3*cells)), half=True)
+    assert wb.dropped == dropped + 1
+    wb.set_V(2, {1: 3.3001})
+    assert wb.flush()
+    assert received(peer, 1) == [frame(ff.voltage_setpoint_frame, 2, 1, 3.3001)]
+    wb.close()
+    bus.shutdown()
+    peer.close()
+
+def check_races():
+    bus = GatedBus()
+    wb = WriteBehind(bus, 0.001)
+    wb.set_V(1, {1: 1.0})
+    assert wb.flush()
+    #a setpoint reverting to the value sent before the batch in flight is sent after it
+    bus.gate.clear()
+    bus.holding.clear()
+    wb.set_V(1, {1: 2.0})
+    assert bus.holding.wait(5.0)
+    wb.set_V(1, {1: 1.0})
+    bus.gate.set()
+    assert wb.flush()
+    assert bus.sent == [frame(ff.voltage_setpoint_frame, 1, 1, v) for v in (1.0, 2.0, 1.0)], bus.sent
+
+    #a failed batch leaves the setpoints of the box unknown: they are sent again, even if repeated
+    bus.sent.clear()
+    bus.fail = True
+    wb.set_V(1, {1: 1.5})
+    assert not wb.flush() and wb.error is not None
+    bus.fail = False
+    wb.set_V(1, {1: 1.5})
+    assert wb.flush() and wb.error is None
+    assert bus.sent == [frame(ff.voltage_setpoint_frame, 1, 1, 1.5)], bus.sent
+    wb.close()
+    bus.shutdown()
+
+def main():
+    check_merging()
+    check_races()
+    print('write-behind test passed')
+
+if __name__ == '__main__':
+    main()